@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This script retrieves draft-eligible junior players and their statistics for
+a range of past or upcoming drafts. Season ids are resolved for each league
+and draft year, all pairs of league and season are processed in parallel
+worker processes sharing the limit of concurrent requests per host. Results
+for each pair are checkpointed, allowing an interrupted backfill to be
+resumed. Finally, results are merged into one set of JSON files per draft
+year.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import drafted_index
+import get_draft_eligible_junior_players as scraper
+import http_client
+import json_writer
+import response_cache
+
+# default location of checkpoints
+CHECKPOINT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache", "backfill")
+# default leagues to retrieve data for
+LEAGUES = ['QMJHL', 'OHL', 'WHL', 'USHL']
+
+# index of already drafted players, set up in each worker process
+ALREADY_DRAFTED = None
+# number of threads retrieving data in each worker process
+WORKER_THREADS = scraper.MAX_WORKERS
+
+
+def get_worker_limits(workers):
+    """
+    Splits the limit of concurrent requests per host and the number of
+    threads retrieving data among the specified number of worker processes.
+    Returns the number of worker processes actually used, i.e. no more than
+    concurrent requests per host are allowed, and the limits for each one.
+    """
+    workers = max(1, min(workers, http_client.MAX_REQUESTS_PER_HOST))
+    return (
+        workers, http_client.MAX_REQUESTS_PER_HOST // workers,
+        max(1, scraper.MAX_WORKERS // workers))
+
+
+def init_worker(
+        cache_path=None, offline=False, drafted_players_file=None,
+        max_requests_per_host=http_client.MAX_REQUESTS_PER_HOST,
+        threads=scraper.MAX_WORKERS):
+    """
+    Initializes worker process by setting up response cache, index of
+    already drafted players and its share of concurrent requests per host
+    and threads.
+    """
+    global ALREADY_DRAFTED, WORKER_THREADS
+
+    # limiting requests before the shared session and semaphores are set up
+    http_client.MAX_REQUESTS_PER_HOST = max_requests_per_host
+    WORKER_THREADS = threads
+    if cache_path is not None:
+        scraper.RESPONSE_CACHE = response_cache.ResponseCache(
+            cache_path, offline=offline)
+    if drafted_players_file is not None:
+        ALREADY_DRAFTED = drafted_index.DraftedPlayerIndex.load(
+            drafted_players_file)
+    else:
+        ALREADY_DRAFTED = drafted_index.DraftedPlayerIndex(dict())
+
+
+def get_checkpoint_paths(checkpoint_dir, league, draft_year):
+    """
+    Retrieves paths of checkpoint files for specified league and draft year,
+    i.e. skater and goalie results and a marker indicating completion.
+    """
+    tgt_dir = os.path.join(checkpoint_dir, str(draft_year))
+    return (
+        os.path.join(tgt_dir, "%s_skaters.json" % league.lower()),
+        os.path.join(tgt_dir, "%s_goalies.json" % league.lower()),
+        os.path.join(tgt_dir, "%s.done" % league.lower()))
+
+
+def is_completed(checkpoint_dir, league, draft_year):
+    """
+    Determines whether results for specified league and draft year have
+    already been checkpointed.
+    """
+    return os.path.isfile(
+        get_checkpoint_paths(checkpoint_dir, league, draft_year)[-1])
+
+
+def backfill_league_season(league, draft_year, checkpoint_dir):
+    """
+    Retrieves rosters and statlines for specified league and draft year and
+    checkpoints the results.
+    """
+    season = scraper.get_draft_season(draft_year, [league])
+    rosters, skater_stats, goalie_stats = scraper.retrieve_all_data(
+        [league], ALREADY_DRAFTED, max_workers=WORKER_THREADS, season=season)
+
+    skater_path, goalie_path, marker_path = get_checkpoint_paths(
+        checkpoint_dir, league, draft_year)
+    os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+    scraper.dump_to_json_file(skater_path, rosters, skater_stats)
+    scraper.dump_to_json_file(
+        goalie_path, rosters, goalie_stats, goalies=True)
+    # marking league and draft year as completed once all results are written
+    json_writer.write_file_atomically(marker_path, json.dumps({
+        'league': league,
+        'draft_year': draft_year,
+        'season_id': season.season_ids[league],
+        'skaters': len(skater_stats),
+        'goalies': len(goalie_stats),
+    }).encode('utf-8'))
+
+    return league, draft_year, len(skater_stats), len(goalie_stats)
+
+
+def merge_draft_year(draft_year, leagues, checkpoint_dir, data_dir, **kwargs):
+    """
+    Merges checkpointed results of all specified leagues for the specified
+    draft year into one set of JSON files.
+    """
+    rosters = dict()
+    skater_stats = dict()
+    goalie_stats = dict()
+
+    for league in leagues:
+        skater_path, goalie_path, _ = get_checkpoint_paths(
+            checkpoint_dir, league, draft_year)
+        league_rosters, league_skater_stats = scraper.load_from_json_file(
+            skater_path)
+        league_goalie_rosters, league_goalie_stats = (
+            scraper.load_from_json_file(goalie_path, goalies=True))
+        rosters.update(league_rosters)
+        rosters.update(league_goalie_rosters)
+        skater_stats.update(league_skater_stats)
+        goalie_stats.update(league_goalie_stats)
+
+    tgt_dir = os.path.join(data_dir, str(draft_year))
+    os.makedirs(tgt_dir, exist_ok=True)
+    scraper.dump_to_json_file(
+        os.path.join(tgt_dir, scraper.SKATER_FILE), rosters, skater_stats,
+        **kwargs)
+    scraper.dump_to_json_file(
+        os.path.join(tgt_dir, scraper.GOALIE_FILE), rosters, goalie_stats,
+        goalies=True, **kwargs)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Backfill draft-eligible junior players and their ' +
+        'stats for a range of draft years.')
+    parser.add_argument(
+        'first_year', type=int, help='First draft year to retrieve data for')
+    parser.add_argument(
+        'last_year', type=int, nargs='?',
+        help='Last draft year to retrieve data for (inclusive)')
+    parser.add_argument(
+        '--leagues', nargs='+', default=LEAGUES, choices=LEAGUES,
+        help='Leagues to retrieve data for')
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='Number of worker processes, at most the number of ' +
+        'concurrent requests per host')
+    parser.add_argument(
+        '--checkpoint-dir', default=CHECKPOINT_DIR,
+        help='Directory for checkpointed results')
+    parser.add_argument(
+        '--restart', action='store_true',
+        help='Ignore existing checkpoints and retrieve all data anew')
+    parser.add_argument(
+        '--data-dir', default=scraper.DATA_DIR,
+        help='Base directory for merged results by draft year')
+    parser.add_argument(
+        '--drafted-players-file',
+        help='JSON file with already drafted players to exclude, note ' +
+        'that this list is not restricted to drafts prior to the ' +
+        'backfilled ones')
+    parser.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help='Do not use persistent cache for data feed responses')
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='Replay data feed responses solely from persistent cache')
+    parser.add_argument(
+        '--cache-path', default=scraper.CACHE_PATH,
+        help='Location of persistent cache for data feed responses')
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='Write merged JSON files without indentation')
+    parser.add_argument(
+        '--compress', action='store_true',
+        help='Write gzip- and brotli-compressed siblings of merged files')
+    args = parser.parse_args()
+
+    draft_years = list(range(args.first_year, (
+        args.last_year or args.first_year) + 1))
+
+    cache_path = None
+    if args.use_cache or args.offline:
+        os.makedirs(
+            os.path.dirname(os.path.abspath(args.cache_path)), exist_ok=True)
+        cache_path = args.cache_path
+
+    # collecting pairs of league and draft year that still need processing
+    tasks = list()
+    for draft_year in draft_years:
+        for league in args.leagues:
+            if not args.restart and is_completed(
+                    args.checkpoint_dir, league, draft_year):
+                print("+ Skipping completed %s %d..." % (league, draft_year))
+                continue
+            tasks.append((league, draft_year))
+
+    # splitting the limit of concurrent requests per host among all workers
+    workers, max_requests_per_host, threads = get_worker_limits(args.workers)
+
+    failed = list()
+    with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker,
+            initargs=(
+                cache_path, args.offline, args.drafted_players_file,
+                max_requests_per_host, threads)
+    ) as executor:
+        futures = {
+            executor.submit(
+                backfill_league_season, league, draft_year,
+                args.checkpoint_dir): (league, draft_year) for
+            league, draft_year in tasks}
+        for future in as_completed(futures):
+            league, draft_year = futures[future]
+            try:
+                _, _, skater_cnt, goalie_cnt = future.result()
+            except Exception as e:
+                print("+ Backfill of %s %d failed: %s" % (
+                    league, draft_year, e))
+                failed.append((league, draft_year))
+                continue
+            print(
+                "+ Backfill of %s %d completed: " % (league, draft_year) +
+                "%d skaters, %d goalies" % (skater_cnt, goalie_cnt))
+
+    # merging results for draft years with all leagues completed
+    for draft_year in draft_years:
+        if all(is_completed(
+                args.checkpoint_dir, league, draft_year) for
+                league in args.leagues):
+            print("+ Merging results for %d..." % draft_year)
+            merge_draft_year(
+                draft_year, args.leagues, args.checkpoint_dir,
+                args.data_dir, compact=args.compact, compress=args.compress)
+
+    if failed:
+        print("+ %d pairs of league and draft year failed, re-run to " % len(
+            failed) + "resume from checkpoints")
+        sys.exit(1)
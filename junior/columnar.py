@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module provides a normalized, columnar representation of junior player
+data. Teams, leagues, countries and positions are stored in lookup tables and
+referenced by index, all other fields are stored column-wise with one array
+per field. A binary variant stores numeric columns as packed little-endian
+typed arrays that may be used directly by client-side typed array views.
+Both variants can be converted back to the regular record-based structure.
+"""
+
+import array
+import json
+import math
+import struct
+import sys
+
+import json_writer
+
+# version of the columnar format
+FORMAT_VERSION = 1
+# magic bytes identifying binary columnar files
+BINARY_MAGIC = b"JRCOLS01"
+# alignment (in bytes) of binary column blocks
+BINARY_ALIGNMENT = 8
+
+# fields that are normalized into lookup tables
+LOOKUP_FIELDS = ('team', 'league', 'country', 'position')
+
+# type codes of packed typed arrays, integer types ordered by size
+INT_TYPES = ('i1', 'i2', 'i4')
+FLOAT_TYPE = 'f8'
+BOOL_TYPE = 'u1'
+# according type codes of the array module
+ARRAY_TYPECODES = {
+    'i1': 'b',
+    'i2': 'h',
+    'i4': 'i',
+    FLOAT_TYPE: 'd',
+    BOOL_TYPE: 'B',
+}
+
+
+def to_columnar(records, fields, last_modified=None):
+    """
+    Converts specified records into a columnar structure using the specified
+    field list.
+    """
+    lookups = {field: list() for field in LOOKUP_FIELDS if field in fields}
+    lookup_indexes = {field: dict() for field in lookups}
+    columns = {field: list() for field in fields}
+
+    for record in records:
+        for field in fields:
+            value = record[field]
+            if field in lookups:
+                # team information is hashable as a tuple only
+                key = tuple(value) if isinstance(value, list) else value
+                if key not in lookup_indexes[field]:
+                    lookup_indexes[field][key] = len(lookups[field])
+                    lookups[field].append(value)
+                value = lookup_indexes[field][key]
+            columns[field].append(value)
+
+    return {
+        'format': 'columnar',
+        'version': FORMAT_VERSION,
+        'last_modified': last_modified,
+        'count': len(columns[fields[0]]) if fields else 0,
+        'fields': list(fields),
+        'lookups': lookups,
+        'columns': columns,
+    }
+
+
+def to_records(columnar_data):
+    """
+    Converts specified columnar structure back into a list of records, led by
+    the last modification timestamp as in the regular JSON files.
+    """
+    fields = columnar_data['fields']
+    lookups = columnar_data['lookups']
+    columns = columnar_data['columns']
+
+    records = [{'last_modified': columnar_data['last_modified']}]
+    for i in range(columnar_data['count']):
+        record = dict()
+        for field in fields:
+            value = columns[field][i]
+            if field in lookups:
+                value = lookups[field][value]
+            record[field] = value
+        records.append(record)
+
+    return records
+
+
+def get_column_type(values):
+    """
+    Determines type of packed typed array suitable for specified column
+    values. Returns None if values can not be packed without loss.
+    """
+    if not values:
+        return None
+    if all(isinstance(value, bool) for value in values):
+        return BOOL_TYPE
+    if all(
+            isinstance(value, int) and not isinstance(value, bool) for
+            value in values):
+        # using the smallest integer type able to hold all values
+        for int_type in INT_TYPES:
+            bits = array.array(ARRAY_TYPECODES[int_type]).itemsize * 8 - 1
+            if -2 ** bits <= min(values) and max(values) < 2 ** bits:
+                return int_type
+        return None
+    # missing float values are represented as NaN
+    if all(
+            value is None or isinstance(value, float) and
+            not math.isnan(value) for value in values) and any(
+                value is not None for value in values):
+        return FLOAT_TYPE
+    return None
+
+
+def pack_column(values, column_type):
+    """
+    Packs specified column values into little-endian bytes.
+    """
+    if column_type == FLOAT_TYPE:
+        values = [float('nan') if value is None else value for value in values]
+    packed = array.array(ARRAY_TYPECODES[column_type], values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_column(data, column_type):
+    """
+    Unpacks column values from specified little-endian bytes.
+    """
+    unpacked = array.array(ARRAY_TYPECODES[column_type])
+    unpacked.frombytes(data)
+    if sys.byteorder != 'little':
+        unpacked.byteswap()
+    if column_type == BOOL_TYPE:
+        return [bool(value) for value in unpacked]
+    if column_type == FLOAT_TYPE:
+        return [None if math.isnan(value) else value for value in unpacked]
+    return unpacked.tolist()
+
+
+def to_binary(columnar_data):
+    """
+    Converts specified columnar structure into its binary variant. Numeric
+    and boolean columns are stored as packed typed arrays, the remaining
+    columns are kept in the JSON header.
+    """
+    header = {
+        key: value for key, value in columnar_data.items() if
+        key != 'columns'}
+    header['columns'] = dict()
+    header['packed_columns'] = dict()
+
+    # collecting packed columns
+    blocks = list()
+    for field in columnar_data['fields']:
+        values = columnar_data['columns'][field]
+        column_type = get_column_type(values)
+        if column_type is None:
+            header['columns'][field] = values
+        else:
+            blocks.append((field, column_type, pack_column(
+                values, column_type)))
+
+    # calculating offsets of column blocks, relative to the end of the header
+    offset = 0
+    for field, column_type, block in blocks:
+        header['packed_columns'][field] = {
+            'type': column_type,
+            'offset': offset,
+            'length': len(block),
+        }
+        offset += len(block) + (-len(block) % BINARY_ALIGNMENT)
+
+    # padding header to keep column blocks aligned
+    header_bytes = json.dumps(
+        header, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    header_size = len(BINARY_MAGIC) + 4 + len(header_bytes)
+    header_bytes += b" " * (-header_size % BINARY_ALIGNMENT)
+
+    chunks = [BINARY_MAGIC, struct.pack('<I', len(header_bytes)), header_bytes]
+    for field, column_type, block in blocks:
+        chunks.append(block)
+        chunks.append(b"\0" * (-len(block) % BINARY_ALIGNMENT))
+
+    return b"".join(chunks)
+
+
+def from_binary(data):
+    """
+    Converts specified binary variant back into a columnar structure.
+    """
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError("Not a binary columnar file")
+    header_start = len(BINARY_MAGIC) + 4
+    header_length, = struct.unpack(
+        '<I', data[len(BINARY_MAGIC):header_start])
+    blocks_start = header_start + header_length
+    columnar_data = json.loads(
+        data[header_start:blocks_start].decode('utf-8'))
+
+    for field, block_info in columnar_data.pop('packed_columns').items():
+        block_start = blocks_start + block_info['offset']
+        columnar_data['columns'][field] = unpack_column(
+            data[block_start:block_start + block_info['length']],
+            block_info['type'])
+
+    return columnar_data
+
+
+def dump_columnar_file(
+        tgt_path, records, fields, last_modified=None, binary=False,
+        default=None):
+    """
+    Dumps specified records to a columnar file at the specified target
+    location, optionally using the binary variant.
+    """
+    columnar_data = to_columnar(records, fields, last_modified)
+    if binary:
+        # serializing non-JSON types, e.g. dates, before packing
+        columnar_data = json.loads(json.dumps(columnar_data, default=default))
+        content = to_binary(columnar_data)
+    else:
+        content = json.dumps(
+            columnar_data, default=default, separators=(',', ':'),
+            sort_keys=True).encode('utf-8')
+    json_writer.write_file_atomically(tgt_path, content)
+
+
+def load_columnar_file(src_path):
+    """
+    Loads records from a columnar file at the specified location, detecting
+    the binary variant automatically.
+    """
+    with open(src_path, 'rb') as src_file:
+        data = src_file.read()
+    if data.startswith(BINARY_MAGIC):
+        return to_records(from_binary(data))
+    return to_records(json.loads(data.decode('utf-8')))
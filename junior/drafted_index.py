@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module provides an index of already drafted players that allows for
+matching whole rosters against the list of drafted players retrieved by
+get_drafted_players.py. Names are normalized and broken down into character
+trigrams and a phonetic key of the last name, both of which are inverted
+to the players using them along with their dates of birth. Dates of birth
+are matched with a tolerance of a specified number of days, candidates are
+retrieved by looking up the keys of a name for each date of birth within
+tolerance and finally verified by their Levenshtein ratio.
+"""
+
+import datetime
+import json
+import os
+import pickle
+import re
+import unicodedata
+
+from collections import defaultdict
+
+import Levenshtein
+
+# version of the index structure, used to invalidate persisted indexes
+INDEX_VERSION = 2
+# default tolerance (in days) for matching dates of birth
+DOB_TOLERANCE = 1
+# minimum Levenshtein ratio for names of players with identical dates of birth
+LEVENSHTEIN_THRESHOLD = 0.8
+# minimum Levenshtein ratio for normalized names of players with dates of
+# birth that differ within the specified tolerance
+TOLERANT_LEVENSHTEIN_THRESHOLD = 0.9
+# minimum Dice coefficient of name trigrams for a candidate match
+TRIGRAM_THRESHOLD = 0.4
+
+# regular expression patterns used for name normalization
+NON_ALPHA_PATTERN = re.compile(r'[^a-z ]+')
+MULTI_SPACE_PATTERN = re.compile(r'\s+')
+VOWEL_PATTERN = re.compile(r'[aeiouy]+')
+REPEATED_CHAR_PATTERN = re.compile(r'(.)\1+')
+
+
+def normalize_name(name):
+    """
+    Normalizes specified name by removing diacritics, punctuation and
+    superfluous whitespace.
+    """
+    name = unicodedata.normalize('NFKD', name)
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = NON_ALPHA_PATTERN.sub(" ", name.lower())
+    return MULTI_SPACE_PATTERN.sub(" ", name).strip()
+
+
+def get_trigrams(normalized_name):
+    """
+    Retrieves set of character trigrams for specified normalized name.
+    """
+    padded_name = " %s " % normalized_name
+    return frozenset(
+        padded_name[i:i + 3] for i in range(len(padded_name) - 2))
+
+
+def get_phonetic_key(normalized_name):
+    """
+    Retrieves a simple phonetic key for specified normalized name, i.e. the
+    consonant skeleton of the last name component.
+    """
+    if not normalized_name:
+        return ""
+    last_name = normalized_name.split()[-1]
+    key = last_name[0] + VOWEL_PATTERN.sub("", last_name[1:])
+    return REPEATED_CHAR_PATTERN.sub(r"\1", key)
+
+
+class DraftedPlayerIndex(object):
+    """
+    An index of already drafted players using dates of birth and normalized
+    names as keys. Players are referred to by their position in the list of
+    all players, i.e. in order of their dates of birth in the source.
+    """
+
+    def __init__(self, drafted_players, dob_tolerance=DOB_TOLERANCE):
+        self.dob_tolerance = dob_tolerance
+        # list of names, normalized names and numbers of trigrams of players
+        self.players = list()
+        # inverted indexes using the ordinal of the date of birth as key
+        # along with a trigram or the phonetic key of the name, respectively
+        self.players_by_dob = defaultdict(list)
+        self.players_by_trigram = defaultdict(list)
+        self.players_by_phonetic_key = defaultdict(list)
+        for dob, players in drafted_players.items():
+            try:
+                dob_ordinal = datetime.date(
+                    *[int(token) for token in dob.split("-")]).toordinal()
+            except (TypeError, ValueError):
+                continue
+            for player in players:
+                name = player[0]
+                normalized_name = normalize_name(name)
+                trigrams = get_trigrams(normalized_name)
+                player_id = len(self.players)
+                self.players.append((name, normalized_name, len(trigrams)))
+                self.players_by_dob[dob_ordinal].append(player_id)
+                for trigram in trigrams:
+                    self.players_by_trigram[
+                        (trigram, dob_ordinal)].append(player_id)
+                self.players_by_phonetic_key[(
+                    get_phonetic_key(normalized_name), dob_ordinal)].append(
+                        player_id)
+        self.players_by_dob = dict(self.players_by_dob)
+        self.players_by_trigram = dict(self.players_by_trigram)
+        self.players_by_phonetic_key = dict(self.players_by_phonetic_key)
+
+    def __len__(self):
+        return len(self.players)
+
+    @classmethod
+    def load(cls, src_path, index_path=None, dob_tolerance=DOB_TOLERANCE):
+        """
+        Loads index for drafted players from specified JSON file, re-using a
+        persisted version of the index if it is still up-to-date.
+        """
+        if index_path is None:
+            index_path = os.path.splitext(src_path)[0] + ".index.pickle"
+
+        # fingerprinting source file and index settings
+        src_stat = os.stat(src_path)
+        fingerprint = (
+            INDEX_VERSION, src_stat.st_size, src_stat.st_mtime, dob_tolerance)
+
+        if os.path.isfile(index_path):
+            try:
+                with open(index_path, 'rb') as index_file:
+                    persisted_fingerprint, index = pickle.load(index_file)
+                if persisted_fingerprint == fingerprint:
+                    return index
+            except Exception:
+                pass
+
+        with open(src_path) as src_file:
+            index = cls(json.load(src_file), dob_tolerance)
+        with open(index_path, 'wb') as index_file:
+            pickle.dump((fingerprint, index), index_file)
+
+        return index
+
+    def match(self, player_name, player_dob):
+        """
+        Retrieves name of drafted player matching specified player name and
+        date of birth or None if no such player exists.
+        """
+        dob_ordinal = player_dob.toordinal()
+
+        # checking players with identical date of birth first
+        for player_id in self.players_by_dob.get(dob_ordinal, ()):
+            drafted_player_name = self.players[player_id][0]
+            levenshtein_ratio = Levenshtein.ratio(
+                player_name, drafted_player_name)
+            if levenshtein_ratio > LEVENSHTEIN_THRESHOLD:
+                print(
+                    "-> Already drafted player found: " +
+                    "%s vs. %s (Levenshtein ratio: %0.4f)" % (
+                        player_name, drafted_player_name, levenshtein_ratio))
+                return drafted_player_name
+
+        if not self.dob_tolerance:
+            return None
+
+        normalized_name = normalize_name(player_name)
+        trigrams = get_trigrams(normalized_name)
+        phonetic_key = get_phonetic_key(normalized_name)
+
+        # checking players with dates of birth within tolerance
+        for offset in range(1, self.dob_tolerance + 1):
+            for candidate_ordinal in (
+                    dob_ordinal - offset, dob_ordinal + offset):
+                for player_id in self.find_candidates(
+                        trigrams, phonetic_key, candidate_ordinal):
+                    drafted_player_name, drafted_normalized_name, _ = (
+                        self.players[player_id])
+                    levenshtein_ratio = Levenshtein.ratio(
+                        normalized_name, drafted_normalized_name)
+                    if levenshtein_ratio > TOLERANT_LEVENSHTEIN_THRESHOLD:
+                        print(
+                            "-> Already drafted player found: " +
+                            "%s vs. %s (Levenshtein ratio: %0.4f, " % (
+                                player_name, drafted_player_name,
+                                levenshtein_ratio) +
+                            "dates of birth %d day(s) apart)" % offset)
+                        return drafted_player_name
+
+        return None
+
+    def find_candidates(self, trigrams, phonetic_key, dob_ordinal):
+        """
+        Retrieves ids of players with the specified date of birth whose names
+        share the specified phonetic key or a sufficient part of the
+        specified trigrams, in order of their ids.
+        """
+        candidates = set(self.players_by_phonetic_key.get(
+            (phonetic_key, dob_ordinal), ()))
+
+        # counting shared trigrams to calculate Dice coefficients
+        trigram_counts = defaultdict(int)
+        for trigram in trigrams:
+            for player_id in self.players_by_trigram.get(
+                    (trigram, dob_ordinal), ()):
+                trigram_counts[player_id] += 1
+        for player_id, trigram_count in trigram_counts.items():
+            dice = 2. * trigram_count / (
+                len(trigrams) + self.players[player_id][2])
+            if dice >= TRIGRAM_THRESHOLD:
+                candidates.add(player_id)
+
+        return sorted(candidates)
+
+    def match_players(self, players):
+        """
+        Matches a batch of players, each specified by a key, full name and
+        date of birth, against the index. Returns a dictionary of keys and
+        names of matching drafted players.
+        """
+        matches = dict()
+        for key, player_name, player_dob in players:
+            drafted_player_name = self.match(player_name, player_dob)
+            if drafted_player_name is not None:
+                matches[key] = drafted_player_name
+        return matches
@@ -11,18 +11,28 @@ environments.
 # TODO: propper logging
 
 
+import argparse
+import cProfile
 import datetime
+import hashlib
 import json
 import re
 import os
+import pstats
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
-import Levenshtein
-import requests
 from dateutil.parser import parse
 
+import columnar
+import drafted_index
+import http_client
+import json_writer
 import locations
+import response_cache
+
+from run_metrics import METRICS
 
 # definition of named tuples to hold some data
 # team information
@@ -43,6 +53,11 @@ StatlineGoalie = namedtuple(
     'shots saves goals_against shutouts goals_against_average ' +
     'save_percentage wins losses ot_losses shootout_games_played ' +
     'shootout_wins shootout_losses')
+# draft-specific season information, i.e. league-specific season ids and
+# relevant dates
+DraftSeason = namedtuple(
+    'DraftSeason', 'draft_year season_ids lower_cutoff_dob ' +
+    'regular_cutoff_dob upper_cutoff_dob draft_date')
 
 # defining dates
 # lower date of birth for draft-eligible players,
@@ -94,6 +109,15 @@ TEAM_STATS_PARAMS = {
     'order_direction': '',
 }
 
+# template parameters for league-wide statistics page urls, retrieved in
+# pages of the specified size
+LEAGUE_STATS_PARAMS = {
+    **TEAM_STATS_PARAMS,
+    'team_id': 0,
+    'first': 0,
+    'limit': 500,
+}
+
 # league-specific template urls for single player pages
 PLAYER_PAGE_URLS = {
     'QMJHL': "http://theqmjhl.ca/players/%s",
@@ -118,6 +142,19 @@ SEASON_CODES = {
     'USHL': 71, #67,
 }
 
+# season information for the upcoming draft, used if no other season is
+# specified explicitly
+DEFAULT_SEASON = DraftSeason(
+    DRAFT_DATE.year, SEASON_CODES, LOWER_CUTOFF_DOB, REGULAR_CUTOFF_DOB,
+    UPPER_CUTOFF_DOB, DRAFT_DATE)
+
+# known dates of past and upcoming drafts
+DRAFT_DATES = {
+    2018: parse("Jun 22, 2018").date(),
+    2019: parse("Jun 21, 2019").date(),
+    2020: DRAFT_DATE,
+}
+
 LEAGUE_KEYS = {
     'QMJHL': 'f322673b6bcae299',
     'OHL': '2976319eb44abe94',
@@ -143,14 +180,118 @@ FEET_PATTERN = re.compile(r'(\d).?')
 # retrieve players already drafted
 DRAFTED_PLAYERS_FILE = "drafted_players_by_dobs.json"
 
+# names of result files
+SKATER_FILE = "junior_skaters.json"
+GOALIE_FILE = "junior_goalies.json"
+# suffixes of columnar result files
+COLUMNAR_SUFFIX = ".columnar.json"
+BINARY_COLUMNAR_SUFFIX = ".columnar.bin"
+# name of file containing fingerprints of team statistics, used to detect
+# changed teams in incremental mode
+FINGERPRINTS_FILE = "junior_fingerprints.json"
+# default location and names of run reports
+REPORT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "reports")
+METRICS_FILE = "junior_run_metrics.json"
+PROMETHEUS_FILE = "junior_run_metrics.prom"
+PROFILE_FILE = "junior_run.prof"
+# number of lines of profiling stats printed
+PROFILE_LINES = 30
+# base directory for season-specific result files
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# maximum number of concurrently running retrieval tasks, requests to a
+# single host are additionally limited by the shared http client
+MAX_WORKERS = 16
+
+# default location of persistent cache for data feed responses
+CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache",
+    "leaguestat_responses.sqlite")
+# persistent response cache, only used if set up explicitly
+RESPONSE_CACHE = None
+
 ###############################################################################
 
 
-def retrieve_teams(league):
+def get_draft_date(draft_year):
+    """
+    Retrieves date of the draft in the specified year, defaulting to the last
+    Friday in June for unknown drafts.
+    """
+    if draft_year in DRAFT_DATES:
+        return DRAFT_DATES[draft_year]
+    draft_date = datetime.date(draft_year, 6, 30)
+    return draft_date - datetime.timedelta(days=(draft_date.weekday() - 4) % 7)
+
+
+def retrieve_seasons(league):
+    """
+    Retrieves all seasons available for specified league.
+    """
+    print("+ Retrieving %s seasons..." % league)
+
+    # retrieving url parameters for data retrieval
+    params = {**BASE_PARAMS, **SEASON_OVERVIEW_PARAMS}
+    # updating client code and key to current league
+    params['client_code'] = LEAGUE_CODES[league]
+    params['key'] = LEAGUE_KEYS[league]
+
+    json_data = fetch_json_data_with_params(BASE_URL, params)
+    return json_data['SiteKit']['Seasons']
+
+
+def find_regular_season_id(league, draft_year):
+    """
+    Finds id of the regular season preceding the draft in the specified year
+    for the specified league.
+    """
+    # regular season names contain both years, e.g. '2019-20 Regular Season'
+    season_years = (
+        "%d-%02d" % (draft_year - 1, draft_year % 100),
+        "%d-%d" % (draft_year - 1, draft_year))
+
+    for item in retrieve_seasons(league):
+        season_name = item['season_name'].lower()
+        if str(item.get('playoff', '0')) == '1':
+            continue
+        if 'regular' not in season_name:
+            continue
+        if any(season_year in season_name for season_year in season_years):
+            return int(item['season_id'])
+
+    raise ValueError(
+        "No %s regular season found for draft year %d" % (league, draft_year))
+
+
+def get_draft_season(draft_year, leagues=None, season_ids=None):
+    """
+    Sets up season information for the draft in the specified year. Season
+    ids not specified explicitly are retrieved for all specified leagues.
+    """
+    if leagues is None:
+        leagues = list(SEASON_CODES.keys())
+    if season_ids is None:
+        season_ids = dict()
+    for league in leagues:
+        if league not in season_ids:
+            season_ids[league] = find_regular_season_id(league, draft_year)
+
+    return DraftSeason(
+        draft_year,
+        season_ids,
+        datetime.date(draft_year - 20, 1, 1),
+        datetime.date(draft_year - 19, 9, 15),
+        datetime.date(draft_year - 18, 9, 15),
+        get_draft_date(draft_year))
+
+
+def retrieve_teams(league, season=None):
     """
     Retrieves teams for specified league by downloading and evaluating a
     corresponding JSON file.
     """
+    season = season or DEFAULT_SEASON
     print("+ Retrieving %s teams..." % league)
 
     # retrieving url to team overview page for specified league
@@ -165,7 +306,7 @@ def retrieve_teams(league):
     # updating client code and key to current league
     params['client_code'] = LEAGUE_CODES[league]
     params['key'] = LEAGUE_KEYS[league]
-    params['season_id'] = SEASON_CODES[league]
+    params['season_id'] = season.season_ids[league]
 
     json_data = fetch_json_data_with_params(BASE_URL, params)
     json_data_node = json_data['SiteKit']['Teamsbyseason']
@@ -188,11 +329,12 @@ def retrieve_teams(league):
     return teams_in_league
 
 
-def retrieve_roster(team, league, already_drafted=None):
+def retrieve_roster(team, league, already_drafted=None, season=None):
     """
     Retrieves rosters for specified team and league by downloading and
     evaluating a corresponding JSON file.
     """
+    season = season or DEFAULT_SEASON
     print("+ Retrieving roster for %s (%s)..." % (team.name, league))
 
     # retrieving url to team roster page for specified league and team
@@ -202,13 +344,20 @@ def retrieve_roster(team, league, already_drafted=None):
     params['client_code'] = LEAGUE_CODES[league]
     params['key'] = LEAGUE_KEYS[league]
     params['team_id'] = team.id
-    params['season_id'] = SEASON_CODES[league]
+    params['season_id'] = season.season_ids[league]
+
+    # setting up index of already drafted players from a separate source
+    if not isinstance(already_drafted, drafted_index.DraftedPlayerIndex):
+        already_drafted = drafted_index.DraftedPlayerIndex(
+            already_drafted or dict())
 
     # setting up container for retrieved roster
     roster = dict()
     # retrieving roster JSON structure
     json_data = fetch_json_data_with_params(BASE_URL, params)
-    # iterating over each player in JSON structure
+
+    # collecting players not yet drafted according to their player pages
+    candidates = list()
     for plr in json_data['SiteKit']['Roster']:
         # skipping staff members (provided in a separate sub-list)
         if 'id' not in plr:
@@ -219,29 +368,41 @@ def retrieve_roster(team, league, already_drafted=None):
 
         # skipping player if he has already been drafted (as noted on his
         # player page)
-        if is_nhl_drafted(plr['draftinfo']):
+        if is_nhl_drafted(plr['draftinfo'], season.draft_year):
+            METRICS.increment('players_skipped_drafted')
             continue
 
         # retrieving player's date of birth
         if not plr['birthdate']:
+            METRICS.increment('players_skipped_missing_dob')
             continue
-        plr_dob = parse(plr['birthdate']).date()
+        with METRICS.stage('date_parsing'):
+            plr_dob = parse(plr['birthdate']).date()
+
+        candidates.append((plr_id, plr_dob, plr))
 
+    # matching all remaining players against list of already drafted ones
+    # from a separate source in a single batch
+    with METRICS.stage('drafted_matching'):
+        drafted_matches = already_drafted.match_players(
+            (plr_id, " ".join(
+                (plr['first_name'].strip(), plr['last_name'].strip())),
+                plr_dob) for plr_id, plr_dob, plr in candidates)
+
+    # iterating over each remaining player
+    for plr_id, plr_dob, plr in candidates:
         # skipping player if he is present in a list of already drafted ones
-        # from a separate source
-        if is_nhl_drafted_extended(
-                " ".join(
-                    (plr['first_name'].strip(), plr['last_name'].strip())),
-                plr_dob,
-                already_drafted):
-                    continue
+        if plr_id in drafted_matches:
+            METRICS.increment('players_skipped_drafted_extended')
+            continue
 
         # skipping non-draft-eligible players
-        if not is_draft_eligible(plr_dob):
+        if not is_draft_eligible(plr_dob, season):
+            METRICS.increment('players_skipped_ineligible')
             continue
 
         # calculating draft day age and retrieving overager status
-        draft_day_age, is_overager = calculate_draft_day_age(plr_dob)
+        draft_day_age, is_overager = calculate_draft_day_age(plr_dob, season)
 
         # retrieving player plage url
         plr_page_url = PLAYER_PAGE_URLS[league] % plr['id']
@@ -287,11 +448,14 @@ def retrieve_roster(team, league, already_drafted=None):
     return roster
 
 
-def retrieve_goalie_stats(team, league, roster):
+def retrieve_team_stats_data(team, league, goalies=False, season=None):
     """
-    Retrieves goalie statlines for specified team roster and league.
+    Retrieves raw JSON structure of skater or goalie statistics for specified
+    team and league.
     """
-    print("+ Retrieving goalie stats for %s (%s)..." % (team.name, league))
+    season = season or DEFAULT_SEASON
+    print("+ Retrieving %s stats for %s (%s)..." % (
+        'goalie' if goalies else 'skater', team.name, league))
 
     # retrieving url to team statistics page for specified league and team
     # retrieving url parameters for data retrieval
@@ -300,13 +464,25 @@ def retrieve_goalie_stats(team, league, roster):
     params['client_code'] = LEAGUE_CODES[league]
     params['key'] = LEAGUE_KEYS[league]
     params['team_id'] = team.id
-    params['season_id'] = SEASON_CODES[league]
-    params['type'] = 'goalies'
+    params['season_id'] = season.season_ids[league]
+    if goalies:
+        params['type'] = 'goalies'
+
+    return fetch_json_data_with_params(BASE_URL, params)
+
+
+def retrieve_goalie_stats(team, league, roster, json_data=None, season=None):
+    """
+    Retrieves goalie statlines for specified team roster and league. Already
+    retrieved team statistics may be provided as JSON structure.
+    """
+    # retrieving team statistics JSON structure
+    if json_data is None:
+        json_data = retrieve_team_stats_data(
+            team, league, goalies=True, season=season)
 
     # setting up container for retrieved team statistics
     goalie_statlines = dict()
-    # retrieving team statistics JSON structure
-    json_data = fetch_json_data_with_params(BASE_URL, params)
     # iterating over each player in JSON structure
     for plr in json_data['SiteKit']['Statviewtype']:
 
@@ -324,65 +500,23 @@ def retrieve_goalie_stats(team, league, roster):
         if roster[plr_id].position != 'G':
             continue
 
-        # setting up dictionary for raw stats
-        raw_stat_line = dict()
-        # retrieving all relevant stats
-        for field in StatlineGoalie._fields[2:]:
-            if field in ('goals_against_average', 'save_percentage'):
-                if plr[field]:
-                    value = float(plr[field])
-                else:
-                    value = None
-            # formatting minutes played using a default format of mmmm:ss
-            elif field == 'minutes_played':
-                value = "%d:%02d" % (int(plr['seconds_played']) / 60,
-                                     int(plr['seconds_played']) % 60)
-            else:
-                value = int(plr[field])
-            raw_stat_line[field] = value
-
         # setting up statline object and adding it to roster stats
-        goalie_statlines[plr_id] = StatlineGoalie(
-            plr_id, "",
-            raw_stat_line['games_played'],
-            raw_stat_line['seconds_played'],
-            raw_stat_line['minutes_played'],
-            raw_stat_line['shots'],
-            raw_stat_line['saves'],
-            raw_stat_line['goals_against'],
-            raw_stat_line['shutouts'],
-            raw_stat_line['goals_against_average'],
-            raw_stat_line['save_percentage'],
-            raw_stat_line['wins'],
-            raw_stat_line['losses'],
-            raw_stat_line['ot_losses'],
-            raw_stat_line['shootout_games_played'],
-            raw_stat_line['shootout_wins'],
-            raw_stat_line['shootout_losses'])
+        goalie_statlines[plr_id] = create_goalie_statline(plr_id, plr)
 
     return goalie_statlines
 
 
-def retrieve_stats(team, league, roster):
+def retrieve_stats(team, league, roster, json_data=None, season=None):
     """
-    Retrieves skater statlines for specified team roster and league.
+    Retrieves skater statlines for specified team roster and league. Already
+    retrieved team statistics may be provided as JSON structure.
     """
-    print("+ Retrieving skater stats for %s (%s)..." % (team.name, league))
-
-    # retrieving url to team statistics page for specified league and team
-    # retrieving url parameters for data retrieval
-    params = {**BASE_PARAMS, **TEAM_STATS_PARAMS}
-    # modifying url parameters
-    params['client_code'] = LEAGUE_CODES[league]
-    params['key'] = LEAGUE_KEYS[league]
-    params['team_id'] = team.id
-    params['season_id'] = SEASON_CODES[league]
+    # retrieving team statistics JSON structure
+    if json_data is None:
+        json_data = retrieve_team_stats_data(team, league, season=season)
 
     # setting up container for retrieved team statistics
     roster_statlines = dict()
-    # retrieving team statistics JSON structure
-    # json_data = fetch_json_data(url)
-    json_data = fetch_json_data_with_params(BASE_URL, params)
     # iterating over each player in JSON structure
     for plr in json_data['SiteKit']['Statviewtype']:
         plr_id = "".join((league, plr['player_id'])).lower()
@@ -391,74 +525,409 @@ def retrieve_stats(team, league, roster):
         if plr_id not in roster:
             continue
 
-        # setting up dictionary for raw stats
-        raw_stat_line = dict()
-        # retrieving all relevant stats
-        for field in Statline._fields[2:]:
-            if field in ('points_per_game', 'shooting_percentage'):
+        # setting up statline objects and adding it to roster stats
+        roster_statlines[plr_id] = create_statline(plr_id, plr)
+
+    return roster_statlines
+
+
+def create_goalie_statline(plr_id, plr):
+    """
+    Creates goalie statline from specified raw data item.
+    """
+    # setting up dictionary for raw stats
+    raw_stat_line = dict()
+    # retrieving all relevant stats
+    for field in StatlineGoalie._fields[2:]:
+        if field in ('goals_against_average', 'save_percentage'):
+            if plr[field]:
                 value = float(plr[field])
             else:
-                value = int(plr[field])
-            raw_stat_line[field] = value
+                value = None
+        # formatting minutes played using a default format of mmmm:ss
+        elif field == 'minutes_played':
+            value = "%d:%02d" % (int(plr['seconds_played']) / 60,
+                                 int(plr['seconds_played']) % 60)
+        else:
+            value = int(plr[field])
+        raw_stat_line[field] = value
+
+    # setting up statline object
+    return StatlineGoalie(
+        plr_id, "",
+        raw_stat_line['games_played'],
+        raw_stat_line['seconds_played'],
+        raw_stat_line['minutes_played'],
+        raw_stat_line['shots'],
+        raw_stat_line['saves'],
+        raw_stat_line['goals_against'],
+        raw_stat_line['shutouts'],
+        raw_stat_line['goals_against_average'],
+        raw_stat_line['save_percentage'],
+        raw_stat_line['wins'],
+        raw_stat_line['losses'],
+        raw_stat_line['ot_losses'],
+        raw_stat_line['shootout_games_played'],
+        raw_stat_line['shootout_wins'],
+        raw_stat_line['shootout_losses'])
+
+
+def create_statline(plr_id, plr):
+    """
+    Creates skater statline from specified raw data item.
+    """
+    # setting up dictionary for raw stats
+    raw_stat_line = dict()
+    # retrieving all relevant stats
+    for field in Statline._fields[2:]:
+        if field in ('points_per_game', 'shooting_percentage'):
+            value = float(plr[field])
+        else:
+            value = int(plr[field])
+        raw_stat_line[field] = value
+
+    # setting up statline object
+    return Statline(
+        plr_id, "",
+        raw_stat_line['games_played'],
+        raw_stat_line['goals'],
+        raw_stat_line['assists'],
+        raw_stat_line['points'],
+        raw_stat_line['plus_minus'],
+        raw_stat_line['penalty_minutes'],
+        raw_stat_line['power_play_goals'],
+        raw_stat_line['power_play_assists'],
+        raw_stat_line['power_play_points'],
+        raw_stat_line['short_handed_goals'],
+        raw_stat_line['short_handed_assists'],
+        raw_stat_line['short_handed_points'],
+        raw_stat_line['shots'],
+        raw_stat_line['shooting_percentage'],
+        raw_stat_line['points_per_game'])
+
+
+def retrieve_league_stats(league, roster, goalies=False, season=None):
+    """
+    Retrieves skater or goalie statlines for all teams of the specified league
+    using paged league-wide requests. Statlines are matched against the
+    specified roster of all teams in the league.
+    """
+    season = season or DEFAULT_SEASON
+    print("+ Retrieving league-wide %s stats for %s..." % (
+        'goalie' if goalies else 'skater', league))
 
-        # setting up statline objects and adding it to roster stats
-        roster_statlines[plr_id] = Statline(
-            plr_id, "",
-            raw_stat_line['games_played'],
-            raw_stat_line['goals'],
-            raw_stat_line['assists'],
-            raw_stat_line['points'],
-            raw_stat_line['plus_minus'],
-            raw_stat_line['penalty_minutes'],
-            raw_stat_line['power_play_goals'],
-            raw_stat_line['power_play_assists'],
-            raw_stat_line['power_play_points'],
-            raw_stat_line['short_handed_goals'],
-            raw_stat_line['short_handed_assists'],
-            raw_stat_line['short_handed_points'],
-            raw_stat_line['shots'],
-            raw_stat_line['shooting_percentage'],
-            raw_stat_line['points_per_game'])
+    # retrieving url parameters for data retrieval
+    params = {**BASE_PARAMS, **LEAGUE_STATS_PARAMS}
+    # modifying url parameters
+    params['client_code'] = LEAGUE_CODES[league]
+    params['key'] = LEAGUE_KEYS[league]
+    params['season_id'] = season.season_ids[league]
+    if goalies:
+        params['type'] = 'goalies'
+
+    # setting up container for retrieved league statistics
+    league_statlines = dict()
+
+    while True:
+        # retrieving current page of league statistics JSON structure
+        json_data = fetch_json_data_with_params(BASE_URL, params)
+        json_data_node = json_data['SiteKit']['Statviewtype']
+        # iterating over each player in JSON structure
+        for plr in json_data_node:
+            # skipping item if it doesn't represent an actual player
+            if 'player_id' not in plr:
+                continue
+
+            plr_id = "".join((league, plr['player_id'])).lower()
+            # skipping players not available in specified roster,
+            # e.g. non-draft-eligible players
+            if plr_id not in roster:
+                continue
+
+            # skipping statlines compiled with teams other than the one the
+            # player has been registered with in the roster
+            if 'team_id' in plr and (
+                    int(plr['team_id']) != roster[plr_id].team.id):
+                continue
+
+            if goalies:
+                # skipping players that are not actually goalies
+                if roster[plr_id].position != 'G':
+                    continue
+                league_statlines[plr_id] = create_goalie_statline(
+                    plr_id, plr)
+            else:
+                league_statlines[plr_id] = create_statline(plr_id, plr)
 
-    return roster_statlines
+        # stopping if the last page has been retrieved
+        if len(json_data_node) < params['limit']:
+            break
+        params['first'] += params['limit']
 
+    # an empty first page indicates that league-wide statistics are not
+    # provided for the specified league
+    if not params['first'] and not json_data_node:
+        raise ValueError("Empty league-wide statistics")
 
-def is_nhl_drafted(draft_info):
+    return league_statlines
+
+
+def retrieve_league_stats_with_fallback(
+        league, teams, roster, goalies=False, season=None):
+    """
+    Retrieves skater or goalie statlines for all teams of the specified league
+    using league-wide requests, falling back to team-specific requests if
+    league-wide statistics are not available.
+    """
+    try:
+        return retrieve_league_stats(league, roster, goalies, season)
+    except Exception as e:
+        print("+ League-wide stats for %s not available: %s" % (league, e))
+
+    print("+ Falling back to team-specific stats for %s..." % league)
+    league_statlines = dict()
+    for team in teams:
+        # restricting roster to players registered with current team
+        team_roster = {
+            plr_id: plr for plr_id, plr in roster.items() if
+            plr.team.id == team.id}
+        if goalies:
+            league_statlines.update(retrieve_goalie_stats(
+                team, league, team_roster, season=season))
+        else:
+            league_statlines.update(retrieve_stats(
+                team, league, team_roster, season=season))
+
+    return league_statlines
+
+
+def retrieve_team_data(team, league, already_drafted=None, season=None):
+    """
+    Retrieves roster, skater and goalie statlines for specified team and
+    league.
+    """
+    roster = retrieve_roster(team, league, already_drafted, season)
+    skater_stats = retrieve_stats(team, league, roster, season=season)
+    goalie_stats = retrieve_goalie_stats(team, league, roster, season=season)
+
+    return roster, skater_stats, goalie_stats
+
+
+def retrieve_all_data(
+        leagues, already_drafted=None, max_workers=MAX_WORKERS,
+        league_stats=False, season=None):
+    """
+    Concurrently retrieves teams, rosters and statlines for all specified
+    leagues and the specified season. Results are merged in the same order as
+    in a sequential run. If so specified, statlines are retrieved by
+    league-wide requests instead of team-specific ones.
+    """
+    # setting up result containers for rosters and player stats
+    rosters = dict()
+    skater_stats = dict()
+    goalie_stats = dict()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # retrieving teams for all leagues at once
+        league_teams = [
+            sorted(list(teams.values())) for teams in executor.map(
+                retrieve_teams, leagues, [season] * len(leagues))]
+
+        if not league_stats:
+            # retrieving data for all teams, keeping futures in the order of
+            # a sequential run to allow for identical merging
+            team_futures = list()
+            for league, teams in zip(leagues, league_teams):
+                for team in teams:
+                    team_futures.append(executor.submit(
+                        retrieve_team_data, team, league, already_drafted,
+                        season))
+
+            for future in team_futures:
+                team_roster, team_skater_stats, team_goalie_stats = (
+                    future.result())
+                rosters.update(team_roster)
+                skater_stats.update(team_skater_stats)
+                goalie_stats.update(team_goalie_stats)
+
+            return rosters, skater_stats, goalie_stats
+
+        # retrieving rosters for all teams
+        roster_futures = list()
+        for league, teams in zip(leagues, league_teams):
+            roster_futures.append([
+                executor.submit(
+                    retrieve_roster, team, league, already_drafted,
+                    season) for team in teams])
+
+        # retrieving league-wide statistics as soon as all rosters of a
+        # league are available
+        stats_futures = list()
+        for league, teams, team_futures in zip(
+                leagues, league_teams, roster_futures):
+            league_roster = dict()
+            for future in team_futures:
+                league_roster.update(future.result())
+            rosters.update(league_roster)
+            stats_futures.append((
+                executor.submit(
+                    retrieve_league_stats_with_fallback,
+                    league, teams, league_roster, season=season),
+                executor.submit(
+                    retrieve_league_stats_with_fallback,
+                    league, teams, league_roster, goalies=True,
+                    season=season)))
+
+        for skater_future, goalie_future in stats_futures:
+            skater_stats.update(skater_future.result())
+            goalie_stats.update(goalie_future.result())
+
+    return rosters, skater_stats, goalie_stats
+
+
+def calculate_team_fingerprint(skater_json_data, goalie_json_data):
+    """
+    Calculates fingerprint for specified raw team statistics using all
+    fields that are retained in the resulting statlines.
+    """
+    items = list()
+    for json_data, fields in (
+            (skater_json_data, Statline._fields[2:]),
+            (goalie_json_data, StatlineGoalie._fields[2:])):
+        for plr in json_data['SiteKit']['Statviewtype']:
+            items.append([plr.get('player_id', '')] + [
+                str(plr.get(field, '')) for field in fields])
+    items.sort()
+
+    return hashlib.sha1(json.dumps(items).encode('utf-8')).hexdigest()
+
+
+def retrieve_team_data_incremental(
+        team, league, already_drafted=None, previous_data=None,
+        previous_fingerprint=None, season=None):
+    """
+    Retrieves roster, skater and goalie statlines for specified team, league
+    and season unless the fingerprint of the team's current statistics matches
+    the specified previous one. In this case previous roster and statlines
+    are re-used.
+    """
+    skater_json_data = retrieve_team_stats_data(team, league, season=season)
+    goalie_json_data = retrieve_team_stats_data(
+        team, league, goalies=True, season=season)
+    fingerprint = calculate_team_fingerprint(
+        skater_json_data, goalie_json_data)
+
+    # re-using previous data if team statistics haven't changed
+    if previous_data is not None and fingerprint == previous_fingerprint:
+        print("+ Re-using unchanged data for %s (%s)..." % (
+            team.name, league))
+        roster, skater_stats, goalie_stats = previous_data
+        return roster, skater_stats, goalie_stats, fingerprint
+
+    roster = retrieve_roster(team, league, already_drafted, season)
+    skater_stats = retrieve_stats(
+        team, league, roster, skater_json_data, season=season)
+    goalie_stats = retrieve_goalie_stats(
+        team, league, roster, goalie_json_data, season=season)
+
+    return roster, skater_stats, goalie_stats, fingerprint
+
+
+def retrieve_all_data_incremental(
+        leagues, previous_dir, already_drafted=None, max_workers=MAX_WORKERS,
+        season=None):
+    """
+    Concurrently retrieves teams, rosters and statlines for all specified
+    leagues and the specified season, re-using previous data from the
+    specified directory for all teams whose statistics haven't changed since.
+    """
+    # loading previous rosters, stats and team fingerprints
+    previous_rosters, previous_skater_stats = load_from_json_file(
+        os.path.join(previous_dir, SKATER_FILE))
+    previous_goalie_rosters, previous_goalie_stats = load_from_json_file(
+        os.path.join(previous_dir, GOALIE_FILE), goalies=True)
+    previous_rosters.update(previous_goalie_rosters)
+    previous_fingerprints = load_fingerprints(
+        os.path.join(previous_dir, FINGERPRINTS_FILE))
+
+    # grouping previous data by team
+    previous_team_data = dict()
+    for plr_id, plr in previous_rosters.items():
+        team_key = get_team_key(plr.team, plr.league)
+        if team_key not in previous_team_data:
+            previous_team_data[team_key] = (dict(), dict(), dict())
+        team_roster, team_skater_stats, team_goalie_stats = (
+            previous_team_data[team_key])
+        team_roster[plr_id] = plr
+        if plr_id in previous_skater_stats:
+            team_skater_stats[plr_id] = previous_skater_stats[plr_id]
+        if plr_id in previous_goalie_stats:
+            team_goalie_stats[plr_id] = previous_goalie_stats[plr_id]
+
+    # setting up result containers for rosters, player stats and fingerprints
+    rosters = dict()
+    skater_stats = dict()
+    goalie_stats = dict()
+    fingerprints = dict()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # retrieving teams for all leagues at once
+        league_teams = list(executor.map(
+            retrieve_teams, leagues, [season] * len(leagues)))
+        # retrieving data for all teams, keeping futures in the order of a
+        # sequential run to allow for identical merging
+        team_futures = list()
+        for league, teams in zip(leagues, league_teams):
+            for team in sorted(list(teams.values())):
+                team_key = get_team_key(team, league)
+                # teams without previous fingerprints are retrieved anew,
+                # regardless of whether previous data is available
+                previous_data = None
+                if team_key in previous_fingerprints:
+                    previous_data = previous_team_data.get(
+                        team_key, (dict(), dict(), dict()))
+                team_futures.append((team_key, executor.submit(
+                    retrieve_team_data_incremental, team, league,
+                    already_drafted, previous_data,
+                    previous_fingerprints.get(team_key), season)))
+
+        for team_key, future in team_futures:
+            (
+                team_roster, team_skater_stats,
+                team_goalie_stats, fingerprint) = future.result()
+            rosters.update(team_roster)
+            skater_stats.update(team_skater_stats)
+            goalie_stats.update(team_goalie_stats)
+            fingerprints[team_key] = fingerprint
+
+    return rosters, skater_stats, goalie_stats, fingerprints
+
+
+def is_nhl_drafted(draft_info, draft_year=None):
     """
     Determines whether specified draft information reveals the according
-    player as already drafted by an NHL team.
+    player as already drafted by an NHL team. If a draft year is specified,
+    only drafts prior to it are taken into account.
     """
     for item in draft_info:
         if item['draft_type'] == 'NHL' and item['draft_rank']:
+            if draft_year and item.get('draft_year') and (
+                    int(item['draft_year']) >= draft_year):
+                continue
             return True
     else:
         return False
 
 
-def is_nhl_drafted_extended(player_name, player_dob, already_drafted):
-    """
-    Determines whether specified player name is present in a dictionary of
-    already drafted players using the player's date of birth as key comparator.
-    """
-    if player_dob.isoformat() in already_drafted:
-        for drafted_player_name in already_drafted[player_dob.isoformat()]:
-            drafted_player_name = drafted_player_name[0]
-            levenshtein_ratio = Levenshtein.ratio(
-                player_name, drafted_player_name)
-            if levenshtein_ratio > 0.8:
-                print(
-                    "-> Already drafted player found: " +
-                    "%s vs. %s (Levenshtein ratio: %0.4f)" % (
-                        player_name, drafted_player_name, levenshtein_ratio))
-                return True
-    return False
-
-
-def is_draft_eligible(player_dob):
+def is_draft_eligible(player_dob, season=None):
     """
     Determines whether specified date of birth is a draft-eligible one.
     """
-    if player_dob >= LOWER_CUTOFF_DOB and player_dob < UPPER_CUTOFF_DOB:
+    season = season or DEFAULT_SEASON
+    if (
+        player_dob >= season.lower_cutoff_dob and
+        player_dob < season.upper_cutoff_dob
+    ):
         return True
     else:
         return False
@@ -480,17 +949,18 @@ def convert_height(height):
         return None
 
 
-def calculate_draft_day_age(player_dob):
+def calculate_draft_day_age(player_dob, season=None):
     """
     Calculates age of player on draft day and determines whether player is
     considered an overager.
     """
-    if player_dob < REGULAR_CUTOFF_DOB:
+    season = season or DEFAULT_SEASON
+    if player_dob < season.regular_cutoff_dob:
         is_overager = True
     else:
         is_overager = False
 
-    draft_day_age = (DRAFT_DATE - player_dob).days
+    draft_day_age = (season.draft_date - player_dob).days
     draft_day_age = float(
         "%d.%03d" % (draft_day_age / 365, draft_day_age % 365))
 
@@ -511,26 +981,92 @@ def fetch_json_data_with_params(base_url, params):
     """
     Fetches JSON data using specified base url and parameters.
     """
-    req = requests.get(base_url, params=params)
-    return req.json()
+    if RESPONSE_CACHE is not None:
+        return RESPONSE_CACHE.fetch_json(base_url, params)
+    return http_client.fetch_json(base_url, params)
 
 
 def fetch_json_data(json_url):
     """
     Fetches JSON data from specified url.
     """
-    req = requests.get(json_url)
-    return req.json()
+    return http_client.fetch_json(json_url)
 
 
-def dump_to_json_file(tgt_path, dump_rosters, dump_stats, goalies=False):
+def get_team_key(team, league):
     """
-    Dumps rosters and according stats to a JSON file at the specified
-    target location.
+    Retrieves key identifying specified team in specified league.
+    """
+    return "%s%d" % (league.lower(), team.id)
+
+
+def load_from_json_file(src_path, goalies=False):
+    """
+    Loads rosters and according stats from a JSON file previously created
+    at the specified location. Returns empty containers if the file doesn't
+    exist.
     """
-    # setting up list of JSON file entries
-    json_dump_prep = list()
+    rosters = dict()
+    stats = dict()
+
+    if not os.path.isfile(src_path):
+        return rosters, stats
+
+    statline_class = StatlineGoalie if goalies else Statline
 
+    # skipping last modification timestamp
+    for data_item in json.loads(open(src_path).read())[1:]:
+        player_data = {field: data_item[field] for field in Player._fields}
+        player_data['team'] = Team(*player_data['team'])
+        player_data['dob'] = datetime.date(
+            *[int(token) for token in player_data['dob'].split("-")])
+        rosters[data_item['id']] = Player(**player_data)
+        stats[data_item['id']] = statline_class(
+            **{field: data_item[field] for field in statline_class._fields})
+
+    return rosters, stats
+
+
+def load_fingerprints(src_path):
+    """
+    Loads team fingerprints from specified JSON file. Returns an empty
+    dictionary if the file doesn't exist.
+    """
+    if not os.path.isfile(src_path):
+        return dict()
+    return json.loads(open(src_path).read())
+
+
+def dump_fingerprints(tgt_path, fingerprints):
+    """
+    Dumps team fingerprints to a JSON file at the specified target location.
+    """
+    open(tgt_path, 'w').write(
+        json.dumps(fingerprints, indent=2, sort_keys=True))
+
+
+def get_last_modified():
+    """
+    Retrieves current date and time as last modification timestamp.
+    """
+    return datetime.datetime.now().strftime("%a %b %d %Y, %H:%M CET")
+
+
+def get_data_item_fields(goalies=False):
+    """
+    Retrieves fields of data items combining player information and
+    statistics.
+    """
+    if goalies:
+        return Player._fields + StatlineGoalie._fields[1:]
+    return Player._fields + Statline._fields[1:]
+
+
+def create_data_items(dump_rosters, dump_stats, goalies=False):
+    """
+    Yields data items combining player information and according stats,
+    sorted by player id.
+    """
     for player_id in sorted(dump_stats.keys()):
         # retrieving player and according statline
         player = dump_rosters[player_id]
@@ -549,62 +1085,176 @@ def dump_to_json_file(tgt_path, dump_rosters, dump_stats, goalies=False):
             for field in Statline._fields[1:]:
                 data_item[field] = getattr(statline, field)
 
-        # adding current data item to list of all data items
-        json_dump_prep.append(data_item)
+        yield data_item
 
-    # inserting current date and time into JSON structure
-    # as last modification timestamp
-    json_dump_prep.insert(0, {
-        "last_modified": datetime.datetime.now().strftime(
-            "%a %b %d %Y, %H:%M CET")
-    })
-    # finally dumping contents to JSON file
-    open(tgt_path, 'w').write(
-        json.dumps(
-            json_dump_prep, default=json_serial, indent=2, sort_keys=True)
-    )
 
+def dump_to_json_file(
+        tgt_path, dump_rosters, dump_stats, goalies=False, compact=False,
+        compress=False):
+    """
+    Dumps rosters and according stats to a JSON file at the specified
+    target location. Data items are streamed to the file one at a time,
+    optionally without indentation and along with compressed siblings.
+    """
+    with METRICS.stage('serialization'), json_writer.JSONArrayWriter(
+            tgt_path, compact=compact, compress=compress,
+            default=json_serial) as writer:
+        # writing current date and time into JSON structure
+        # as last modification timestamp
+        writer.write({"last_modified": get_last_modified()})
 
-if __name__ == '__main__':
+        for data_item in create_data_items(dump_rosters, dump_stats, goalies):
+            writer.write(data_item)
 
+
+def dump_to_columnar_file(
+        tgt_path, dump_rosters, dump_stats, goalies=False, binary=False):
+    """
+    Dumps rosters and according stats to a columnar file at the specified
+    target location, optionally using the binary variant.
+    """
+    with METRICS.stage('serialization'):
+        columnar.dump_columnar_file(
+            tgt_path, create_data_items(dump_rosters, dump_stats, goalies),
+            get_data_item_fields(goalies), get_last_modified(), binary,
+            default=json_serial)
+
+
+def run(args):
+    """
+    Retrieves rosters and stats for all leagues and dumps them to result
+    files according to the specified command line arguments.
+    """
     leagues = ['QMJHL', 'OHL', 'WHL', 'USHL']
     skater_tgt_path = os.path.join(
-        os.path.dirname(os.path.abspath(__file__)), r"junior_skaters.json")
+        os.path.dirname(os.path.abspath(__file__)), SKATER_FILE)
     goalie_tgt_path = os.path.join(
-        os.path.dirname(os.path.abspath(__file__)), r"junior_goalies.json")
-
-    # setting up result containers for rosters and player stats
-    rosters = dict()
-    skater_stats = dict()
-    goalie_stats = dict()
+        os.path.dirname(os.path.abspath(__file__)), GOALIE_FILE)
 
     if os.path.isfile(DRAFTED_PLAYERS_FILE):
-        already_drafted = json.loads(open(DRAFTED_PLAYERS_FILE).read())
+        already_drafted = drafted_index.DraftedPlayerIndex.load(
+            DRAFTED_PLAYERS_FILE, dob_tolerance=args.dob_tolerance)
         print(
             "+ List of already drafted players " +
             "loaded from '%s'" % DRAFTED_PLAYERS_FILE)
     else:
-        already_drafted = dict()
-
-    # doing the following for each league
-    for current_league in leagues[:]:
-        # retrieving teams in current league
-        teams = retrieve_teams(current_league)
-        for current_team in sorted(list(teams.values()))[:]:
-            # retrieving roster for current team
-            team_roster = retrieve_roster(
-                current_team, current_league, already_drafted)
-            # updating container for all rosters
-            rosters.update(team_roster)
-            # retrieving player statistics for current team
-            team_skater_stats = retrieve_stats(
-                current_team, current_league, team_roster)
-            team_goalie_stats = retrieve_goalie_stats(
-                current_team, current_league, team_roster)
-            # updating container for all player statistics
-            skater_stats.update(team_skater_stats)
-            goalie_stats.update(team_goalie_stats)
+        already_drafted = drafted_index.DraftedPlayerIndex(dict())
+
+    if args.incremental:
+        # retrieving rosters and player stats for changed teams only
+        with METRICS.stage('retrieval'):
+            rosters, skater_stats, goalie_stats, fingerprints = (
+                retrieve_all_data_incremental(
+                    leagues, args.data_dir, already_drafted))
+        # updating results of previous run
+        os.makedirs(args.data_dir, exist_ok=True)
+        dump_to_json_file(
+            os.path.join(args.data_dir, SKATER_FILE), rosters, skater_stats,
+            compact=args.compact, compress=args.compress)
+        dump_to_json_file(
+            os.path.join(args.data_dir, GOALIE_FILE), rosters, goalie_stats,
+            goalies=True, compact=args.compact, compress=args.compress)
+        dump_fingerprints(
+            os.path.join(args.data_dir, FINGERPRINTS_FILE), fingerprints)
+    else:
+        # retrieving rosters and player stats for all leagues concurrently
+        with METRICS.stage('retrieval'):
+            rosters, skater_stats, goalie_stats = retrieve_all_data(
+                leagues, already_drafted, league_stats=args.league_stats)
 
     # dumping rosters and stats to JSON files
-    dump_to_json_file(skater_tgt_path, rosters, skater_stats)
-    dump_to_json_file(goalie_tgt_path, rosters, goalie_stats, goalies=True)
+    dump_to_json_file(
+        skater_tgt_path, rosters, skater_stats,
+        compact=args.compact, compress=args.compress)
+    dump_to_json_file(
+        goalie_tgt_path, rosters, goalie_stats, goalies=True,
+        compact=args.compact, compress=args.compress)
+
+    if args.columnar:
+        # dumping rosters and stats to columnar files
+        for tgt_path, stats, goalies in (
+                (skater_tgt_path, skater_stats, False),
+                (goalie_tgt_path, goalie_stats, True)):
+            tgt_base = os.path.splitext(tgt_path)[0]
+            dump_to_columnar_file(
+                tgt_base + COLUMNAR_SUFFIX, rosters, stats, goalies)
+            dump_to_columnar_file(
+                tgt_base + BINARY_COLUMNAR_SUFFIX, rosters, stats, goalies,
+                binary=True)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Retrieve draft-eligible junior players and their stats.')
+    parser.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help='Do not use persistent cache for data feed responses')
+    parser.add_argument(
+        '--offline', action='store_true',
+        help='Replay data feed responses solely from persistent cache')
+    parser.add_argument(
+        '--cache-path', default=CACHE_PATH,
+        help='Location of persistent cache for data feed responses')
+    mode_group = parser.add_mutually_exclusive_group()
+    mode_group.add_argument(
+        '--league-stats', action='store_true',
+        help='Retrieve player stats by league-wide instead of ' +
+        'team-specific requests')
+    mode_group.add_argument(
+        '--incremental', action='store_true',
+        help='Only process teams whose stats have changed since the ' +
+        'previous run')
+    parser.add_argument(
+        '--data-dir', default=os.path.join(DATA_DIR, str(DRAFT_DATE.year)),
+        help='Directory containing results of the previous run, updated ' +
+        'in incremental mode')
+    parser.add_argument(
+        '--dob-tolerance', type=int, default=drafted_index.DOB_TOLERANCE,
+        help='Tolerance (in days) for dates of birth when matching ' +
+        'already drafted players')
+    parser.add_argument(
+        '--compact', action='store_true',
+        help='Write JSON files without indentation')
+    parser.add_argument(
+        '--compress', action='store_true',
+        help='Write gzip- and brotli-compressed siblings of JSON files')
+    parser.add_argument(
+        '--columnar', action='store_true',
+        help='Additionally write columnar and binary columnar files')
+    parser.add_argument(
+        '--metrics-path', default=os.path.join(REPORT_DIR, METRICS_FILE),
+        help='Location of JSON run report')
+    parser.add_argument(
+        '--prometheus-path',
+        default=os.path.join(REPORT_DIR, PROMETHEUS_FILE),
+        help='Location of Prometheus textfile run report')
+    parser.add_argument(
+        '--profile', nargs='?', const=os.path.join(REPORT_DIR, PROFILE_FILE),
+        help='Profile run and dump profiling stats to specified location')
+    args = parser.parse_args()
+
+    if args.use_cache or args.offline:
+        os.makedirs(
+            os.path.dirname(os.path.abspath(args.cache_path)), exist_ok=True)
+        RESPONSE_CACHE = response_cache.ResponseCache(
+            args.cache_path, offline=args.offline)
+
+    METRICS.reset()
+    if args.profile:
+        # wrapping whole run in profiler
+        profiler = cProfile.Profile()
+        profiler.runcall(run, args)
+        os.makedirs(
+            os.path.dirname(os.path.abspath(args.profile)), exist_ok=True)
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(
+            PROFILE_LINES)
+    else:
+        run(args)
+
+    # dumping run reports
+    for tgt_path in (args.metrics_path, args.prometheus_path):
+        os.makedirs(os.path.dirname(os.path.abspath(tgt_path)), exist_ok=True)
+    METRICS.dump_json(args.metrics_path)
+    METRICS.dump_prometheus(args.prometheus_path)
@@ -16,10 +16,10 @@ import os
 import json
 from urllib.parse import urlparse
 
-import requests
-
 from lxml import html
 
+import http_client
+
 # base url for eliteprospects.com
 BASE_URL = "http://www.eliteprospects.com"
 # url template for draft overview pages at eliteprospects.com
@@ -34,8 +34,7 @@ def retrieve_drafted_player_links(draft_year):
     draft year.
     """
     url = "/".join((BASE_URL, DRAFT_URL_TEMPLATE % draft_year))
-    req = requests.get(url)
-    doc = html.fromstring(req.text)
+    doc = html.fromstring(http_client.fetch_text(url))
 
     # full links to player pages are present at the specified position in
     # the main table
@@ -73,9 +72,8 @@ def retrieve_drafted_player_data(player_links, existing_player_data=None):
                 "registered (%s)" % ep_id)
             continue
 
-        req = requests.get(url)
         print("+ Working on URL %d of %d (%s)" % (i, len(player_links), url))
-        doc = html.fromstring(req.text)
+        doc = html.fromstring(http_client.fetch_text(url))
 
         # retrieving full name from page title
         full_name = doc.xpath(
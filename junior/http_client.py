@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module provides a shared HTTP client for data retrieval from the hockey
+websites used by the junior scripts. Connections are pooled and kept alive,
+responses are compressed in transfer, failed requests are retried with an
+exponential backoff and unchanged resources are re-validated using
+conditional requests.
+"""
+
+import json
+import threading
+import time
+
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from run_metrics import METRICS
+
+# maximum number of concurrent requests sent to a single host, also used as
+# size of the connection pool for each host
+MAX_REQUESTS_PER_HOST = 6
+# connect and read timeouts (in seconds)
+TIMEOUT = (5, 30)
+# maximum number of retries for failed requests
+MAX_RETRIES = 5
+# base factor for exponential backoff between retries (in seconds)
+BACKOFF_FACTOR = 0.5
+# status codes that are considered transient and will trigger a retry
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+# default headers sent with each request
+DEFAULT_HEADERS = {
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive',
+}
+
+# shared session, created on first use
+SESSION = None
+SESSION_LOCK = threading.Lock()
+# per-host semaphores limiting the number of concurrent requests
+HOST_SEMAPHORES = dict()
+HOST_SEMAPHORES_LOCK = threading.Lock()
+# validators (ETag, Last-Modified) and contents of previous responses by url,
+# ordered from least to most recently used
+VALIDATED_RESPONSES = OrderedDict()
+VALIDATED_RESPONSES_LOCK = threading.Lock()
+# maximum overall size (in bytes) of contents kept for re-validation,
+# persistent caching of responses is provided by module response_cache
+MAX_VALIDATED_RESPONSES_SIZE = 32 * 1024 * 1024
+# overall size (in bytes) of contents kept for re-validation
+validated_responses_size = 0
+
+
+def get_session():
+    """
+    Retrieves shared session with pooled connections and automatic retries,
+    creating it if necessary.
+    """
+    global SESSION
+
+    with SESSION_LOCK:
+        if SESSION is None:
+            retry = Retry(
+                total=MAX_RETRIES,
+                backoff_factor=BACKOFF_FACTOR,
+                status_forcelist=RETRY_STATUS_CODES,
+                allowed_methods=frozenset(['GET']),
+                raise_on_status=False)
+            adapter = HTTPAdapter(
+                pool_connections=MAX_REQUESTS_PER_HOST,
+                pool_maxsize=MAX_REQUESTS_PER_HOST,
+                max_retries=retry)
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            SESSION = session
+        return SESSION
+
+
+def get_host_semaphore(url):
+    """
+    Retrieves semaphore limiting the number of concurrent requests to the
+    host of the specified url.
+    """
+    host = urlparse(url).netloc
+    with HOST_SEMAPHORES_LOCK:
+        if host not in HOST_SEMAPHORES:
+            HOST_SEMAPHORES[host] = threading.BoundedSemaphore(
+                MAX_REQUESTS_PER_HOST)
+        return HOST_SEMAPHORES[host]
+
+
+def get(url, params=None, etag=None, last_modified=None):
+    """
+    Sends a GET request to the specified url using the shared session. If
+    validators are specified, the request is sent as a conditional one and
+    may result in a response with status code 304 (Not Modified).
+    """
+    headers = dict()
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    # using view parameter (if available) or host to classify requests
+    view = (params or dict()).get('view') or urlparse(url).netloc
+
+    with get_host_semaphore(url), METRICS.stage('network'):
+        start = time.perf_counter()
+        try:
+            req = get_session().get(
+                url, params=params, headers=headers, timeout=TIMEOUT)
+        except Exception:
+            METRICS.record_request(
+                view, time.perf_counter() - start, 0, failed=True)
+            raise
+        METRICS.record_request(
+            view, time.perf_counter() - start, len(req.content),
+            failed=req.status_code >= 400)
+    if req.status_code != 304:
+        req.raise_for_status()
+
+    return req
+
+
+def fetch_content(url, params=None):
+    """
+    Fetches raw content and according encoding from specified url using
+    conditional requests for resources that have been retrieved before.
+    """
+    # using full url including parameters as key for previous responses
+    key = requests.Request('GET', url, params=params).prepare().url
+    with VALIDATED_RESPONSES_LOCK:
+        previous = VALIDATED_RESPONSES.get(key)
+        if previous is not None:
+            VALIDATED_RESPONSES.move_to_end(key)
+
+    if previous is None:
+        req = get(url, params)
+    else:
+        req = get(url, params, previous['etag'], previous['last_modified'])
+
+    # re-using content of previous response if resource hasn't changed
+    if req.status_code == 304 and previous is not None:
+        return previous['content'], previous['encoding']
+
+    etag = req.headers.get('ETag')
+    last_modified = req.headers.get('Last-Modified')
+    # registering content of responses that allow for re-validation
+    if etag or last_modified:
+        register_validated_response(key, {
+            'etag': etag,
+            'last_modified': last_modified,
+            'content': req.content,
+            'encoding': req.encoding,
+        })
+
+    return req.content, req.encoding
+
+
+def register_validated_response(key, response):
+    """
+    Registers specified response for re-validation by specified key,
+    evicting least recently used responses once the overall size of their
+    contents exceeds the maximum size.
+    """
+    global validated_responses_size
+
+    if len(response['content']) > MAX_VALIDATED_RESPONSES_SIZE:
+        return
+    with VALIDATED_RESPONSES_LOCK:
+        previous = VALIDATED_RESPONSES.pop(key, None)
+        if previous is not None:
+            validated_responses_size -= len(previous['content'])
+        VALIDATED_RESPONSES[key] = response
+        validated_responses_size += len(response['content'])
+        while validated_responses_size > MAX_VALIDATED_RESPONSES_SIZE:
+            _, evicted = VALIDATED_RESPONSES.popitem(last=False)
+            validated_responses_size -= len(evicted['content'])
+
+
+def fetch_json(url, params=None):
+    """
+    Fetches JSON data from specified url using optional parameters.
+    """
+    content, _ = fetch_content(url, params)
+    with METRICS.stage('json_decoding'):
+        return json.loads(content)
+
+
+def fetch_text(url, params=None):
+    """
+    Fetches text from specified url using optional parameters.
+    """
+    content, encoding = fetch_content(url, params)
+    return str(content, encoding or 'utf-8', errors='replace')
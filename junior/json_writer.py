@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module provides a streaming writer for JSON arrays. Array items are
+serialized and written one at a time, optionally along with gzip- and
+brotli-compressed siblings of the target file. All files are written to
+temporary locations first and published atomically once complete, siblings
+of previous runs that are not written anew are removed on publication.
+"""
+
+import gzip
+import json
+import os
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# permissions of published files
+FILE_MODE = 0o644
+# gzip compression level
+GZIP_LEVEL = 9
+# brotli compression quality
+BROTLI_QUALITY = 11
+# suffixes of compressed siblings of target files
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+
+
+class JSONArrayWriter(object):
+    """
+    A writer streaming items of a JSON array to a target file. Indented
+    output is identical to the one of json.dumps() with an indentation of two
+    spaces, compact output omits all optional whitespace.
+    """
+
+    def __init__(
+            self, tgt_path, compact=False, compress=False, default=None,
+            sort_keys=True):
+        self.tgt_path = tgt_path
+        self.compact = compact
+        self.default = default
+        self.sort_keys = sort_keys
+        self.item_count = 0
+
+        # setting up temporary files and according target paths
+        self.tmp_paths = list()
+        self.raw_file = self.create_tmp_file(tgt_path)
+        self.gzip_raw_file = None
+        self.gzip_file = None
+        self.brotli_file = None
+        self.brotli_compressor = None
+        if compress:
+            self.gzip_raw_file = self.create_tmp_file("%s.gz" % tgt_path)
+            self.gzip_file = gzip.GzipFile(
+                fileobj=self.gzip_raw_file, mode='wb',
+                compresslevel=GZIP_LEVEL, mtime=0)
+            if brotli is not None:
+                self.brotli_file = self.create_tmp_file("%s.br" % tgt_path)
+                self.brotli_compressor = brotli.Compressor(
+                    mode=brotli.MODE_TEXT, quality=BROTLI_QUALITY)
+
+    def __enter__(self):
+        self.write_chunk("[" if self.compact else "[\n")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.write_chunk("]" if self.compact else "\n]")
+            self.close(publish=True)
+        else:
+            self.close(publish=False)
+
+    def create_tmp_file(self, tgt_path):
+        """
+        Creates temporary file in the directory of the specified target path
+        and registers it for later publication.
+        """
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(tgt_path)),
+            prefix=".%s." % os.path.basename(tgt_path), suffix=".tmp")
+        self.tmp_paths.append((tmp_path, tgt_path))
+        return os.fdopen(tmp_fd, 'wb')
+
+    def write_chunk(self, chunk):
+        """
+        Writes specified chunk of text to target file and all compressed
+        siblings.
+        """
+        chunk = chunk.encode('utf-8')
+        self.raw_file.write(chunk)
+        if self.gzip_file is not None:
+            self.gzip_file.write(chunk)
+        if self.brotli_file is not None:
+            self.brotli_file.write(self.brotli_compressor.process(chunk))
+
+    def write(self, item):
+        """
+        Serializes specified item and writes it to the target files.
+        """
+        if self.compact:
+            chunk = json.dumps(
+                item, default=self.default, sort_keys=self.sort_keys,
+                separators=(',', ':'))
+            if self.item_count:
+                chunk = "," + chunk
+        else:
+            # indenting all lines of the serialized item by one level
+            chunk = "  " + json.dumps(
+                item, default=self.default, sort_keys=self.sort_keys,
+                indent=2).replace("\n", "\n  ")
+            if self.item_count:
+                chunk = ",\n" + chunk
+        self.write_chunk(chunk)
+        self.item_count += 1
+
+    def close(self, publish=True):
+        """
+        Closes all files and atomically moves them to their target
+        locations. Temporary files are removed if they are not published.
+        """
+        if self.brotli_file is not None:
+            self.brotli_file.write(self.brotli_compressor.finish())
+            self.brotli_file.close()
+        if self.gzip_file is not None:
+            # closing the gzip stream leaves the underlying file open
+            self.gzip_file.close()
+            self.gzip_raw_file.close()
+        self.raw_file.close()
+
+        for tmp_path, tgt_path in self.tmp_paths:
+            if publish:
+                os.chmod(tmp_path, FILE_MODE)
+                os.replace(tmp_path, tgt_path)
+            elif os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+        if publish:
+            # removing compressed siblings that would serve outdated data
+            published_paths = set(tgt_path for _, tgt_path in self.tmp_paths)
+            for suffix in COMPRESSED_SUFFIXES:
+                sibling_path = "%s%s" % (self.tgt_path, suffix)
+                if sibling_path not in published_paths and os.path.isfile(
+                        sibling_path):
+                    os.remove(sibling_path)
+
+
+def write_file_atomically(tgt_path, content):
+    """
+    Writes specified binary content to a temporary file and atomically moves
+    it to the specified target location.
+    """
+    tmp_fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(tgt_path)),
+        prefix=".%s." % os.path.basename(tgt_path), suffix=".tmp")
+    try:
+        with os.fdopen(tmp_fd, 'wb') as tmp_file:
+            tmp_file.write(content)
+        os.chmod(tmp_path, FILE_MODE)
+        os.replace(tmp_path, tgt_path)
+    except Exception:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module provides a persistent cache for responses retrieved from the
+leaguestat data feed. Cached responses are considered fresh for a view-specific
+amount of time and re-validated afterwards. The overall size of the cache is
+limited by evicting least recently used entries. In offline mode responses are
+solely replayed from the cache.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+import http_client
+
+from run_metrics import METRICS
+
+# request parameters used to identify a cached response, paging parameters
+# are included to distinguish pages of league-wide statistics
+KEY_PARAMS = (
+    'client_code', 'view', 'team_id', 'season_id', 'type', 'first', 'limit')
+
+# view-specific time (in seconds) a cached response is considered fresh
+VIEW_TTLS = {
+    'seasons': 7 * 24 * 60 * 60,
+    'teamsbyseason': 7 * 24 * 60 * 60,
+    'roster': 12 * 60 * 60,
+    'statviewtype': 60 * 60,
+}
+# time (in seconds) a cached response of any other view is considered fresh
+DEFAULT_TTL = 60 * 60
+# maximum overall size of cached response bodies (in bytes)
+MAX_CACHE_SIZE = 256 * 1024 * 1024
+# time (in seconds) to wait for locks held by other processes
+SQLITE_TIMEOUT = 30
+
+
+class CacheMissError(LookupError):
+    """
+    Raised if a response is not available in the cache in offline mode.
+    """
+
+
+class ResponseCache(object):
+    """
+    A persistent cache of data feed responses backed by an SQLite database.
+    """
+
+    def __init__(
+            self, cache_path, offline=False, view_ttls=None,
+            max_size=MAX_CACHE_SIZE):
+        self.cache_path = cache_path
+        self.offline = offline
+        self.view_ttls = view_ttls or VIEW_TTLS
+        self.max_size = max_size
+        # a single connection is shared by all threads, access is serialized
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            cache_path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses (" +
+            "key TEXT PRIMARY KEY, view TEXT, body BLOB, size INTEGER, " +
+            "etag TEXT, last_modified TEXT, fetched_at REAL, " +
+            "accessed_at REAL)")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at " +
+            "ON responses (accessed_at)")
+        self.conn.commit()
+
+    @staticmethod
+    def get_key(params):
+        """
+        Creates cache key from key components of specified request
+        parameters.
+        """
+        return json.dumps(
+            [str(params.get(param, '')) for param in KEY_PARAMS])
+
+    def get_ttl(self, view):
+        """
+        Retrieves time (in seconds) a cached response for the specified view
+        is considered fresh.
+        """
+        return self.view_ttls.get(view, DEFAULT_TTL)
+
+    def lookup(self, key):
+        """
+        Retrieves cached entry for specified key, updating its access time.
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT body, etag, last_modified, fetched_at " +
+                "FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key))
+            self.conn.commit()
+        body, etag, last_modified, fetched_at = row
+        return {
+            'content': zlib.decompress(body),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+        }
+
+    def store(self, key, view, content, etag=None, last_modified=None):
+        """
+        Stores response content for specified key and evicts least recently
+        used entries if the maximum cache size has been exceeded.
+        """
+        body = zlib.compress(content)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES " +
+                "(?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, view, body, len(body), etag, last_modified, now, now))
+            self.evict()
+            self.conn.commit()
+
+    def refresh(self, key):
+        """
+        Marks cached entry for specified key as freshly validated.
+        """
+        with self.lock:
+            self.conn.execute(
+                "UPDATE responses SET fetched_at = ? WHERE key = ?",
+                (time.time(), key))
+            self.conn.commit()
+
+    def evict(self):
+        """
+        Evicts least recently used entries until the overall size of the
+        cache is below its maximum size. Needs to be called with the lock
+        held.
+        """
+        cache_size, = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if cache_size <= self.max_size:
+            return
+        for key, size in self.conn.execute(
+                "SELECT key, size FROM responses " +
+                "ORDER BY accessed_at").fetchall():
+            self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            cache_size -= size
+            if cache_size <= self.max_size:
+                break
+
+    def fetch_json(self, url, params):
+        """
+        Fetches JSON data using specified url and parameters, replaying
+        fresh responses from the cache and re-validating stale ones.
+        """
+        key = self.get_key(params)
+        view = params.get('view', '')
+        entry = self.lookup(key)
+
+        if entry is not None and (
+                self.offline or
+                time.time() - entry['fetched_at'] < self.get_ttl(view)):
+            METRICS.increment('cache_hits')
+            with METRICS.stage('json_decoding'):
+                return json.loads(entry['content'])
+        if self.offline:
+            raise CacheMissError(
+                "No cached response available for %s" % key)
+
+        if entry is None:
+            req = http_client.get(url, params)
+        else:
+            req = http_client.get(
+                url, params, entry['etag'], entry['last_modified'])
+
+        # re-using cached content if resource hasn't changed
+        if req.status_code == 304 and entry is not None:
+            METRICS.increment('cache_revalidations')
+            self.refresh(key)
+            with METRICS.stage('json_decoding'):
+                return json.loads(entry['content'])
+
+        METRICS.increment('cache_misses')
+        self.store(
+            key, view, req.content,
+            req.headers.get('ETag'), req.headers.get('Last-Modified'))
+        with METRICS.stage('json_decoding'):
+            return json.loads(req.content)
+
+    def close(self):
+        """
+        Closes connection to cache database.
+        """
+        with self.lock:
+            self.conn.close()
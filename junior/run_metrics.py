@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module provides instrumentation for runs of the junior scripts. Latency
+and size of each request, wall and CPU time of processing stages and
+arbitrary counters are collected in a thread-safe manner. A run report may be
+written as JSON file and as Prometheus textfile.
+"""
+
+import datetime
+import json
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+
+import json_writer
+
+# prefix of all Prometheus metric names
+PROMETHEUS_PREFIX = "junior_scraper"
+# quantiles of request latencies reported
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def calculate_quantile(sorted_values, quantile):
+    """
+    Calculates specified quantile of a sorted list of values using the
+    nearest-rank method.
+    """
+    if not sorted_values:
+        return 0.
+    rank = max(int(round(quantile * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class RunMetrics(object):
+    """
+    A collection of request metrics, stage timings and counters of a single
+    run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Discards all collected metrics and restarts the run clocks.
+        """
+        with self.lock:
+            self.start_time = time.time()
+            self.start_wall = time.perf_counter()
+            self.start_cpu = time.process_time()
+            # request latencies and sizes by view
+            self.request_latencies = defaultdict(list)
+            self.request_bytes = defaultdict(int)
+            self.request_errors = defaultdict(int)
+            # accumulated wall and cpu times and number of calls by stage
+            self.stage_wall = defaultdict(float)
+            self.stage_cpu = defaultdict(float)
+            self.stage_calls = defaultdict(int)
+            # arbitrary counters
+            self.counters = defaultdict(int)
+
+    def record_request(self, view, latency, size, failed=False):
+        """
+        Registers latency (in seconds) and size (in bytes) of a request for
+        the specified view.
+        """
+        with self.lock:
+            self.request_latencies[view].append(latency)
+            self.request_bytes[view] += size
+            if failed:
+                self.request_errors[view] += 1
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measures wall and CPU time spent in the specified stage. CPU time is
+        measured for the current thread, times of concurrent calls are
+        accumulated.
+        """
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - start_wall
+            cpu = time.thread_time() - start_cpu
+            with self.lock:
+                self.stage_wall[name] += wall
+                self.stage_cpu[name] += cpu
+                self.stage_calls[name] += 1
+
+    def increment(self, name, value=1):
+        """
+        Increments specified counter by specified value.
+        """
+        with self.lock:
+            self.counters[name] += value
+
+    def report(self):
+        """
+        Creates report of all metrics collected during the current run.
+        """
+        with self.lock:
+            requests = dict()
+            for view, latencies in self.request_latencies.items():
+                sorted_latencies = sorted(latencies)
+                requests[view] = {
+                    'count': len(latencies),
+                    'errors': self.request_errors[view],
+                    'bytes': self.request_bytes[view],
+                    'latency_sum': sum(latencies),
+                    'latency_max': sorted_latencies[-1],
+                    'latency_quantiles': {
+                        str(quantile): calculate_quantile(
+                            sorted_latencies, quantile) for
+                        quantile in LATENCY_QUANTILES},
+                }
+            stages = {
+                name: {
+                    'calls': self.stage_calls[name],
+                    'wall': self.stage_wall[name],
+                    'cpu': self.stage_cpu[name],
+                } for name in self.stage_calls}
+
+            return {
+                'started': datetime.datetime.fromtimestamp(
+                    self.start_time).isoformat(),
+                'timestamp': time.time(),
+                'wall': time.perf_counter() - self.start_wall,
+                'cpu': time.process_time() - self.start_cpu,
+                'requests': requests,
+                'stages': stages,
+                'counters': dict(self.counters),
+            }
+
+    def dump_json(self, tgt_path):
+        """
+        Dumps run report to a JSON file at the specified target location.
+        """
+        json_writer.write_file_atomically(tgt_path, json.dumps(
+            self.report(), indent=2, sort_keys=True).encode('utf-8'))
+
+    def dump_prometheus(self, tgt_path):
+        """
+        Dumps run report to a Prometheus textfile at the specified target
+        location.
+        """
+        report = self.report()
+        lines = list()
+
+        def add_metric(name, metric_type, help_text, samples):
+            name = "%s_%s" % (PROMETHEUS_PREFIX, name)
+            lines.append("# HELP %s %s" % (name, help_text))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for suffix, labels, value in samples:
+                label_str = ",".join(
+                    '%s="%s"' % (key, labels[key]) for key in sorted(labels))
+                if label_str:
+                    label_str = "{%s}" % label_str
+                lines.append("%s%s%s %s" % (
+                    name, suffix, label_str, repr(float(value))))
+
+        add_metric(
+            'last_run_timestamp_seconds', 'gauge',
+            'Time of the last run.', [('', {}, report['timestamp'])])
+        add_metric(
+            'run_wall_seconds', 'gauge', 'Wall time of the last run.',
+            [('', {}, report['wall'])])
+        add_metric(
+            'run_cpu_seconds', 'gauge', 'CPU time of the last run.',
+            [('', {}, report['cpu'])])
+
+        requests = report['requests']
+        add_metric(
+            'requests_total', 'gauge', 'Number of requests by view.', [
+                ('', {'view': view}, item['count']) for
+                view, item in sorted(requests.items())])
+        add_metric(
+            'request_errors_total', 'gauge',
+            'Number of failed requests by view.', [
+                ('', {'view': view}, item['errors']) for
+                view, item in sorted(requests.items())])
+        add_metric(
+            'response_bytes_total', 'gauge',
+            'Size of responses by view.', [
+                ('', {'view': view}, item['bytes']) for
+                view, item in sorted(requests.items())])
+        latency_samples = list()
+        for view, item in sorted(requests.items()):
+            for quantile, value in sorted(item['latency_quantiles'].items()):
+                latency_samples.append(
+                    ('', {'view': view, 'quantile': quantile}, value))
+            latency_samples.append(('_sum', {'view': view}, item[
+                'latency_sum']))
+            latency_samples.append(('_count', {'view': view}, item['count']))
+        add_metric(
+            'request_latency_seconds', 'summary',
+            'Request latencies by view.', latency_samples)
+
+        stages = report['stages']
+        add_metric(
+            'stage_wall_seconds', 'gauge',
+            'Accumulated wall time by stage.', [
+                ('', {'stage': name}, item['wall']) for
+                name, item in sorted(stages.items())])
+        add_metric(
+            'stage_cpu_seconds', 'gauge',
+            'Accumulated CPU time by stage.', [
+                ('', {'stage': name}, item['cpu']) for
+                name, item in sorted(stages.items())])
+        add_metric(
+            'counter', 'gauge', 'Counters of the last run.', [
+                ('', {'name': name}, value) for
+                name, value in sorted(report['counters'].items())])
+
+        json_writer.write_file_atomically(
+            tgt_path, ("\n".join(lines) + "\n").encode('utf-8'))
+
+
+# metrics shared by all modules of a run
+METRICS = RunMetrics()
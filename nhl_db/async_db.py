@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Asyncio counterparts of the team and division lookups of the NHL database,
+based on the asyncio extension of SQLAlchemy (1.4 or later) and an async
+driver, i.e. asyncpg for PostgreSQL or aiosqlite for SQLite stand-ins.
+
+Connection settings, pool sizing and the cached table metadata are shared
+with the synchronous API in module db, teams are kept in a registry with the
+same refresh policy as the synchronous one.
+"""
+
+import asyncio
+
+from sqlalchemy import select
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.sql.expression import func
+
+try:
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+except ImportError:
+    # SQLAlchemy 1.4
+    from sqlalchemy.orm import sessionmaker
+
+    def async_sessionmaker(**kwargs):
+        return sessionmaker(class_ = AsyncSession, **kwargs)
+
+import db
+from nhl_team import NHLTeam, NHLTeamRegistry
+from nhl_division import NHLDivision, get_team_ids, supports_team_arrays
+
+# async drivers used instead of the default ones by database backend
+async_drivers = {
+    'postgresql': 'asyncpg',
+    'sqlite': 'aiosqlite',
+}
+
+_engine = None
+_session_factory = None
+_prepare_lock = None
+
+def get_async_connection_string():
+    u"""
+    Retrieves connection string of the database using an async driver.
+    """
+    url = make_url(db.get_connection_string())
+    backend = url.get_backend_name()
+    if backend in async_drivers:
+        url = url.set(drivername = "%s+%s" % (backend, async_drivers[backend]))
+    return url
+
+def get_async_engine():
+    u"""
+    Retrieves the shared async engine, creating it on first use.
+    """
+    global _engine, _session_factory
+    if _engine is None:
+        url = get_async_connection_string()
+        if url.get_backend_name() == 'sqlite':
+            _engine = create_async_engine(url, echo = False)
+        else:
+            _engine = create_async_engine(url, echo = False, pool_size = db.pool_size)
+        # keeping attributes of loaded objects accessible after commits
+        _session_factory = async_sessionmaker(bind = _engine, expire_on_commit = False)
+    return _engine
+
+async def prepare():
+    u"""
+    Maps all registered classes to their tables, loading the (possibly
+    cached) metadata using the async engine.
+    """
+    global _prepare_lock
+    if db.is_prepared():
+        return
+    if _prepare_lock is None:
+        _prepare_lock = asyncio.Lock()
+    async with _prepare_lock:
+        if not db.is_prepared():
+            async with get_async_engine().connect() as connection:
+                metadata = await connection.run_sync(db.load_metadata)
+            db.prepare(metadata)
+
+async def get_session():
+    u"""
+    Creates a new async session using the shared async engine.
+    """
+    await prepare()
+    get_async_engine()
+    return _session_factory()
+
+class AsyncNHLTeamRegistry(NHLTeamRegistry):
+    u"""An in-process registry of all NHL teams for use with asyncio.
+
+    Teams are loaded using the async engine, concurrent lookups wait for a
+    pending load instead of loading teams themselves.
+    """
+
+    def __init__(self, max_age = 3600, miss_refresh_interval = 60):
+        super(AsyncNHLTeamRegistry, self).__init__(max_age, miss_refresh_interval)
+        self.async_lock = None
+
+    async def load_async(self):
+        u"""
+        Loads all teams from the database.
+        """
+        async with await get_session() as session:
+            result = await session.execute(select(NHLTeam))
+            self.set_teams(result.scalars().all())
+
+    async def lookup_async(self, teams_attr, key):
+        u"""
+        Looks up team by specified key in the specified map of the registry,
+        (re-)loading the registry if necessary.
+        """
+        if self.async_lock is None:
+            self.async_lock = asyncio.Lock()
+        # looking up teams without waiting as long as the registry is valid
+        if not self.is_expired():
+            t = getattr(self, teams_attr).get(key)
+            if t is not None or not self.may_refresh_on_miss():
+                return t
+        async with self.async_lock:
+            if self.is_expired():
+                await self.load_async()
+            t = getattr(self, teams_attr).get(key)
+            if t is None and self.may_refresh_on_miss():
+                await self.load_async()
+                t = getattr(self, teams_attr).get(key)
+        return t
+
+    async def find(self, abbr):
+        u"""
+        Finds team by specified abbreviation, regardless of case.
+        """
+        return await self.lookup_async('teams_by_abbr', abbr.lower())
+
+    async def find_by_id(self, team_id):
+        u"""
+        Finds team by specified id.
+        """
+        return await self.lookup_async('teams_by_id', team_id)
+
+team_registry = AsyncNHLTeamRegistry()
+
+async def find_team(abbr):
+    u"""
+    Finds team by specified abbreviation, regardless of case.
+    """
+    return await team_registry.find(abbr)
+
+async def find_team_by_id(team_id):
+    u"""
+    Finds team by specified id.
+    """
+    return await team_registry.find_by_id(team_id)
+
+async def find_divisions_and_teams_by_seasons(years):
+    u"""
+    Retrieves divisions along with their teams for all specified seasons
+    using a single query, or two queries for databases without array
+    support. Returns dictionary of seasons and lists of divisions with their
+    teams.
+    """
+    years = list(years)
+    if not years:
+        return NHLDivision.group_divisions_and_teams(years, list())
+
+    async with await get_session() as session:
+        if supports_team_arrays(get_async_engine().dialect):
+            result = await session.execute(
+                select(NHLDivision, NHLTeam).outerjoin(
+                    NHLTeam, NHLTeam.team_id == func.any(NHLDivision.teams)
+                ).where(
+                    NHLDivision.year.in_(years)
+                ).order_by(
+                    NHLDivision.year, NHLDivision.division_name,
+                    func.array_position(NHLDivision.teams, NHLTeam.team_id)
+                ))
+            rows = result.all()
+        else:
+            result = await session.execute(
+                select(NHLDivision).where(
+                    NHLDivision.year.in_(years)
+                ).order_by(
+                    NHLDivision.year, NHLDivision.division_name
+                ))
+            divisions = result.scalars().all()
+            team_ids = get_team_ids(divisions)
+            teams = list()
+            if team_ids:
+                result = await session.execute(
+                    select(NHLTeam).where(NHLTeam.team_id.in_(team_ids)))
+                teams = result.scalars().all()
+            rows = NHLDivision.join_divisions_and_teams(divisions, teams)
+
+    return NHLDivision.group_divisions_and_teams(years, rows)
+
+async def find_divisions_and_teams(year):
+    u"""
+    Retrieves divisions along with their teams for specified season using a
+    single query.
+    """
+    return (await find_divisions_and_teams_by_seasons([year]))[year]
+
+if __name__ == '__main__':
+
+    async def main():
+        t = await find_team('TOR')
+        print("Team with abbreviation '%s': %s" % ('TOR', t))
+        t = await find_team_by_id(12)
+        print("Team with id %d: %s" % (12, t))
+        await get_async_engine().dispose()
+
+    asyncio.run(main())
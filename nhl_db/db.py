@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Shared database access for all classes of the NHL database.
+
+A single engine is created lazily on first use. Table metadata is reflected
+once and cached on disk along with a fingerprint of the database schema in
+the user's cache directory (or the directory set by the environment variable
+NHL_DB_CACHE_DIR), subsequent runs merely compare the fingerprint with the
+current schema and load the cached metadata. Classes registered with this
+module are mapped to their tables once the first session is created. Instead
+of PostgreSQL a local SQLite database may be used as stand-in by setting the
+environment variable NHL_DB_URL, e.g. to 'sqlite:///nhl_db.sqlite'. Such
+stand-ins declare the team arrays of divisions as JSON columns.
+"""
+
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm.session import sessionmaker
+from sqlalchemy.schema import MetaData
+
+try:
+    from sqlalchemy.orm import registry
+except ImportError:
+    # SQLAlchemy before 1.4
+    from sqlalchemy.orm import mapper as map_class
+else:
+    map_class = registry().map_imperatively
+
+db_engine = 'postgresql'
+user = '***'
+password = '***'
+host = '***'
+port = '5432'
+database = '***'
+schema = 'nhl_db'
+pool_size = 5
+
+conn_string = "%s://%s:%s@%s:%s/%s" % (db_engine, user, password, host, port, database)
+
+# name of the file with cached table metadata
+metadata_cache_filename = 'metadata.cache'
+
+_lock = threading.RLock()
+_engine = None
+_metadata = None
+_session_factory = sessionmaker()
+_registered_classes = list()
+_mapped = False
+
+def get_connection_string():
+    u"""
+    Retrieves connection string, which may be overridden by environment
+    variable NHL_DB_URL.
+    """
+    return os.environ.get('NHL_DB_URL', conn_string)
+
+def get_engine():
+    u"""
+    Retrieves the shared engine, creating it on first use.
+    """
+    global _engine
+    with _lock:
+        if _engine is None:
+            url = get_connection_string()
+            if url.startswith('sqlite'):
+                # SQLite databases do not use a queue pool
+                _engine = create_engine(url, echo = False)
+            else:
+                _engine = create_engine(url, echo = False, pool_size = pool_size)
+            _session_factory.configure(bind = _engine)
+        return _engine
+
+def get_schema_fingerprint(connection):
+    u"""
+    Calculates fingerprint of all table definitions within the schema using
+    a single catalog query.
+    """
+    if connection.dialect.name == 'sqlite':
+        rows = connection.execute(text(
+            "SELECT type, name, sql FROM sqlite_master ORDER BY type, name"))
+    else:
+        rows = connection.execute(text(
+            "SELECT c.table_name, c.column_name, c.data_type, c.udt_name, "
+            "c.is_nullable, c.column_default, k.constraint_name "
+            "FROM information_schema.columns c "
+            "LEFT JOIN information_schema.key_column_usage k "
+            "ON k.table_schema = c.table_schema AND "
+            "k.table_name = c.table_name AND k.column_name = c.column_name "
+            "WHERE c.table_schema = :schema "
+            "ORDER BY c.table_name, c.ordinal_position, k.constraint_name"),
+            {'schema': schema})
+    return hashlib.sha1(repr(
+        [tuple(row) for row in rows]).encode('utf-8')).hexdigest()
+
+def get_cache_key(url):
+    u"""
+    Retrieves key identifying the database with specified URL in the
+    metadata cache, leaving out driver and credentials.
+    """
+    return "%s://%s:%s/%s" % (url.get_backend_name(), url.host, url.port, url.database)
+
+def get_metadata_cache_file():
+    u"""
+    Retrieves location of cached table metadata, i.e. within the directory
+    set by environment variable NHL_DB_CACHE_DIR or the user's cache
+    directory.
+    """
+    cache_dir = os.environ.get('NHL_DB_CACHE_DIR')
+    if not cache_dir:
+        cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(
+            os.path.expanduser('~'), '.cache'), 'nhl_db')
+    return os.path.join(cache_dir, metadata_cache_filename)
+
+def load_cached_metadata(cache_key, fingerprint):
+    u"""
+    Loads cached metadata if it has been reflected from the specified
+    database with the specified schema fingerprint.
+    """
+    metadata_cache_file = get_metadata_cache_file()
+    if not os.path.isfile(metadata_cache_file):
+        return None
+    try:
+        with open(metadata_cache_file, 'rb') as cache_file:
+            cached_key, cached_fingerprint, metadata = pickle.load(cache_file)
+    except Exception:
+        # ignoring caches that are corrupt or stem from other versions
+        return None
+    if cached_key != cache_key or cached_fingerprint != fingerprint:
+        return None
+    return metadata
+
+def save_cached_metadata(cache_key, fingerprint, metadata):
+    u"""
+    Saves specified metadata to the cache, replacing any previous one at
+    once.
+    """
+    metadata_cache_file = get_metadata_cache_file()
+    cache_dir = os.path.dirname(metadata_cache_file)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir = cache_dir, suffix = ".tmp")
+    try:
+        with os.fdopen(tmp_fd, 'wb') as tmp_file:
+            pickle.dump(
+                (cache_key, fingerprint, metadata), tmp_file,
+                pickle.HIGHEST_PROTOCOL)
+    except:
+        os.remove(tmp_path)
+        raise
+    if hasattr(os, 'replace'):
+        os.replace(tmp_path, metadata_cache_file)
+    else:
+        # renaming does not replace existing files on Windows
+        if os.path.isfile(metadata_cache_file):
+            os.remove(metadata_cache_file)
+        os.rename(tmp_path, metadata_cache_file)
+
+def load_metadata(connection):
+    u"""
+    Loads metadata of all tables using specified connection, from the cache
+    unless the database schema has changed since it was reflected.
+    """
+    cache_key = get_cache_key(connection.engine.url)
+    fingerprint = get_schema_fingerprint(connection)
+    metadata = load_cached_metadata(cache_key, fingerprint)
+    if metadata is None:
+        # SQLite stand-ins do not use a schema
+        metadata = MetaData(
+            schema = None if connection.dialect.name == 'sqlite' else schema)
+        metadata.reflect(bind = connection)
+        try:
+            save_cached_metadata(cache_key, fingerprint, metadata)
+        except (IOError, OSError, pickle.PicklingError):
+            # caching is an optimization only, e.g. on read-only installs
+            pass
+    return metadata
+
+def get_metadata():
+    u"""
+    Retrieves metadata of all tables, loading it on first use.
+    """
+    global _metadata
+    with _lock:
+        if _metadata is None:
+            with get_engine().connect() as connection:
+                _metadata = load_metadata(connection)
+        return _metadata
+
+def get_table(tablename):
+    u"""
+    Retrieves table with specified name.
+    """
+    metadata = get_metadata()
+    if metadata.schema:
+        tablename = "%s.%s" % (metadata.schema, tablename)
+    return metadata.tables[tablename]
+
+def register_class(cls):
+    u"""
+    Registers specified class to be mapped to the table named by its
+    '__tablename__' attribute once the tables are needed.
+    """
+    with _lock:
+        if _mapped:
+            map_table(cls)
+        else:
+            _registered_classes.append(cls)
+    return cls
+
+def map_table(cls):
+    u"""
+    Maps specified class to its table.
+    """
+    cls.__table__ = get_table(cls.__tablename__)
+    map_class(cls, cls.__table__)
+
+def prepare(metadata = None):
+    u"""
+    Maps all registered classes to their tables, optionally using specified
+    metadata unless metadata has been loaded already. This happens
+    automatically when the first session is created.
+    """
+    global _mapped, _metadata
+    with _lock:
+        if _metadata is None and metadata is not None:
+            _metadata = metadata
+        while _registered_classes:
+            map_table(_registered_classes[0])
+            del _registered_classes[0]
+        _mapped = True
+
+def is_prepared():
+    u"""
+    Checks whether all registered classes have been mapped to their tables.
+    """
+    return _mapped and not _registered_classes
+
+def Session():
+    u"""
+    Creates a new session using the shared engine.
+    """
+    prepare()
+    return _session_factory()
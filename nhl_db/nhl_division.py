@@ -5,36 +5,38 @@ u"""
 A Python class representing an NHL division.
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm.session import sessionmaker
-from sqlalchemy.schema import MetaData
-from sqlalchemy.ext.declarative import declarative_base
+from __future__ import print_function
 
-from sqlalchemy import or_, and_
-from sqlalchemy.sql.expression import func
+import csv
+import itertools
 
-db_engine = 'postgresql'
-user = '***'
-password = '***'
-host = '***'
-port = '5432'
-database = '***'
+from collections import namedtuple, OrderedDict
 
-conn_string = "%s://%s:%s@%s:%s/%s" % (db_engine, user, password, host, port, database)
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from io import StringIO
 
-Engine = create_engine(conn_string, echo = False, pool_size = 5)
-Session = sessionmaker(bind = Engine)
-Base = declarative_base(metadata = MetaData(schema = 'nhl_db', bind = Engine))
+from sqlalchemy import or_, and_
+from sqlalchemy.sql.expression import func
+from sqlalchemy.exc import DBAPIError
+
+import db
+from db import Session
 
 from nhl_team import NHLTeam
 
-class NHLDivision(Base):
+# a line of the division configuration file that could not be loaded
+FailedRow = namedtuple('FailedRow', 'line_no line reason')
+# a division along with its teams
+DivisionTeams = namedtuple('DivisionTeams', 'division teams')
+
+class NHLDivision(object):
     u"""A class representing an NHL division.
     
     Associated table: 'nhl_divisions'
     """
     __tablename__ = 'nhl_divisions'
-    __autoload__ = True
 
     def __init__(self, name, season, teams, conference = None):
         self.division_name = name
@@ -45,51 +47,273 @@ class NHLDivision(Base):
         self.conference = conference
 
     @classmethod
-    def get_divisions_and_teams(cls, year):
+    def find_divisions_and_teams_by_seasons(cls, years):
+        u"""
+        Retrieves divisions along with their teams for all specified seasons
+        using a single query joining each division with the teams of its team
+        array. Returns dictionary of seasons and lists of divisions with
+        their teams, ordered by division name and by position within the team
+        array, respectively. Databases without array support, e.g. SQLite
+        stand-ins, retrieve divisions and their teams using two queries.
+        """
+        years = list(years)
+        if not years:
+            return cls.group_divisions_and_teams(years, list())
+
         session = Session()
-        divs = session.query(NHLDivision).filter(
-            NHLDivision.year == year).all()
-        for d in divs:
-            teams = list()
-            for team_id in d.teams:
-                team = NHLTeam.find_by_id(team_id)
-                teams.append(team)
-            print d.division_name
+        try:
+            if supports_team_arrays(session.get_bind().dialect):
+                rows = session.query(NHLDivision, NHLTeam).outerjoin(
+                        NHLTeam, NHLTeam.team_id == func.any(NHLDivision.teams)
+                    ).filter(
+                        NHLDivision.year.in_(years)
+                    ).order_by(
+                        NHLDivision.year, NHLDivision.division_name,
+                        func.array_position(NHLDivision.teams, NHLTeam.team_id)
+                    ).all()
+            else:
+                divisions = session.query(NHLDivision).filter(
+                        NHLDivision.year.in_(years)
+                    ).order_by(
+                        NHLDivision.year, NHLDivision.division_name
+                    ).all()
+                team_ids = get_team_ids(divisions)
+                teams = session.query(NHLTeam).filter(
+                    NHLTeam.team_id.in_(team_ids)).all() if team_ids else list()
+                rows = cls.join_divisions_and_teams(divisions, teams)
+        finally:
+            session.close()
+
+        return cls.group_divisions_and_teams(years, rows)
+
+    @classmethod
+    def join_divisions_and_teams(cls, divisions, teams):
+        u"""
+        Joins specified divisions with the specified teams of their team
+        arrays. Returns rows of divisions and teams (None for divisions
+        without known teams) in the order of the divisions and by position
+        within the team array.
+        """
+        teams_by_id = dict((t.team_id, t) for t in teams)
+        rows = list()
+        for d in divisions:
+            # teams listed repeatedly are joined at their first position
+            division_teams = [
+                teams_by_id[team_id] for team_id in
+                OrderedDict.fromkeys(d.teams or list())
+                if team_id in teams_by_id]
+            if division_teams:
+                rows.extend((d, t) for t in division_teams)
+            else:
+                rows.append((d, None))
+        return rows
+
+    @classmethod
+    def group_divisions_and_teams(cls, years, rows):
+        u"""
+        Groups specified rows of divisions and teams, ordered by season,
+        division name and position of the team, by season and division.
+        """
+        result = OrderedDict((year, list()) for year in sorted(years))
+        for d, t in rows:
+            divisions = result[d.year]
+            # rows of a division follow each other
+            if not divisions or divisions[-1].division is not d:
+                divisions.append(DivisionTeams(d, list()))
+            if t is not None:
+                divisions[-1].teams.append(t)
+        return result
+
+    @classmethod
+    def find_divisions_and_teams(cls, year):
+        u"""
+        Retrieves divisions along with their teams for specified season using
+        a single query.
+        """
+        return cls.find_divisions_and_teams_by_seasons([year])[year]
+
+    @classmethod
+    def get_divisions_and_teams(cls, year):
+        for d, teams in cls.find_divisions_and_teams(year):
+            print(d.division_name)
             for t in teams:
-                print "\t", t
-                
-def create_divisions(division_src_file):
-    lines = open(division_src_file).readlines()
-    
+                print("\t", t)
+
+db.register_class(NHLDivision)
+
+def supports_team_arrays(dialect):
+    u"""
+    Checks whether the team arrays of divisions can be joined with teams
+    within queries using the specified dialect, i.e. for PostgreSQL only.
+    """
+    return dialect.name == 'postgresql'
+
+def get_team_ids(divisions):
+    u"""
+    Retrieves ids of all teams of the specified divisions.
+    """
+    return sorted(set(
+        team_id for d in divisions for team_id in d.teams or list()))
+
+def parse_division_line(line):
+    u"""
+    Parses specified line of the division configuration file into division
+    name, season, team abbreviations and conference (None if not given).
+    """
+    division_name, season, teams, conference = line.strip().split(";")
+    team_abbrs = [abbr.strip() for abbr in teams[1:-1].split(',')]
+    return division_name, int(season), team_abbrs, conference or None
+
+def get_batches(iterable, size):
+    u"""
+    Yields successive lists of specified size from specified iterable.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def resolve_team_ids(session, abbrs):
+    u"""
+    Resolves specified team abbreviations to team ids using a single query.
+    Returns dictionary of lower-case abbreviations and team ids.
+    """
+    abbrs = set(abbr.lower() for abbr in abbrs)
+    if not abbrs:
+        return dict()
+    # comparing abbreviations regardless of case, which may be backed by an
+    # index on lower(abbr)
+    rows = session.query(NHLTeam.abbr, NHLTeam.team_id).filter(
+        func.lower(NHLTeam.abbr).in_(abbrs)).all()
+    return dict((abbr.lower(), team_id) for abbr, team_id in rows)
+
+def insert_divisions(session, divisions, use_copy = False):
+    u"""
+    Inserts specified divisions, each of them given as dictionary of column
+    values, using a single executemany statement or PostgreSQL's COPY.
+    """
+    columns = ('division_name', 'year', 'teams', 'conference')
+    if not use_copy:
+        session.execute(NHLDivision.__table__.insert(), divisions)
+        return
+
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    for division in divisions:
+        writer.writerow((
+            division['division_name'], division['year'],
+            "{%s}" % ",".join(str(team_id) for team_id in division['teams']),
+            # empty unquoted values are copied as NULL
+            division['conference'] or ''))
+    buffer.seek(0)
+
+    # using the connection of the session's current transaction
+    connection = session.connection()
+    dbapi = connection.dialect.dbapi
+    statement = "COPY %s (%s) FROM STDIN WITH CSV" % (
+        NHLDivision.__table__.fullname, ", ".join(columns))
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(statement, buffer)
+    except dbapi.Error as e:
+        # raw cursors raise errors of the driver, which are wrapped just like
+        # errors of statements executed by SQLAlchemy
+        raise DBAPIError.instance(statement, None, e, dbapi.Error)
+    finally:
+        cursor.close()
+
+def get_error_reason(error):
+    u"""
+    Retrieves reason of specified database error, preferably the message of
+    the underlying driver error.
+    """
+    return str(getattr(error, 'orig', None) or error).strip()
+
+def insert_division_batch(session, rows, use_copy, failed):
+    u"""
+    Inserts divisions of specified rows, each of them given as line number,
+    line and dictionary of column values, within a savepoint. If the batch
+    fails, rows are inserted one by one to register failing ones. Returns
+    number of inserted divisions.
+    """
+    try:
+        with session.begin_nested():
+            insert_divisions(session, [r[2] for r in rows], use_copy)
+        return len(rows)
+    except DBAPIError:
+        pass
+
+    inserted = 0
+    for line_no, line, division in rows:
+        try:
+            with session.begin_nested():
+                insert_divisions(session, [division])
+            inserted += 1
+        except DBAPIError as e:
+            failed.append(FailedRow(line_no, line, get_error_reason(e)))
+    return inserted
+
+def load_divisions(division_src_file, batch_size = 500, use_copy = False):
+    u"""
+    Bulk loads divisions from specified configuration file. The file is
+    streamed in batches of lines, team abbreviations of each batch are
+    resolved by a single query and its divisions are inserted at once and
+    committed. Lines that can not be parsed, refer to unknown teams or fail
+    to be inserted are skipped. Returns number of loaded divisions and list
+    of failed rows.
+    """
+    loaded = 0
+    failed = list()
+
     session = Session()
     try:
-        for line in lines:
-            if line.startswith("#"):
-                continue
-            division_name, season, teams, conference = line.strip().split(";")
-            season = int(season)
-            team_abbrs = teams[1:-1].split(',')
-            teams = list()
-            for t in team_abbrs:
-                team = NHLTeam.find(t)
-                teams.append(team)
-            else:
-                if conference:
-                    division = NHLDivision(division_name, season, teams, conference)
-                else:
-                    division = NHLDivision(division_name, season, teams)
-                session.add(division)
-                
-                ids = "{" + ",".join([str(t.team_id) for t in teams])  + "}"
-                if conference:
-                    output = "%s Division (%s Conference):\t%d\t%s" % (division_name, conference, season, ids)
-                else:
-                    output = "%s Division:\t%d\t%s" % (division_name, season, ids)
-                print output
-        else:
-            session.commit()
+        with open(division_src_file) as src:
+            lines = (
+                (line_no, line.strip()) for line_no, line in enumerate(src, 1)
+                if line.strip() and not line.startswith("#"))
+            for batch in get_batches(lines, batch_size):
+                parsed = list()
+                for line_no, line in batch:
+                    try:
+                        parsed.append((line_no, line, parse_division_line(line)))
+                    except ValueError as e:
+                        failed.append(FailedRow(line_no, line, "Invalid line: %s" % e))
+
+                team_ids = resolve_team_ids(
+                    session, [abbr for _, _, p in parsed for abbr in p[2]])
+
+                rows = list()
+                for line_no, line, (division_name, season, team_abbrs, conference) in parsed:
+                    unknown_abbrs = [abbr for abbr in team_abbrs if abbr.lower() not in team_ids]
+                    if unknown_abbrs:
+                        failed.append(FailedRow(
+                            line_no, line, "Unknown teams: %s" % ", ".join(unknown_abbrs)))
+                        continue
+                    rows.append((line_no, line, {
+                        'division_name': division_name,
+                        'year': season,
+                        'teams': [team_ids[abbr.lower()] for abbr in team_abbrs],
+                        'conference': conference,
+                    }))
+
+                if rows:
+                    loaded += insert_division_batch(session, rows, use_copy, failed)
+                session.commit()
     except:
         session.rollback()
+        raise
+    finally:
+        session.close()
+
+    return loaded, failed
+
+def create_divisions(division_src_file, use_copy = False):
+    loaded, failed = load_divisions(division_src_file, use_copy = use_copy)
+    for f in failed:
+        print("Failed to load line %d (%s): %s" % (f.line_no, f.line, f.reason))
+    print("%d divisions loaded, %d lines failed" % (loaded, len(failed)))
             
             
 if __name__ == '__main__':
@@ -5,70 +5,138 @@ u"""
 A Python class representing an NHL team.
 """
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm.session import sessionmaker
-from sqlalchemy.schema import MetaData
-from sqlalchemy.ext.declarative import declarative_base
+from __future__ import print_function
+
+import threading
+import time
 
 from sqlalchemy import or_, and_
 from sqlalchemy.sql.expression import func
 
-db_engine = 'postgresql'
-user = '***'
-password = '***'
-host = '***'
-port = '5432'
-database = '***'
-
-conn_string = "%s://%s:%s@%s:%s/%s" % (db_engine, user, password, host, port, database)
+import db
+from db import Session
 
-Engine = create_engine(conn_string, echo = False, pool_size = 5)
-Session = sessionmaker(bind = Engine)
-Base = declarative_base(metadata = MetaData(schema = 'nhl_db', bind = Engine))
-
-class NHLTeam(Base):
+class NHLTeam(object):
     u"""A class representing an NHL team.
     
     Associated table: 'nhl_teams'
     """
     __tablename__ = 'nhl_teams'
-    __autoload__ = True
 
     def __init__(self):
         pass
 
     @classmethod
     def find(cls, abbr):
-        session = Session()
-        try:
-            t = session.query(NHLTeam).filter(
-                    func.lower(NHLTeam.abbr) == abbr.lower()
-                ).one()
-        except:
-            t = None
-        finally:
-            session.close()
-        return t
+        return team_registry.find(abbr)
 
     @classmethod
     def find_by_id(cls, team_id):
+        return team_registry.find_by_id(team_id)
+
+
+    def __str__(self):
+        return self.name
+
+db.register_class(NHLTeam)
+
+class NHLTeamRegistry(object):
+    u"""An in-process registry of all NHL teams.
+
+    All teams are loaded at once from table 'nhl_teams' and kept in memory,
+    allowing to look up teams by abbreviation (case-insensitive) or id
+    without any database round trips. The registry is reloaded after an
+    explicit invalidation or once it is older than the maximum age. Lookups
+    of unknown teams trigger a reload as well, but at most once per miss
+    refresh interval.
+    """
+
+    def __init__(self, max_age = 3600, miss_refresh_interval = 60):
+        self.max_age = max_age
+        self.miss_refresh_interval = miss_refresh_interval
+        self.lock = threading.Lock()
+        self.invalidate()
+
+    def invalidate(self):
+        u"""
+        Discards all teams, causing the registry to be reloaded on the next
+        lookup.
+        """
+        with self.lock:
+            self.teams_by_abbr = None
+            self.teams_by_id = None
+            self.loaded_at = None
+
+    def load(self):
+        u"""
+        Loads all teams from the database.
+        """
         session = Session()
         try:
-            t = session.query(NHLTeam).filter(
-                    NHLTeam.team_id == team_id
-                ).one()
-        except:
-            t = None
+            teams = session.query(NHLTeam).all()
         finally:
+            # teams remain usable after having been detached from the session
             session.close()
+        self.set_teams(teams)
+
+    def set_teams(self, teams):
+        u"""
+        Replaces all teams of the registry by the specified ones.
+        """
+        teams_by_abbr = dict()
+        teams_by_id = dict()
+        for t in teams:
+            if t.abbr is not None:
+                teams_by_abbr[t.abbr.lower()] = t
+            teams_by_id[t.team_id] = t
+
+        self.teams_by_abbr = teams_by_abbr
+        self.teams_by_id = teams_by_id
+        self.loaded_at = time.time()
+
+    def lookup(self, teams_attr, key):
+        u"""
+        Looks up team by specified key in the specified map of the registry,
+        (re-)loading the registry if necessary.
+        """
+        with self.lock:
+            if self.is_expired():
+                self.load()
+            t = getattr(self, teams_attr).get(key)
+            if t is None and self.may_refresh_on_miss():
+                self.load()
+                t = getattr(self, teams_attr).get(key)
         return t
 
+    def is_expired(self):
+        u"""
+        Checks whether the registry needs to be (re-)loaded.
+        """
+        return self.loaded_at is None or time.time() - self.loaded_at > self.max_age
 
-    def __str__(self):
-        return self.name
+    def may_refresh_on_miss(self):
+        u"""
+        Checks whether the registry may be reloaded after an unknown team was
+        looked up, as it may have been added since the registry was loaded.
+        """
+        return time.time() - self.loaded_at > self.miss_refresh_interval
+
+    def find(self, abbr):
+        u"""
+        Finds team by specified abbreviation, regardless of case.
+        """
+        return self.lookup('teams_by_abbr', abbr.lower())
+
+    def find_by_id(self, team_id):
+        u"""
+        Finds team by specified id.
+        """
+        return self.lookup('teams_by_id', team_id)
+
+team_registry = NHLTeamRegistry()
 
 if __name__ == '__main__':
     t = NHLTeam.find('TOR')
-    print "Team with abbreviation '%s': %s" % ('TOR', t)
+    print("Team with abbreviation '%s': %s" % ('TOR', t))
     t = NHLTeam.find_by_id(12)
-    print "Team with id %d: %s" % (12, t)
+    print("Team with id %d: %s" % (12, t))
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Tests of bulk loading divisions, using a stand-in for the session that fails
+to insert divisions of a particular name and an in-memory SQLite database.
+"""
+
+import contextlib
+import unittest
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import sessionmaker
+
+import db
+import nhl_division
+
+from nhl_division import NHLDivision, FailedRow
+
+class DriverError(Exception):
+    pass
+
+class DriverIntegrityError(DriverError):
+    pass
+
+class FakeDBAPI(object):
+    Error = DriverError
+
+class FakeDialect(object):
+    dbapi = FakeDBAPI
+
+class FakeCursor(object):
+
+    def __init__(self, session):
+        self.session = session
+
+    def copy_expert(self, statement, buffer):
+        if self.session.bad_name in buffer.getvalue():
+            raise DriverIntegrityError("duplicate key value")
+        self.session.copied += buffer.getvalue().splitlines()
+
+    def close(self):
+        pass
+
+class FakeConnection(object):
+    dialect = FakeDialect
+
+    def __init__(self, session):
+        self.connection = self
+        self.session = session
+
+    def cursor(self):
+        return FakeCursor(self.session)
+
+class FakeSession(object):
+    u"""
+    A stand-in for a session failing to insert divisions with a particular
+    name, raising driver errors for COPY and wrapped errors otherwise.
+    """
+
+    def __init__(self, bad_name):
+        self.bad_name = bad_name
+        self.copied = list()
+        self.inserted = list()
+
+    @contextlib.contextmanager
+    def begin_nested(self):
+        yield
+
+    def connection(self):
+        return FakeConnection(self)
+
+    def execute(self, statement, divisions):
+        if any(d['division_name'] == self.bad_name for d in divisions):
+            raise IntegrityError(
+                str(statement), divisions, DriverIntegrityError("duplicate key value"))
+        self.inserted += [d['division_name'] for d in divisions]
+
+class InsertDivisionBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = getattr(NHLDivision, '__table__', None)
+        NHLDivision.__table__ = Table(
+            'nhl_divisions', MetaData(),
+            Column('division_name', String), Column('year', Integer),
+            Column('teams', String), Column('conference', String))
+        self.rows = [
+            (line_no, "line %d" % line_no, {
+                'division_name': name, 'year': 2006,
+                'teams': [1, 2], 'conference': None})
+            for line_no, name in enumerate(('Atlantic', 'Central', 'Pacific'), 1)]
+
+    def tearDown(self):
+        if self.table is None:
+            del NHLDivision.__table__
+        else:
+            NHLDivision.__table__ = self.table
+
+    def check_failing_batch(self, use_copy):
+        session = FakeSession('Central')
+        failed = list()
+        inserted = nhl_division.insert_division_batch(
+            session, self.rows, use_copy, failed)
+        self.assertEqual(inserted, 2)
+        self.assertEqual(session.inserted, ['Atlantic', 'Pacific'])
+        self.assertEqual(failed, [FailedRow(2, "line 2", "duplicate key value")])
+
+    def test_failing_batch(self):
+        self.check_failing_batch(False)
+
+    def test_failing_batch_copy(self):
+        self.check_failing_batch(True)
+
+    def test_batch_copy(self):
+        session = FakeSession('Northeast')
+        failed = list()
+        inserted = nhl_division.insert_division_batch(
+            session, self.rows, True, failed)
+        self.assertEqual(inserted, 3)
+        self.assertEqual(len(session.copied), 3)
+        self.assertEqual(failed, [])
+
+class ResolveTeamIdsTest(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine('sqlite://')
+        with engine.begin() as connection:
+            connection.execute(text(
+                "CREATE TABLE nhl_teams (team_id INTEGER PRIMARY KEY, name TEXT, abbr TEXT)"))
+            connection.execute(text(
+                "CREATE TABLE nhl_divisions (division_id INTEGER PRIMARY KEY, " +
+                "division_name TEXT, year INTEGER, teams JSON, conference TEXT)"))
+            connection.execute(text(
+                "INSERT INTO nhl_teams VALUES (1, 'Ottawa', 'Ott'), " +
+                "(2, 'Toronto', 'TOR'), (3, 'Boston', 'bos')"))
+        metadata = MetaData()
+        metadata.reflect(bind = engine)
+        db.prepare(metadata)
+        self.session = sessionmaker(bind = engine)()
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_mixed_case_abbreviations(self):
+        team_ids = nhl_division.resolve_team_ids(
+            self.session, ['OTT', 'tor', 'Bos', 'XXX'])
+        self.assertEqual(team_ids, {'ott': 1, 'tor': 2, 'bos': 3})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Benchmark of nearest line engines on reproducible synthetic workloads. Point
+and line datasets are generated with uniformly distributed, clustered or
+road-network-like layouts. Each available engine is run in a separate
+process behind a common interface, results of all engines are checked for
+agreement and throughput, latency percentiles, peak memory usage and scaling
+by number of worker processes are reported. No ArcGIS installation is
+required.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import hashlib
+import json
+import math
+import multiprocessing
+import sys
+import time
+
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import nearest_line
+import shared_index
+import tiled_nearest_line
+
+# available dataset layouts
+DATASETS = ('uniform', 'clustered', 'roads')
+# average distance between neighbouring line features
+SPACING = 100.
+# number of points per tile in tiled mode
+POINTS_PER_TILE = 50000
+# latency percentiles reported
+PERCENTILES = (50, 90, 99)
+
+# using the most precise clock available
+timer = getattr(time, 'perf_counter', time.time)
+
+
+def create_random_walks(rng, starts, counts, step):
+    u"""
+    Creates vertex coordinates of random walks with specified start points,
+    vertex counts and average step length.
+    """
+    steps = rng.normal(0., step, (counts.sum(), 2))
+    first_vertices = np.cumsum(counts) - counts
+    steps[first_vertices] = starts
+    coords = np.cumsum(steps, axis=0)
+    # restarting accumulation at the first vertex of each walk
+    offsets = coords[first_vertices] - steps[first_vertices]
+    return coords - np.repeat(offsets, counts, axis=0)
+
+
+def create_line_set(coords, counts):
+    u"""
+    Creates line set of single-part lines from specified vertex coordinates
+    and vertex counts.
+    """
+    return nearest_line.LineSet(
+        np.arange(len(counts)), coords, np.append(0, np.cumsum(counts)),
+        np.arange(len(counts)))
+
+
+def create_uniform_dataset(rng, line_cnt, point_cnt):
+    u"""
+    Creates short random-walk lines and points, both uniformly distributed.
+    """
+    side = math.sqrt(line_cnt) * SPACING
+    counts = rng.randint(2, 11, line_cnt)
+    coords = create_random_walks(
+        rng, rng.uniform(0., side, (line_cnt, 2)), counts, SPACING / 4)
+    points = rng.uniform(0., side, (point_cnt, 2))
+    return create_line_set(coords, counts), points
+
+
+def create_clustered_dataset(rng, line_cnt, point_cnt):
+    u"""
+    Creates short random-walk lines and points, both concentrated in
+    normally distributed clusters of varying size.
+    """
+    side = math.sqrt(line_cnt) * SPACING
+    cluster_cnt = max(line_cnt // 1000, 1)
+    centers = rng.uniform(0., side, (cluster_cnt, 2))
+    sigmas = rng.uniform(0.01, 0.05, cluster_cnt) * side
+
+    def create_clustered_points(cnt):
+        clusters = rng.randint(0, cluster_cnt, cnt)
+        return centers[clusters] + rng.normal(0., 1., (cnt, 2)) * sigmas[
+            clusters, np.newaxis]
+
+    counts = rng.randint(2, 11, line_cnt)
+    coords = create_random_walks(
+        rng, create_clustered_points(line_cnt), counts, SPACING / 4)
+    return create_line_set(coords, counts), create_clustered_points(point_cnt)
+
+
+def create_roads_dataset(rng, line_cnt, point_cnt):
+    u"""
+    Creates a jittered grid of streets with a few long highways with many
+    vertices crossing it, and points scattered along the streets.
+    """
+    vertex_cnt = 8
+    highway_cnt = max(line_cnt // 10000, 1)
+    highway_vertex_cnt = min(max(line_cnt, 100), 20000)
+    # a grid of n x n blocks consists of 2 * n * (n + 1) streets
+    block_cnt = max(int(math.sqrt((line_cnt - highway_cnt) / 2.)), 1)
+    block_size = SPACING * 2
+    side = block_cnt * block_size
+
+    # setting up start and end points of horizontal and vertical streets
+    i, j = np.meshgrid(
+        np.arange(block_cnt + 1), np.arange(block_cnt), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    starts = np.vstack((
+        np.column_stack((j, i)), np.column_stack((i, j)))) * block_size
+    ends = np.vstack((
+        np.column_stack((j + 1, i)), np.column_stack((i, j + 1)))) * (
+            block_size)
+    street_cnt = min(len(starts), max(line_cnt - highway_cnt, 1))
+    starts, ends = starts[:street_cnt], ends[:street_cnt]
+
+    # interpolating and jittering intermediate vertices
+    t = np.linspace(0., 1., vertex_cnt)
+    street_coords = starts[:, np.newaxis] + t[:, np.newaxis] * (
+        ends - starts)[:, np.newaxis]
+    street_coords[:, 1:-1] += rng.normal(
+        0., block_size / 50, (street_cnt, vertex_cnt - 2, 2))
+
+    # setting up highways as random walks across the grid
+    highway_coords = create_random_walks(
+        rng, rng.uniform(0., side, (highway_cnt, 2)),
+        np.full(highway_cnt, highway_vertex_cnt),
+        side / math.sqrt(highway_vertex_cnt) / 2)
+
+    coords = np.vstack((street_coords.reshape(-1, 2), highway_coords))
+    counts = np.append(
+        np.full(street_cnt, vertex_cnt),
+        np.full(highway_cnt, highway_vertex_cnt))
+
+    # scattering points along random streets
+    streets = rng.randint(0, street_cnt, point_cnt)
+    t = rng.uniform(0., 1., (point_cnt, 1))
+    points = starts[streets] + t * (ends[streets] - starts[streets]) + (
+        rng.normal(0., block_size / 10, (point_cnt, 2)))
+
+    return create_line_set(coords, counts), points
+
+
+def create_dataset(dataset, line_cnt, point_cnt, seed):
+    u"""
+    Creates specified dataset with specified numbers of line and point
+    features. Returns line set and point coordinates.
+    """
+    rng = np.random.RandomState(seed)
+    return globals()["create_%s_dataset" % dataset](rng, line_cnt, point_cnt)
+
+
+def run_best_first(line_set, line_index, points, worker_cnt):
+    u"""
+    Runs best-first search for each point. Returns line indexes, distances
+    and latencies of all queries.
+    """
+    lines = np.empty(len(points), dtype=np.int64)
+    distances = np.empty(len(points))
+    latencies = np.empty(len(points))
+    for i, (x, y) in enumerate(points.tolist()):
+        start = timer()
+        line, distance = line_index.nearest(x, y)
+        latencies[i] = timer() - start
+        lines[i] = -1 if line is None else line
+        distances[i] = np.inf if distance is None else distance
+    return lines, distances, latencies
+
+
+def run_batch(line_set, line_index, points, worker_cnt):
+    u"""
+    Runs vectorized batch search. Returns line indexes, distances and
+    latencies of all batches.
+    """
+    lines = np.empty(len(points), dtype=np.int64)
+    distances = np.empty(len(points))
+    latencies = list()
+    for start in range(0, len(points), nearest_line.BATCH_SIZE):
+        end = start + nearest_line.BATCH_SIZE
+        batch_start = timer()
+        lines[start:end], distances[start:end] = line_index.nearest_batch(
+            points[start:end, 0], points[start:end, 1])
+        latencies.append(timer() - batch_start)
+    return lines, distances, np.array(latencies)
+
+
+def collect_results(results, point_cnt, line_set):
+    u"""
+    Collects unordered results of nearest line retrieval, using point
+    indexes as point OIDs. Returns line indexes and distances.
+    """
+    lines = np.full(point_cnt, -1, dtype=np.int64)
+    distances = np.full(point_cnt, np.inf)
+    for poid, loid, distance in results:
+        if loid is not None:
+            # line OIDs are line indexes in all synthetic datasets
+            lines[poid] = loid
+            distances[poid] = distance
+    return lines, distances
+
+
+def run_parallel(line_set, line_index, points, worker_cnt):
+    u"""
+    Runs batch search in worker processes sharing the line index. Returns
+    line indexes and distances.
+    """
+    lines, distances = collect_results(
+        shared_index.find_nearest_lines_parallel(
+            zip(range(len(points)), points[:, 0], points[:, 1]), line_index,
+            worker_cnt), len(points), line_set)
+    return lines, distances, None
+
+
+def run_tiled(line_set, line_index, points, worker_cnt):
+    u"""
+    Runs tiled search in worker processes, building the index of each tile
+    separately. Returns line indexes and distances.
+    """
+    point_source = tiled_nearest_line.ArrayPoints(
+        np.arange(len(points)), points[:, 0], points[:, 1])
+    xmin, ymin, xmax, ymax = point_source.extent
+    tile_size = max(xmax - xmin, ymax - ymin) / max(
+        math.sqrt(len(points) / POINTS_PER_TILE), 1.)
+    lines, distances = collect_results(
+        tiled_nearest_line.find_nearest_lines_tiled(
+            point_source, tiled_nearest_line.ArrayLines(line_set), tile_size,
+            worker_cnt=worker_cnt), len(points), line_set)
+    return lines, distances, None
+
+
+# available engines, those marked as parallel are run for each worker count
+ENGINES = OrderedDict((
+    ('best-first', (run_best_first, False)),
+    ('batch', (run_batch, False)),
+    ('parallel', (run_parallel, True)),
+    ('tiled', (run_tiled, True)),
+))
+
+
+def get_peak_rss():
+    u"""
+    Retrieves peak resident set size (in MiB) of the current process and its
+    terminated child processes, if available.
+    """
+    if resource is None:
+        return None
+    rss = sum(
+        resource.getrusage(who).ru_maxrss for
+        who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    # resident set size is reported in bytes on macOS, in KiB elsewhere
+    return rss / (1024. ** 2 if sys.platform == 'darwin' else 1024.)
+
+
+def run_case(conn, engine, dataset, line_cnt, point_cnt, seed, worker_cnt):
+    u"""
+    Runs specified engine on specified dataset and sends measurements to the
+    specified connection. Meant to be run in a separate process to measure
+    peak memory usage of each engine individually.
+    """
+    line_set, points = create_dataset(dataset, line_cnt, point_cnt, seed)
+
+    start = timer()
+    line_index = None
+    if engine != 'tiled':
+        line_index = nearest_line.LineIndex(line_set)
+    build_time = timer() - start
+
+    start = timer()
+    lines, distances, latencies = ENGINES[engine][0](
+        line_set, line_index, points, worker_cnt)
+    query_time = timer() - start
+
+    measurements = {
+        'build_time': build_time,
+        'query_time': query_time,
+        'throughput': point_cnt / query_time if query_time else None,
+        'latencies': None,
+        'peak_rss': get_peak_rss(),
+        # digest of results to check for agreement between engines
+        'digest': hashlib.sha1(
+            lines.tobytes() + distances.tobytes()).hexdigest(),
+    }
+    if latencies is not None and len(latencies):
+        measurements['latencies'] = {
+            str(percentile): float(np.percentile(latencies, percentile)) for
+            percentile in PERCENTILES}
+    conn.send(measurements)
+    conn.close()
+
+
+def run_isolated(*args):
+    u"""
+    Runs a benchmark case in a fresh process and returns its measurements.
+    """
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('spawn')
+    else:
+        context = multiprocessing
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    process = context.Process(target=run_case, args=(child_conn,) + args)
+    process.start()
+    child_conn.close()
+    try:
+        measurements = parent_conn.recv()
+    except EOFError:
+        measurements = None
+    process.join()
+    return measurements
+
+
+def format_row(values, widths):
+    u"""
+    Formats specified values as a table row with specified column widths.
+    """
+    return "  ".join(
+        ("%*s" if i else "%-*s") % (width, value) for
+        i, (value, width) in enumerate(zip(values, widths)))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Benchmark nearest line engines on synthetic datasets.')
+    parser.add_argument(
+        '--datasets', nargs='+', default=list(DATASETS), choices=DATASETS,
+        help='Dataset layouts to benchmark')
+    parser.add_argument(
+        '--sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+        help='Numbers of line features, from 10^3 up to 10^7')
+    parser.add_argument(
+        '--points-ratio', type=float, default=1.,
+        help='Number of point features relative to number of line features')
+    parser.add_argument(
+        '--engines', nargs='+', default=['batch', 'parallel', 'tiled'],
+        choices=list(ENGINES), help='Engines to benchmark')
+    parser.add_argument(
+        '--workers', nargs='+', type=int,
+        default=sorted(set([1, multiprocessing.cpu_count()])),
+        help='Numbers of worker processes for parallel engines')
+    parser.add_argument(
+        '--seed', type=int, default=42, help='Seed of random generator')
+    parser.add_argument(
+        '--output', help='JSON file to write all measurements to')
+    args = parser.parse_args()
+
+    widths = (10, 9, 9, 12, 8, 9, 9, 12, 11, 11, 11, 9, 6)
+    print(format_row((
+        'dataset', 'lines', 'points', 'engine', 'workers', 'build s',
+        'query s', 'points/s', 'p50 ms', 'p90 ms', 'p99 ms', 'RSS MiB',
+        'agree'), widths))
+
+    all_measurements = list()
+    for dataset in args.datasets:
+        for line_cnt in args.sizes:
+            point_cnt = max(int(line_cnt * args.points_ratio), 1)
+            reference_digest = None
+            for engine in args.engines:
+                worker_cnts = args.workers if ENGINES[engine][1] else [1]
+                for worker_cnt in worker_cnts:
+                    measurements = run_isolated(
+                        engine, dataset, line_cnt, point_cnt, args.seed,
+                        worker_cnt)
+                    if measurements is None:
+                        print("Benchmark of %s on %s (%d) failed" % (
+                            engine, dataset, line_cnt))
+                        continue
+                    if reference_digest is None:
+                        reference_digest = measurements['digest']
+                    measurements['agrees'] = (
+                        measurements['digest'] == reference_digest)
+                    measurements.update({
+                        'dataset': dataset, 'lines': line_cnt,
+                        'points': point_cnt, 'engine': engine,
+                        'workers': worker_cnt})
+                    all_measurements.append(measurements)
+
+                    latencies = measurements['latencies'] or dict()
+                    print(format_row((
+                        dataset, line_cnt, point_cnt, engine, worker_cnt,
+                        "%.3f" % measurements['build_time'],
+                        "%.3f" % measurements['query_time'],
+                        "%.0f" % (measurements['throughput'] or 0),
+                    ) + tuple(
+                        "%.3f" % (latencies[str(percentile)] * 1000) if
+                        latencies else "-" for percentile in PERCENTILES) + (
+                        "%.0f" % measurements['peak_rss'] if
+                        measurements['peak_rss'] is not None else "-",
+                        "yes" if measurements['agrees'] else "NO"), widths))
+                    sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(all_measurements, output_file, indent=2)
+
+    # reporting scaling of parallel engines relative to a single worker
+    query_times = defaultdict(dict)
+    for item in all_measurements:
+        if ENGINES[item['engine']][1]:
+            query_times[item['dataset'], item['lines'], item['engine']][
+                item['workers']] = item['query_time']
+    for (dataset, line_cnt, engine), times in sorted(query_times.items()):
+        if 1 not in times or len(times) < 2:
+            continue
+        print("Scaling of %s on %s (%d): %s" % (
+            engine, dataset, line_cnt, ", ".join(
+                "%d workers %.2fx" % (worker_cnt, times[1] / times[
+                    worker_cnt]) for worker_cnt in sorted(times))))
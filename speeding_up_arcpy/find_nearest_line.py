@@ -8,6 +8,11 @@ Linear version of a script to retrieve nearest line features to set of point fea
 import os, sys
 import arcpy
 
+import incremental_nearest_line
+import line_store
+import nearest_line
+import result_writer
+
 sde_connection_file = "sde_connection.sde"
 
 point_src_dataset = "FDS_POINT"
@@ -16,76 +21,104 @@ point_src_featureclass = "FCL_POINT"
 line_src_dataset = "FDS_LINE"
 line_src_featureclass = "FCL_LINE"
 
-buffer_base_increment = 10
-
 point_lyr_src = '\\'.join((sde_connection_file, point_src_dataset, point_src_featureclass))
 line_lyr_src = '\\'.join((sde_connection_file, line_src_dataset, line_src_featureclass))
 
-
-def find_nearest_line(point_lyr_src, line_lyr_src):
-    # creating ESRI feature layers
-    point_lyr = arcpy.management.MakeFeatureLayer(point_lyr_src, "point_layer")
-    line_lyr = arcpy.management.MakeFeatureLayer(line_lyr_src, "line_layer")
-
-    # retrieving OID and shape field names for point feature layer
-    oid_fieldname = arcpy.Describe(point_lyr).OIDFieldName
-    shape_fieldname = arcpy.Describe(point_lyr).shapeFieldName
-
-    # setting up container for resulting pairs of points and least-distance lines
-    pnt_min_dist_line_pairs = list()
-    
-    with arcpy.da.SearchCursor(point_lyr, ["OID@", "SHAPE@"]) as point_cursor:
-        for poid, geom in point_cursor:
-            print "Working on point feature %d" % poid
-            # setting up a where clause to create a feature layer that solely contains the current point of interest
-            poi_where_clause = "%s = %d" % (oid_fieldname, poid)
-            # crreating that feature layer that will be used as foundation for distance calculation
-            poi_lyr = arcpy.management.MakeFeatureLayer(point_lyr, "poi_layer", poi_where_clause)
-    
-            buffer_radius = 0
-            nearby_lines_cnt = 0
-            i = 1
-            
-            while not nearby_lines_cnt:
-                # setting initial buffer radius to base size or incrementing
-                # current buffer radius by base size (non-linear)
-                buffer_radius += i * buffer_base_increment
-                # finding all line elements that are within a distance of
-                # buffer radius from the point of interest
-                nearby_lines_lyr = arcpy.management.SelectLayerByLocation(line_lyr, "WITHIN_A_DISTANCE", poi_lyr, buffer_radius)
-                nearby_lines_cnt = int(arcpy.management.GetCount(nearby_lines_lyr).getOutput(0))
-                i += 1
-
-            print "Number of line features found within %d m of point feature %d: %d" % (buffer_radius, poid, nearby_lines_cnt)
-            
-            # retrieving point geometry
-            point_geom = arcpy.PointGeometry(geom.getPart())
-    
-            # setting up minimal distance variables
-            minimal_distance = sys.maxsize
-            minimal_distance_line_oid = None
-    
-            # from all found lines within buffer radius find the one with the
-            # smallest distance to the point of interest feature
-            with arcpy.da.SearchCursor(nearby_lines_lyr, ["OID@", "SHAPE@"]) as line_cursor:
-                for loid, lgeom in line_cursor:
-                    line_geom = arcpy.Polyline(lgeom.getPart())
-                    distance = point_geom.distanceTo(line_geom)
-    
-                    if distance < minimal_distance:
-                        minimal_distance = distance
-                        minimal_distance_line_oid = loid
-
-            print "Minimum distance calculated between point feature %d and line feature %d: %0.2f" % (poid, minimal_distance_line_oid, minimal_distance)
-            
-            arcpy.management.Delete(poi_lyr)
-
-            pnt_min_dist_line_pairs.append((poid, minimal_distance_line_oid, minimal_distance))
-                        
-            print "++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++"
-
-    return pnt_min_dist_line_pairs
+# location of results, either a CSV file or an SQLite database
+result_path = "nearest_lines.sqlite"
+
+# location of a store of line geometries and their spatial index, exported
+# once from the line feature class and memory-mapped by subsequent runs, set
+# to None to read line features on every run
+line_store_path = "lines.store"
+
+# location of the state of incremental runs, i.e. previous results along with
+# point locations, and editor tracking field recording the last edit of line
+# features
+state_path = "nearest_lines.state"
+line_edit_field = "last_edited_date"
+
+
+def find_nearest_line(point_lyr_src, line_lyr_src, result_path, line_store_path, resume=False):
+    # reading all line geometries once and bulk-loading a spatial index
+    # over their segments, or memory-mapping both from the line store
+    line_index = line_store.load_line_index(line_lyr_src, line_store_path)
+
+    print "Spatial index created for %d line features" % len(line_index.line_set)
+
+    # setting up writer streaming resulting pairs of points and least-distance
+    # lines to the result location, when resuming points up to the last
+    # checkpoint are skipped
+    with result_writer.create_writer(result_path, resume) as writer:
+        progress = result_writer.ProgressReporter(
+            int(arcpy.management.GetCount(point_lyr_src).getOutput(0)), writer.count)
+
+        # finding the line with the smallest distance for each point of interest
+        for result in nearest_line.find_nearest_lines(
+                nearest_line.read_points_from_feature_class(point_lyr_src, writer.last_oid), line_index):
+            writer.write(result)
+            progress.update()
+
+    progress.report()
+
+    return writer.count
+
+def update_nearest_line(point_lyr_src, line_lyr_src, result_path, line_store_path, state_path):
+    is_initial = not os.path.isfile(state_path)
+    # retrieving the last line edit before reading edited lines, later edits
+    # will be taken into account by the next run
+    fingerprint = line_store.get_source_fingerprint(line_lyr_src)
+    last_edit = incremental_nearest_line.get_last_edit(line_lyr_src, line_edit_field)
+    # the line store is kept up to date along with the state, i.e. it is
+    # validated against the line feature class only for initial runs
+    line_index = line_store.load_line_index(line_lyr_src, line_store_path, is_initial)
+    # reading current locations of all points to be compared with the state
+    points = nearest_line.read_points_from_feature_class(point_lyr_src)
+
+    if is_initial:
+        # without previous results nearest lines are retrieved for all points
+        state = incremental_nearest_line.NearestLineState.create(points, line_index, last_edit)
+        with result_writer.create_writer(result_path) as writer:
+            for result in state.results():
+                writer.write(result)
+        state.save(state_path)
+
+        print "Retrieved nearest lines for %d point features" % len(state)
+
+        return len(state)
+
+    state = incremental_nearest_line.NearestLineState.load(state_path)
+    changed_points, deleted_poids = incremental_nearest_line.get_point_changes(state, points)
+    # lines edited since the last run are read according to editor tracking,
+    # lines no longer present have been deleted, including nearest lines of
+    # the state missing from a store exported anew in the meantime
+    edited_lines = incremental_nearest_line.read_edited_lines(line_lyr_src, line_edit_field, state.last_edit)
+    deleted_loids = sorted(
+        (set(line_index.line_set.oids.tolist()) | set(state.loids[state.loids >= 0].tolist())) -
+        set(incremental_nearest_line.read_line_oids(line_lyr_src)))
+
+    # finding nearest lines solely for points affected by any of the changes
+    state, updated_index, changed_poids, deleted_poids = incremental_nearest_line.update_state(
+        state, line_index, changed_points, deleted_poids, edited_lines, deleted_loids)
+    state.last_edit = last_edit
+
+    incremental_nearest_line.update_results(result_path, state, changed_poids, deleted_poids)
+    if updated_index is not line_index:
+        # releasing the memory-mapped store before replacing it
+        line_index = updated_index
+        if line_store_path is not None:
+            line_store.write_store(line_store_path, line_index, line_lyr_src, fingerprint)
+    state.save(state_path)
+
+    print "Updated results of %d point features, removed results of %d point features" % (len(changed_poids), len(deleted_poids))
+
+    return len(changed_poids)
 
 if __name__ == '__main__':
     
-    point_with_least_distance_lines = find_nearest_line(point_lyr_src, line_lyr_src)
\ No newline at end of file
+    if '--incremental' in sys.argv:
+        # updating results of a previous incremental run after edits
+        point_cnt = update_nearest_line(point_lyr_src, line_lyr_src, result_path, line_store_path, state_path)
+    else:
+        # resuming an interrupted run if requested
+        point_cnt = find_nearest_line(point_lyr_src, line_lyr_src, result_path, line_store_path, '--resume' in sys.argv)
\ No newline at end of file
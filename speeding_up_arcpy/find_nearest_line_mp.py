@@ -6,8 +6,15 @@ Parallel version of a script to retrieve nearest line features to set of point f
 """
 
 import os, sys
+import multiprocessing
 import arcpy
 
+import line_store
+import nearest_line
+import result_writer
+import shared_index
+import tiled_nearest_line
+
 sde_connection_file = "sde_connection.sde"
 
 point_src_dataset = "FDS_POINT"
@@ -16,130 +23,76 @@ point_src_featureclass = "FCL_POINT"
 line_src_dataset = "FDS_LINE"
 line_src_featureclass = "FCL_LINE"
 
-buffer_base_increment = 10
-
 point_lyr_src = '\\'.join((sde_connection_file, point_src_dataset, point_src_featureclass))
 line_lyr_src = '\\'.join((sde_connection_file, line_src_dataset, line_src_featureclass))
 
+# location of results, either a CSV file or an SQLite database
+result_path = "nearest_lines.sqlite"
+
+# location of a store of line geometries and their spatial index, exported
+# once from the line feature class and memory-mapped by subsequent runs, set
+# to None to read line features on every run
+line_store_path = "lines.store"
+
+# size of tiles for out-of-core processing, set to None to process all
+# features at once
+tile_size = None
+
+
+def find_nearest_line(point_lyr_src, line_lyr_src, result_path, line_store_path, worker_cnt, resume=False):
+    # reading all line geometries once and bulk-loading a spatial index
+    # over their segments, or memory-mapping both from the line store, the
+    # index will be shared with all workers
+    line_index = line_store.load_line_index(line_lyr_src, line_store_path)
+
+    print "Spatial index created for %d line features" % len(line_index.line_set)
+
+    # setting up writer streaming resulting pairs of points and least-distance
+    # lines to the result location, when resuming points up to the last
+    # checkpoint are skipped
+    with result_writer.create_writer(result_path, resume) as writer:
+        progress = result_writer.ProgressReporter(
+            int(arcpy.management.GetCount(point_lyr_src).getOutput(0)), writer.count)
+
+        # finding the line with the smallest distance for each point of interest,
+        # batches of points are dynamically distributed to the worker pool and
+        # results are retrieved in order of points to allow for checkpoints
+        for result in shared_index.find_nearest_lines_parallel(
+                nearest_line.read_points_from_feature_class(point_lyr_src, writer.last_oid),
+                line_index, worker_cnt, ordered=True):
+            writer.write(result)
+            progress.update()
+
+    progress.report()
+
+    return writer.count
+
+def find_nearest_line_tiled(point_lyr_src, line_lyr_src, result_path, worker_cnt, tile_size):
+    # setting up sources that allow workers to solely read features located
+    # within (and around) their current tile
+    point_source = tiled_nearest_line.FeatureClassSource(point_lyr_src)
+    line_source = tiled_nearest_line.FeatureClassSource(line_lyr_src)
+
+    # setting up writer streaming resulting pairs of points and least-distance
+    # lines to the result location, results of tiles are retrieved in order
+    # of completion and may therefore not be resumed
+    with result_writer.create_writer(result_path, ordered=False) as writer:
+        progress = result_writer.ProgressReporter(
+            int(arcpy.management.GetCount(point_lyr_src).getOutput(0)))
+
+        for result in tiled_nearest_line.find_nearest_lines_tiled(
+                point_source, line_source, tile_size, worker_cnt=worker_cnt):
+            writer.write(result)
+            progress.update()
+
+    progress.report()
 
-def find_nearest_line(func_data):
-    # unpacking provided function data
-    point_lyr_src, line_lyr_src, oid_lower_bound, oid_upper_bound = func_data
-    
-    # creating ESRI feature layers
-    point_lyr = arcpy.management.MakeFeatureLayer(point_lyr_src, "point_layer")
-    line_lyr = arcpy.management.MakeFeatureLayer(line_lyr_src, "line_layer")
-
-    # retrieving OID and shape field names for point feature layer
-    oid_fieldname = arcpy.Describe(point_lyr).OIDFieldName
-    shape_fieldname = arcpy.Describe(point_lyr).shapeFieldName
-
-    # setting up where clause to restrict selection to specified oid range
-    where_clause = "%s >= %d AND %s <= %d" % (oid_fieldname, oid_lower_bound, oid_fieldname, oid_upper_bound)
-    # re-creating point feature layer
-    arcpy.management.Delete(point_lyr)
-    point_lyr = arcpy.management.MakeFeatureLayer(point_lyr_src, "point_layer", where_clause)
-
-    # setting up container for resulting pairs of points and least-distance lines
-    pnt_min_dist_line_pairs = list()
-    
-    with arcpy.da.SearchCursor(point_lyr, ["OID@", "SHAPE@"]) as point_cursor:
-        for poid, geom in point_cursor:
-            print "Working on point feature %d" % poid
-            # setting up a where clause to create a feature layer that solely contains the current point of interest
-            poi_where_clause = "%s = %d" % (oid_fieldname, poid)
-            # crreating that feature layer that will be used as foundation for distance calculation
-            poi_lyr = arcpy.management.MakeFeatureLayer(point_lyr, "poi_layer", poi_where_clause)
-    
-            buffer_radius = 0
-            nearby_lines_cnt = 0
-            i = 1
-            
-            while not nearby_lines_cnt:
-                # setting initial buffer radius to base size or incrementing
-                # current buffer radius by base size (non-linear)
-                buffer_radius += i * buffer_base_increment
-                # finding all line elements that are within a distance of
-                # buffer radius from the point of interest
-                nearby_lines_lyr = arcpy.management.SelectLayerByLocation(line_lyr, "WITHIN_A_DISTANCE", poi_lyr, buffer_radius)
-                nearby_lines_cnt = int(arcpy.management.GetCount(nearby_lines_lyr).getOutput(0))
-                i += 1
-
-            print "Number of line features found within %d m of point feature %d: %d" % (buffer_radius, poid, nearby_lines_cnt)
-            
-            # retrieving point geometry
-            point_geom = arcpy.PointGeometry(geom.getPart())
-    
-            # setting up minimal distance variables
-            minimal_distance = sys.maxsize
-            minimal_distance_line_oid = None
-    
-            # from all found lines within buffer radius find the one with the
-            # smallest distance to the point of interest feature
-            with arcpy.da.SearchCursor(nearby_lines_lyr, ["OID@", "SHAPE@"]) as line_cursor:
-                for loid, lgeom in line_cursor:
-                    line_geom = arcpy.Polyline(lgeom.getPart())
-                    distance = point_geom.distanceTo(line_geom)
-    
-                    if distance < minimal_distance:
-                        minimal_distance = distance
-                        minimal_distance_line_oid = loid
-
-            print "Minimum distance calculated between point feature %d and line feature %d: %0.2f" % (poid, minimal_distance_line_oid, minimal_distance)
-            
-            arcpy.management.Delete(poi_lyr)
-
-            pnt_min_dist_line_pairs.append((poid, minimal_distance_line_oid, minimal_distance))
-                        
-            print "++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++"
-
-    return pnt_min_dist_line_pairs
-
-def chunks(l, n):
-    u"""
-    Yields successive n-sized chunks from l with the last chunk containing
-    m (< n) elements.
-    """
-    for i in xrange(0, len(l), n):
-        yield l[i : i + n]
-
-def get_equal_parts(lyr, size):
-    u"""
-    Creates oid ranges with given maximum size from specified layer.
-    """
-    print "Creating oid ranges with maximum size %d" % size
-    
-    all_oids = list()
-    
-    with arcpy.da.SearchCursor(lyr, ["OID@"]) as cursor:
-        for oid, in cursor:
-            all_oids.append(oid)
-    
-    print "%d oids found overall" % len(all_oids)
-    equal_parts = list(chunks(sorted(all_oids), size))
-    print "%d oid ranges created" % len(equal_parts)
-    return equal_parts
+    return writer.count
 
 if __name__ == '__main__':
-    equal_parts = get_equal_parts(point_lyr_src, 20)   
-
-    mp_func_data = list()
-    i = 0
-    for eq in equal_parts:
-        i += 1
-        print "part %2d - lower oid bound: %4d - upper oid bound: %4d - size: %2d" % (i, eq[0], eq[-1], len(eq))
-        mp_func_data.append([point_lyr_src, line_lyr_src, eq[0], eq[-1]])
-        
-    # setting up pool of four workers
-    pool = multiprocessing.Pool(4, None, None, 1)
-    # setting up list for all results
-    all_results = list()
-
-    # mapping function for nearest line retrieval (with input data) to worker pool
-    for worker_results in pool.map(find_nearest_line, mp_func_data):
-        all_results.extend(worker_results)
-
-    # closing pool and waiting for each task to be finished
-    pool.close()
-    pool.join()
-    
\ No newline at end of file
+    # using a pool with one worker per processor
+    if tile_size:
+        point_cnt = find_nearest_line_tiled(point_lyr_src, line_lyr_src, result_path, multiprocessing.cpu_count(), tile_size)
+    else:
+        # resuming an interrupted run if requested
+        point_cnt = find_nearest_line(point_lyr_src, line_lyr_src, result_path, line_store_path, multiprocessing.cpu_count(), '--resume' in sys.argv)
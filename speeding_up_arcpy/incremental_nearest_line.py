@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Incremental maintenance of nearest line features after edits of points or
+lines. The results of a previous run are kept as a state along with the
+coordinates of all points, the spatial index is kept in a line store. Given
+inserted, moved and deleted points as well as edited and deleted lines, only
+affected points are queried again: inserted and moved points, points whose
+nearest line was edited or deleted and points whose circle with the stored
+distance as radius is reached by the new geometry of an edited line. All
+other results remain valid, since none of their candidate lines got nearer.
+"""
+
+from __future__ import division, print_function
+
+import json
+import os
+import sqlite3
+import tempfile
+
+import numpy as np
+
+import nearest_line
+import result_writer
+
+# maximum number of point OIDs per delete statement
+DELETE_BATCH_SIZE = 500
+
+
+class NearestLineState(object):
+    u"""
+    Results of nearest line retrieval held in arrays sorted by point OID,
+    i.e. point OIDs and coordinates, OIDs of nearest lines (-1 if there are
+    no lines) and distances (infinite if there are no lines). Additionally
+    the latest edit of any line taken into account may be recorded.
+    """
+
+    def __init__(self, poids, x, y, loids, distances, last_edit=None):
+        self.poids = np.asarray(poids, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.loids = np.asarray(loids, dtype=np.int64)
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.last_edit = last_edit
+
+    def __len__(self):
+        return len(self.poids)
+
+    @classmethod
+    def create(cls, points, line_index, last_edit=None):
+        u"""
+        Creates state by finding nearest lines for all specified points, each
+        of them given as point OID and coordinates.
+        """
+        poids, x, y = get_point_arrays(points)
+        order = np.argsort(poids, kind='mergesort')
+        state = cls(
+            poids[order], x[order], y[order],
+            np.full(len(poids), -1, dtype=np.int64),
+            np.full(len(poids), np.inf), last_edit)
+        state.query(np.arange(len(poids)), line_index)
+        return state
+
+    @classmethod
+    def load(cls, src_path):
+        u"""
+        Loads state from the specified location.
+        """
+        with open(src_path, 'rb') as src_file:
+            arrays = np.load(src_file)
+            return cls(
+                arrays['poids'], arrays['x'], arrays['y'], arrays['loids'],
+                arrays['distances'], json.loads(str(arrays['last_edit'])))
+
+    def save(self, tgt_path):
+        u"""
+        Saves state to the specified location, replacing any existing state
+        at once.
+        """
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(tgt_path)), suffix=".tmp")
+        with os.fdopen(tmp_fd, 'wb') as tmp_file:
+            np.savez(
+                tmp_file, poids=self.poids, x=self.x, y=self.y,
+                loids=self.loids, distances=self.distances,
+                last_edit=json.dumps(self.last_edit))
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        result_writer.replace_file(tmp_path, tgt_path)
+
+    def query(self, points, line_index):
+        u"""
+        Finds nearest lines for the points with the specified indexes and
+        updates their results.
+        """
+        oids = line_index.line_set.oids
+        for start in range(0, len(points), nearest_line.BATCH_SIZE):
+            batch = points[start:start + nearest_line.BATCH_SIZE]
+            lines, distances = line_index.nearest_batch(
+                self.x[batch], self.y[batch])
+            self.loids[batch] = np.where(
+                lines < 0, -1, oids[np.maximum(lines, 0)] if len(
+                    oids) else -1)
+            self.distances[batch] = distances
+
+    def results(self, poids=None):
+        u"""
+        Yields tuples of point OID, OID of nearest line and distance for all
+        points or the points with the specified OIDs.
+        """
+        points = np.arange(len(self.poids))
+        if poids is not None:
+            points = np.searchsorted(self.poids, np.sort(poids))
+        for poid, loid, distance in zip(
+                self.poids[points].tolist(), self.loids[points].tolist(),
+                self.distances[points].tolist()):
+            if loid < 0:
+                yield poid, None, None
+            else:
+                yield poid, loid, distance
+
+
+def get_point_arrays(points):
+    u"""
+    Retrieves arrays of point OIDs and coordinates from the specified
+    iterable of points, each of them given as point OID and coordinates.
+    """
+    poids, x, y = list(), list(), list()
+    for poid, px, py in points:
+        poids.append(poid)
+        x.append(px)
+        y.append(py)
+    return (
+        np.array(poids, dtype=np.int64), np.array(x, dtype=np.float64),
+        np.array(y, dtype=np.float64))
+
+
+def get_point_changes(state, points):
+    u"""
+    Compares all current points, each of them given as point OID and
+    coordinates, with the points of the specified state. Returns inserted
+    and moved points as a list of point OIDs and coordinates, and OIDs of
+    deleted points.
+    """
+    poids, x, y = get_point_arrays(points)
+    points = np.searchsorted(state.poids, poids)
+    is_known = points < len(state.poids)
+    is_known[is_known] = state.poids[points[is_known]] == poids[is_known]
+    is_changed = ~is_known
+    is_changed[is_known] = (state.x[points[is_known]] != x[is_known]) | (
+        state.y[points[is_known]] != y[is_known])
+    deleted_poids = np.setdiff1d(state.poids, poids)
+    return (
+        list(zip(
+            poids[is_changed].tolist(), x[is_changed].tolist(),
+            y[is_changed].tolist())),
+        deleted_poids.tolist())
+
+
+def update_line_index(line_index, edited_lines, deleted_loids=()):
+    u"""
+    Creates line index with the specified edited lines, each of them given
+    as line OID and a list of parts, replacing existing lines with the same
+    OIDs and added otherwise, and without the lines with the specified OIDs.
+    Returns the new index and a line set of the edited lines.
+    """
+    edited_set = nearest_line.LineSet.from_lines(edited_lines)
+    changed_loids = np.union1d(
+        edited_set.oids, np.asarray(deleted_loids, dtype=np.int64))
+    kept_set = line_index.line_set.subset(np.flatnonzero(
+        ~np.isin(line_index.line_set.oids, changed_loids)))
+    return nearest_line.LineIndex(
+        nearest_line.LineSet.concatenate((kept_set, edited_set)),
+        line_index.capacity), edited_set
+
+
+def get_affected_points(state, edited_set, deleted_loids=()):
+    u"""
+    Retrieves indexes of all points of the specified state whose nearest line
+    was edited or deleted, or whose stored distance is reached by any of the
+    edited lines.
+    """
+    changed_loids = np.union1d(
+        edited_set.oids, np.asarray(deleted_loids, dtype=np.int64))
+    is_affected = np.isin(state.loids, changed_loids)
+
+    if len(edited_set.segments):
+        # restricting candidates to points whose distance circles intersect
+        # the extent of all edited lines before calculating exact distances
+        boxes = edited_set.line_boxes
+        xmin, ymin = boxes[:, :2].min(axis=0)
+        xmax, ymax = boxes[:, 2:].max(axis=0)
+        candidates = np.flatnonzero(~is_affected & (
+            state.x + state.distances >= xmin) & (
+                state.x - state.distances <= xmax) & (
+                    state.y + state.distances >= ymin) & (
+                        state.y - state.distances <= ymax))
+
+        edited_index = nearest_line.LineIndex(edited_set)
+        for start in range(0, len(candidates), nearest_line.BATCH_SIZE):
+            batch = candidates[start:start + nearest_line.BATCH_SIZE]
+            _, distances = edited_index.nearest_batch(
+                state.x[batch], state.y[batch])
+            is_affected[batch] = distances <= state.distances[batch]
+
+    return np.flatnonzero(is_affected)
+
+
+def update_state(
+        state, line_index, changed_points=(), deleted_poids=(),
+        edited_lines=(), deleted_loids=()):
+    u"""
+    Updates the specified state and line index after the specified changes,
+    i.e. inserted or moved points given as point OID and coordinates, OIDs of
+    deleted points, inserted or modified lines given as line OID and a list
+    of parts, and OIDs of deleted lines. Only affected points are queried
+    again. Returns the updated state, the updated line index (or the
+    specified one if no lines changed), OIDs of all points with changed
+    results and OIDs of all deleted points.
+    """
+    changed_poids, x, y = get_point_arrays(changed_points)
+    deleted_poids = np.asarray(deleted_poids, dtype=np.int64)
+
+    # removing deleted points as well as previous versions of changed ones
+    # and appending the latter with pending results
+    is_kept = ~np.isin(state.poids, np.union1d(changed_poids, deleted_poids))
+    poids = np.append(state.poids[is_kept], changed_poids)
+    order = np.argsort(poids, kind='mergesort')
+    state = NearestLineState(
+        poids[order], np.append(state.x[is_kept], x)[order],
+        np.append(state.y[is_kept], y)[order],
+        np.append(state.loids[is_kept], np.full(
+            len(changed_poids), -1, dtype=np.int64))[order],
+        np.append(state.distances[is_kept], np.full(
+            len(changed_poids), np.inf))[order],
+        state.last_edit)
+    affected = np.searchsorted(state.poids, changed_poids)
+
+    edited_lines = list(edited_lines)
+    if edited_lines or len(deleted_loids):
+        line_index, edited_set = update_line_index(
+            line_index, edited_lines, deleted_loids)
+        affected = np.union1d(affected, get_affected_points(
+            state, edited_set, deleted_loids))
+
+    state.query(affected, line_index)
+    # deleted points may be inserted again with the same OID
+    deleted_poids = np.setdiff1d(deleted_poids, changed_poids)
+    return state, line_index, state.poids[affected], deleted_poids
+
+
+def update_results(result_path, state, changed_poids, deleted_poids):
+    u"""
+    Updates results at the specified location after changes of the state.
+    Results in an existing SQLite database are updated in place, any other
+    results are written anew from the state.
+    """
+    if result_path.lower().endswith(".csv") or not os.path.isfile(
+            result_path):
+        with result_writer.create_writer(result_path) as writer:
+            for result in state.results():
+                writer.write(result)
+        return
+
+    removed_poids = np.union1d(changed_poids, deleted_poids).tolist()
+    connection = sqlite3.connect(result_path)
+    try:
+        for start in range(0, len(removed_poids), DELETE_BATCH_SIZE):
+            batch = removed_poids[start:start + DELETE_BATCH_SIZE]
+            connection.execute(
+                "DELETE FROM nearest_lines WHERE poid IN (%s)" % ", ".join(
+                    "?" * len(batch)), batch)
+        connection.executemany(
+            "INSERT INTO nearest_lines (%s) VALUES (?, ?, ?)" % ", ".join(
+                result_writer.RESULT_FIELDS), state.results(changed_poids))
+        # results are complete, i.e. there is nothing to be resumed
+        connection.execute(
+            "INSERT OR REPLACE INTO checkpoint VALUES (0, ?, " +
+            "(SELECT COUNT(*) FROM nearest_lines))",
+            (int(state.poids[-1]) if len(state) else None,))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def read_line_oids(src):
+    u"""
+    Reads OIDs of all line features from specified feature class or layer.
+    """
+    import arcpy
+
+    with arcpy.da.SearchCursor(src, ["OID@"]) as cursor:
+        return [loid for loid, in cursor]
+
+
+def get_last_edit(src, edit_fieldname):
+    u"""
+    Retrieves the latest edit date of all features of the specified feature
+    class or layer from the specified editor tracking field, formatted as
+    string.
+    """
+    import arcpy
+
+    with arcpy.da.SearchCursor(src, [edit_fieldname]) as cursor:
+        edits = [edit for edit, in cursor if edit is not None]
+    if not edits:
+        return None
+    return max(edits).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_date_literal(src, date_string):
+    u"""
+    Retrieves literal of the specified date, formatted as string, in the SQL
+    syntax of the workspace of the specified feature class or layer.
+    """
+    import arcpy
+
+    # walking up from feature class and feature dataset to the workspace
+    path = arcpy.Describe(src).catalogPath
+    desc = arcpy.Describe(path)
+    while desc.dataType != 'Workspace' and desc.path and desc.path != path:
+        path = desc.path
+        desc = arcpy.Describe(path)
+
+    workspace_type = getattr(desc, 'workspaceType', None)
+    if workspace_type == 'FileSystem':
+        # shapefiles store dates without time, comparing with the day of the
+        # edit includes all lines edited later on
+        return "date '%s'" % date_string[:10]
+    if workspace_type == 'RemoteDatabase':
+        dbms = getattr(desc.connectionProperties, 'dbclient', '').lower()
+        if dbms == 'oracle':
+            return "TO_DATE('%s', 'YYYY-MM-DD HH24:MI:SS')" % date_string
+        if dbms == 'postgresql':
+            return "TIMESTAMP '%s'" % date_string
+        return "'%s'" % date_string
+    return "date '%s'" % date_string
+
+
+def read_edited_lines(src, edit_fieldname, last_edit):
+    u"""
+    Reads line features from specified feature class or layer that were
+    inserted or modified at or after the specified edit date according to
+    the specified editor tracking field.
+    """
+    import arcpy
+
+    where_clause = None
+    if last_edit is not None:
+        where_clause = "%s >= %s" % (
+            arcpy.AddFieldDelimiters(src, edit_fieldname),
+            get_date_literal(src, last_edit))
+    return nearest_line.read_lines_from_feature_class(src, where_clause)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Compact on-disk store of line features along with their spatial index. All
+arrays of a line index, i.e. flat vertex coordinates, part offsets, OIDs,
+bounding boxes of lines, runs of segments and all levels of the tree, are
+written once to a single file consisting of a short header and aligned raw
+arrays. Opening the store merely memory-maps the file, so neither geometries
+have to be read from the feature class nor the index has to be rebuilt, and
+all processes opening the same store share its pages through the operating
+system cache.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+import nearest_line
+import result_writer
+
+# identifier at the start of each store file
+MAGIC = b"NLSTORE1"
+# version of the store format
+VERSION = 2
+# alignment (in bytes) of arrays within the file
+ALIGNMENT = 64
+
+
+def write_store(tgt_path, line_index, source=None, fingerprint=None):
+    u"""
+    Writes all arrays of the specified line index to a store at the specified
+    location, optionally recording the source the lines were read from and
+    its fingerprint. The store is written to a temporary file first and
+    replaces any existing store at once.
+    """
+    arrays = line_index.to_arrays()
+
+    # laying out arrays relative to the end of the header
+    layout = list()
+    size = 0
+    for key, array in arrays.items():
+        size += -size % ALIGNMENT
+        layout.append((key, array.dtype.str, array.shape, size))
+        size += array.nbytes
+
+    header = json.dumps({
+        'version': VERSION,
+        'capacity': line_index.capacity,
+        'source': source,
+        'fingerprint': fingerprint,
+        'arrays': layout,
+    }).encode('utf-8')
+    header_size = len(MAGIC) + 4 + len(header)
+
+    tmp_fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(tgt_path)), suffix=".tmp")
+    try:
+        with os.fdopen(tmp_fd, 'wb') as tmp_file:
+            tmp_file.write(MAGIC)
+            tmp_file.write(struct.pack('<I', len(header)))
+            tmp_file.write(header)
+            data_start = header_size + -header_size % ALIGNMENT
+            for key, dtype, shape, offset in layout:
+                # padding up to the aligned start of each array
+                tmp_file.write(b"\0" * (
+                    data_start + offset - tmp_file.tell()))
+                np.ascontiguousarray(arrays[key], dtype=dtype).tofile(
+                    tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        result_writer.replace_file(tmp_path, tgt_path)
+    except BaseException:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_header(src_path):
+    u"""
+    Reads header of the store at the specified location. Returns the header
+    and the offset of the first array within the file.
+    """
+    with open(src_path, 'rb') as src_file:
+        magic = src_file.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError("%s is not a line store" % src_path)
+        header_length, = struct.unpack('<I', src_file.read(4))
+        header = json.loads(src_file.read(header_length).decode('utf-8'))
+
+    if header['version'] != VERSION:
+        raise ValueError("Unsupported version %d of line store %s" % (
+            header['version'], src_path))
+    header_size = len(MAGIC) + 4 + header_length
+    return header, header_size + -header_size % ALIGNMENT
+
+
+def open_store(src_path):
+    u"""
+    Opens the store at the specified location. Returns a line index on
+    read-only views of the memory-mapped file, keeping track of the store
+    location.
+    """
+    header, data_start = read_header(src_path)
+    buffer = np.memmap(src_path, dtype=np.uint8, mode='r')
+
+    arrays = dict()
+    for key, dtype, shape, offset in header['arrays']:
+        arrays[key] = np.ndarray(
+            tuple(shape), dtype, buffer, data_start + offset)
+
+    line_index = nearest_line.LineIndex.from_arrays(
+        arrays, header['capacity'])
+    line_index.store_path = src_path
+    return line_index
+
+
+def get_source_fingerprint(src):
+    u"""
+    Retrieves fingerprint of the specified feature class or layer, i.e. the
+    number of features, their extent and the latest edit date if editor
+    tracking is enabled.
+    """
+    import arcpy
+
+    desc = arcpy.Describe(src)
+    last_edit = None
+    if getattr(desc, 'editorTrackingEnabled', False) and desc.editedAtFieldName:
+        with arcpy.da.SearchCursor(src, [desc.editedAtFieldName]) as cursor:
+            edits = [edit for edit, in cursor if edit is not None]
+        if edits:
+            last_edit = max(edits).strftime("%Y-%m-%d %H:%M:%S")
+
+    return {
+        'count': int(arcpy.management.GetCount(src).getOutput(0)),
+        'extent': [
+            desc.extent.XMin, desc.extent.YMin,
+            desc.extent.XMax, desc.extent.YMax],
+        'last_edit': last_edit,
+    }
+
+
+def export_feature_class(
+        src, tgt_path, capacity=nearest_line.NODE_CAPACITY, fingerprint=None):
+    u"""
+    Reads line features from the specified feature class or layer, builds
+    their spatial index and writes it to a store at the specified location
+    along with the fingerprint of the feature class, retrieved before
+    reading unless specified.
+    """
+    if fingerprint is None:
+        fingerprint = get_source_fingerprint(src)
+    line_index = nearest_line.LineIndex(nearest_line.LineSet.from_lines(
+        nearest_line.read_lines_from_feature_class(src)), capacity)
+    write_store(tgt_path, line_index, src, fingerprint)
+
+
+def is_store_valid(store_path, fingerprint):
+    u"""
+    Checks whether the store at the specified location exists, is readable
+    and has been exported from a source with the specified fingerprint.
+    """
+    if not os.path.isfile(store_path):
+        return False
+    try:
+        header, _ = read_header(store_path)
+    except ValueError:
+        # stores of other versions are exported again
+        return False
+    # comparing fingerprints as stored in the header
+    return header.get('fingerprint') == json.loads(json.dumps(fingerprint))
+
+
+def load_line_index(src, store_path=None, validate=True):
+    u"""
+    Retrieves line index for the specified feature class or layer. If a
+    store location is specified, an existing store is opened or otherwise
+    created from the line features. Unless validation is disabled, an
+    existing store is exported again if the fingerprint of the feature class
+    has changed since. Without a store location the index is built in memory.
+    """
+    if store_path is None:
+        return nearest_line.LineIndex(nearest_line.LineSet.from_lines(
+            nearest_line.read_lines_from_feature_class(src)))
+    if validate:
+        fingerprint = get_source_fingerprint(src)
+        if not is_store_valid(store_path, fingerprint):
+            export_feature_class(src, store_path, fingerprint=fingerprint)
+    elif not os.path.isfile(store_path):
+        export_feature_class(src, store_path)
+    return open_store(store_path)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Write line features exported as well-known text to a ' +
+        'memory-mappable line store.')
+    parser.add_argument(
+        'line_file', help='CSV file with line OIDs and geometries')
+    parser.add_argument('store_file', help='Location of line store')
+    parser.add_argument(
+        '--capacity', type=int, default=nearest_line.NODE_CAPACITY,
+        help='Maximum number of entries per node of the spatial index')
+    args = parser.parse_args()
+
+    write_store(args.store_file, nearest_line.LineIndex(
+        nearest_line.LineSet.from_lines(
+            nearest_line.read_lines_from_wkt_file(args.line_file)),
+        args.capacity), args.line_file)
@@ -0,0 +1,804 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Engine to retrieve nearest line features to a set of point features using a
+spatial index. Line geometries are read once into flat coordinate arrays and
+split into short runs of consecutive segments, an R-tree is bulk-loaded over
+the bounding boxes of all runs using the Sort-Tile-Recursive (STR) algorithm
+and queried by a best-first search. Runs are pruned by their bounding boxes
+just like nodes of the tree, so only segments near a point are evaluated
+regardless of the number of vertices of the lines they belong to. Neither
+index nor queries depend on arcpy, the engine may therefore also be used with
+exported geometries on platforms without ArcGIS.
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import csv
+import heapq
+import itertools
+import math
+import re
+import sys
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+# maximum number of entries per node of the spatial index
+NODE_CAPACITY = 16
+# maximum number of consecutive segments per run, i.e. per leaf entry of the
+# spatial index
+RUN_LENGTH = 8
+# names of arrays making up each level of the spatial index
+LEVEL_ARRAYS = ('boxes', 'children', 'offsets')
+# number of points queried at once in batch mode
+BATCH_SIZE = 4096
+# maximum number of point-segment pairs evaluated at once in batch mode
+CHUNK_SIZE = 65536
+# relative tolerance of comparisons between lower and upper distance bounds,
+# covering rounding errors of either bound
+BOUND_TOLERANCE = 1e-12
+
+# line found by a query, along with the nearest point on it and its measure
+# if requested
+Match = namedtuple('Match', 'line distance x y measure')
+
+# regular expressions to parse well-known text (WKT) geometries
+WKT_GEOMETRY_REGEX = re.compile(
+    r"^\s*(POINT|LINESTRING|MULTILINESTRING)\s*(?:Z|M|ZM)?\s*" +
+    r"(\(.*\)|EMPTY)\s*$",
+    re.IGNORECASE)
+WKT_PART_REGEX = re.compile(r"\(([^()]*)\)")
+
+
+class LineSet(object):
+    u"""
+    A set of line features represented by flat arrays, i.e. vertex
+    coordinates, offsets of all parts into the vertex array and indexes of the
+    line each part belongs to. Segments are derived from consecutive vertices
+    of each part.
+    """
+
+    def __init__(
+            self, oids, coords, part_offsets, part_lines, segments=None,
+            segment_lines=None, line_boxes=None):
+        self.oids = np.asarray(oids, dtype=np.int64)
+        self.coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        self.part_offsets = np.asarray(part_offsets, dtype=np.int64)
+        self.part_lines = np.asarray(part_lines, dtype=np.int64)
+
+        if segments is None or segment_lines is None:
+            # each vertex but the last one of a part starts a segment
+            is_segment_start = np.ones(len(self.coords), dtype=bool)
+            is_segment_start[self.part_offsets[1:] - 1] = False
+            segment_starts = np.flatnonzero(is_segment_start)
+            # retrieving line index for each segment
+            segment_lines = self.part_lines[np.searchsorted(
+                self.part_offsets, segment_starts, side='right') - 1]
+            # setting up segment coordinates as rows of x0, y0, x1, y1
+            segments = np.hstack((
+                self.coords[segment_starts], self.coords[segment_starts + 1]))
+        self.segments = segments
+        self.segment_lines = segment_lines
+        self._line_boxes = line_boxes
+        self._segment_measures = None
+
+    def __len__(self):
+        return len(self.oids)
+
+    @classmethod
+    def from_lines(cls, lines):
+        u"""
+        Creates line set from specified iterable of line features, each of
+        them given as line OID and a list of parts, i.e. sequences of
+        coordinate pairs.
+        """
+        oids = list()
+        coords = list()
+        part_offsets = [0]
+        part_lines = list()
+
+        for loid, parts in lines:
+            for part in parts:
+                if not len(part):
+                    continue
+                coords.extend(part)
+                part_offsets.append(len(coords))
+                part_lines.append(len(oids))
+            oids.append(loid)
+
+        return cls(oids, coords, part_offsets, part_lines)
+
+    @classmethod
+    def concatenate(cls, line_sets):
+        u"""
+        Creates line set consisting of all lines of the specified line sets,
+        one after another.
+        """
+        oids, coords, part_lines = list(), list(), list()
+        part_offsets = [np.zeros(1, dtype=np.int64)]
+        vertex_cnt = line_cnt = 0
+        for line_set in line_sets:
+            oids.append(line_set.oids)
+            coords.append(line_set.coords)
+            part_offsets.append(line_set.part_offsets[1:] + vertex_cnt)
+            part_lines.append(line_set.part_lines + line_cnt)
+            vertex_cnt += len(line_set.coords)
+            line_cnt += len(line_set.oids)
+        return cls(
+            np.concatenate(oids), np.concatenate(coords),
+            np.concatenate(part_offsets), np.concatenate(part_lines))
+
+    @property
+    def line_boxes(self):
+        u"""
+        Retrieves bounding boxes of all lines as rows of xmin, ymin, xmax,
+        ymax. Lines without any parts have inverted infinite boxes.
+        """
+        if self._line_boxes is None:
+            boxes = np.empty((len(self.oids), 4))
+            boxes[:, :2] = np.inf
+            boxes[:, 2:] = -np.inf
+            if len(self.part_lines):
+                np.minimum.at(
+                    boxes[:, :2], self.part_lines, np.minimum.reduceat(
+                        self.coords, self.part_offsets[:-1]))
+                np.maximum.at(
+                    boxes[:, 2:], self.part_lines, np.maximum.reduceat(
+                        self.coords, self.part_offsets[:-1]))
+            self._line_boxes = boxes
+        return self._line_boxes
+
+    def subset(self, lines):
+        u"""
+        Creates line set consisting of the lines with the specified indexes,
+        keeping their original order.
+        """
+        lines = np.unique(np.asarray(lines, dtype=np.int64))
+        parts = np.flatnonzero(np.isin(self.part_lines, lines))
+        # collecting vertex ranges of all selected parts
+        starts = self.part_offsets[parts]
+        counts = self.part_offsets[parts + 1] - starts
+        vertices = np.repeat(starts - np.cumsum(counts) + counts, counts) + (
+            np.arange(counts.sum()))
+        return LineSet(
+            self.oids[lines], self.coords[vertices],
+            np.append(0, np.cumsum(counts)),
+            np.searchsorted(lines, self.part_lines[parts]))
+
+    @property
+    def segment_measures(self):
+        u"""
+        Retrieves measures of all segment start points, i.e. their distances
+        along the according line, with the parts of a line following each
+        other.
+        """
+        if self._segment_measures is None:
+            lengths = np.hypot(
+                self.segments[:, 2] - self.segments[:, 0],
+                self.segments[:, 3] - self.segments[:, 1])
+            measures = np.cumsum(lengths) - lengths
+            # starting over at the first segment of each line
+            line_starts = get_group_starts(self.segment_lines)
+            self._segment_measures = measures - np.repeat(
+                measures[line_starts], np.diff(np.append(
+                    line_starts, len(measures))))
+        return self._segment_measures
+
+    @property
+    def segment_boxes(self):
+        u"""
+        Retrieves bounding boxes of all segments as rows of xmin, ymin, xmax,
+        ymax.
+        """
+        return np.hstack((
+            np.minimum(self.segments[:, :2], self.segments[:, 2:]),
+            np.maximum(self.segments[:, :2], self.segments[:, 2:])))
+
+
+def calculate_segment_projections(x, y, segments):
+    u"""
+    Calculates distances between the specified point and all specified
+    segments along with the relative positions of the nearest points on the
+    segments. Point coordinates may also be given as arrays holding one point
+    per segment. Degenerate segments are treated as points.
+    """
+    dx = segments[:, 2] - segments[:, 0]
+    dy = segments[:, 3] - segments[:, 1]
+    length_sq = dx * dx + dy * dy
+    # projecting point onto each segment, clamped to the segment's vertices
+    t = np.zeros_like(length_sq)
+    np.divide(
+        (x - segments[:, 0]) * dx + (y - segments[:, 1]) * dy, length_sq,
+        out=t, where=length_sq > 0)
+    np.clip(t, 0., 1., out=t)
+    distances = np.hypot(
+        x - (segments[:, 0] + t * dx), y - (segments[:, 1] + t * dy))
+    return distances, t
+
+
+def calculate_segment_distances(x, y, segments):
+    u"""
+    Calculates distances between the specified point and all specified
+    segments. Point coordinates may also be given as arrays holding one point
+    per segment.
+    """
+    return calculate_segment_projections(x, y, segments)[0]
+
+
+def calculate_box_distances(x, y, boxes):
+    u"""
+    Calculates minimum distances between the specified point and all
+    specified bounding boxes, i.e. lower bounds of the distances to all
+    geometries contained within.
+    """
+    dx = np.maximum(np.maximum(boxes[:, 0] - x, x - boxes[:, 2]), 0.)
+    dy = np.maximum(np.maximum(boxes[:, 1] - y, y - boxes[:, 3]), 0.)
+    return np.hypot(dx, dy)
+
+
+def calculate_box_max_distances(x, y, boxes):
+    u"""
+    Calculates upper bounds of the distances between the specified point and
+    the nearest geometry within each of the specified bounding boxes. As each
+    side of a bounding box touches a contained geometry, this is the smaller
+    of the distances to the farther end of the nearer side in either
+    direction (MINMAXDIST).
+    """
+    center_x = (boxes[:, 0] + boxes[:, 2]) * 0.5
+    center_y = (boxes[:, 1] + boxes[:, 3]) * 0.5
+    near_dx = np.where(x <= center_x, boxes[:, 0], boxes[:, 2]) - x
+    near_dy = np.where(y <= center_y, boxes[:, 1], boxes[:, 3]) - y
+    far_dx = np.where(x >= center_x, boxes[:, 0], boxes[:, 2]) - x
+    far_dy = np.where(y >= center_y, boxes[:, 1], boxes[:, 3]) - y
+    return np.minimum(np.hypot(near_dx, far_dy), np.hypot(far_dx, near_dy))
+
+
+def get_segment_runs(segments, segment_lines, run_length):
+    u"""
+    Splits specified segments into runs of at most specified length, each of
+    them consisting of connected consecutive segments of the same line.
+    Returns offsets of all runs into the segments.
+    """
+    is_start = np.ones(len(segments), dtype=bool)
+    is_start[1:] = (segment_lines[1:] != segment_lines[:-1]) | np.any(
+        segments[1:, :2] != segments[:-1, 2:], axis=1)
+    group_starts = np.flatnonzero(is_start)
+    positions = np.arange(len(segments)) - np.repeat(
+        group_starts, np.diff(np.append(group_starts, len(segments))))
+    return np.append(
+        np.flatnonzero(positions % run_length == 0), len(segments))
+
+
+def get_group_starts(values):
+    u"""
+    Retrieves start indexes of all groups of equal consecutive values.
+    """
+    is_start = np.ones(len(values), dtype=bool)
+    is_start[1:] = values[1:] != values[:-1]
+    return np.flatnonzero(is_start)
+
+
+def expand_pairs(pair_points, pair_nodes, children, offsets):
+    u"""
+    Expands specified pairs of point and node indexes to pairs of point and
+    child indexes, keeping the order of points. Without ordered children,
+    the children of each node are given by the range of its offsets.
+    """
+    counts = offsets[pair_nodes + 1] - offsets[pair_nodes]
+    # calculating position of each child within the node's children
+    positions = np.arange(counts.sum()) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+    pair_children = np.repeat(offsets[pair_nodes], counts) + positions
+    if children is not None:
+        pair_children = children[pair_children]
+    return np.repeat(pair_points, counts), pair_children
+
+
+def pack_boxes(boxes, capacity):
+    u"""
+    Groups specified bounding boxes into nodes of specified capacity using
+    the Sort-Tile-Recursive algorithm. Returns the order of the boxes and
+    offsets of each node into this order.
+    """
+    box_cnt = len(boxes)
+    node_cnt = int(math.ceil(box_cnt / capacity))
+    slice_cnt = int(math.ceil(math.sqrt(node_cnt)))
+
+    center_x = (boxes[:, 0] + boxes[:, 2]) * 0.5
+    center_y = (boxes[:, 1] + boxes[:, 3]) * 0.5
+
+    # sorting boxes by x coordinate of their centers into vertical slices...
+    order = np.argsort(center_x, kind='mergesort')
+    slices = np.arange(box_cnt) // (slice_cnt * capacity)
+    # ...and by y coordinate within each slice
+    order = order[np.lexsort((center_y[order], slices))]
+
+    offsets = np.append(np.arange(0, box_cnt, capacity), box_cnt)
+    return order, offsets
+
+
+class LineIndex(object):
+    u"""
+    An R-tree over runs of consecutive segments of a line set, bulk-loaded
+    using the Sort-Tile-Recursive algorithm. Runs are given by their offsets
+    into the segments and their bounding boxes. The tree is stored level-wise
+    starting with the leaves, each level consisting of the bounding boxes of
+    its nodes, the ordered indexes of their children (runs for the leaf
+    level) and offsets of each node into these.
+    """
+
+    def __init__(
+            self, line_set, capacity=NODE_CAPACITY, levels=None,
+            run_offsets=None, run_boxes=None, run_length=RUN_LENGTH):
+        self.line_set = line_set
+        self.capacity = capacity
+        if run_offsets is None or run_boxes is None:
+            run_offsets = get_segment_runs(
+                line_set.segments, line_set.segment_lines, run_length)
+            segment_boxes = line_set.segment_boxes
+            run_boxes = np.hstack((
+                np.minimum.reduceat(segment_boxes[:, :2], run_offsets[:-1]),
+                np.maximum.reduceat(segment_boxes[:, 2:], run_offsets[:-1])
+            )) if len(segment_boxes) else np.empty((0, 4))
+        self.run_offsets = run_offsets
+        self.run_boxes = run_boxes
+        if levels is None:
+            levels = self.build_levels(run_boxes, capacity)
+        self.levels = levels
+
+    def to_arrays(self):
+        u"""
+        Retrieves all arrays of line set and tree by name.
+        """
+        arrays = OrderedDict()
+        for key in (
+                'oids', 'coords', 'part_offsets', 'part_lines', 'segments',
+                'segment_lines', 'line_boxes'):
+            arrays[key] = getattr(self.line_set, key)
+        arrays['run_offsets'] = self.run_offsets
+        arrays['run_boxes'] = self.run_boxes
+        for i, level in enumerate(self.levels):
+            for key, array in zip(LEVEL_ARRAYS, level):
+                arrays["level_%d_%s" % (i, key)] = array
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, capacity=NODE_CAPACITY):
+        u"""
+        Creates index from specified arrays by name, e.g. views on a shared
+        memory block, without copying or rebuilding anything.
+        """
+        line_set = LineSet(*[arrays.get(key) for key in (
+            'oids', 'coords', 'part_offsets', 'part_lines', 'segments',
+            'segment_lines', 'line_boxes')])
+        levels = list()
+        while "level_%d_boxes" % len(levels) in arrays:
+            levels.append(tuple(
+                arrays["level_%d_%s" % (len(levels), key)] for
+                key in LEVEL_ARRAYS))
+        return cls(
+            line_set, capacity, levels, arrays['run_offsets'],
+            arrays['run_boxes'])
+
+    @staticmethod
+    def build_levels(boxes, capacity):
+        u"""
+        Builds levels of the tree bottom-up from specified bounding boxes of
+        its leaf entries.
+        """
+        levels = list()
+        while len(boxes):
+            order, offsets = pack_boxes(boxes, capacity)
+            ordered_boxes = boxes[order]
+            boxes = np.hstack((
+                np.minimum.reduceat(ordered_boxes[:, :2], offsets[:-1]),
+                np.maximum.reduceat(ordered_boxes[:, 2:], offsets[:-1])))
+            levels.append((boxes, order, offsets))
+            if len(boxes) == 1:
+                break
+        return levels
+
+    def nearest(self, x, y):
+        u"""
+        Finds line nearest to the specified point using a best-first search.
+        Returns index of the line and distance, ties are resolved in favor of
+        the lower line index.
+        """
+        if not self.levels:
+            return None, None
+
+        best_distance = np.inf
+        best_line = None
+
+        # queue of nodes and runs (level -1) to visit, ordered by their
+        # distance lower bounds
+        queue = [(0., len(self.levels) - 1, 0)]
+        while queue:
+            lower_bound, level, node = heapq.heappop(queue)
+            # no remaining entry may contain a line closer than the best one
+            if lower_bound > best_distance:
+                break
+
+            if level < 0:
+                # calculating distances to all segments of the run, all of
+                # them belonging to the same line
+                distances = calculate_segment_distances(
+                    x, y, self.line_set.segments[
+                        self.run_offsets[node]:self.run_offsets[node + 1]])
+                distance = float(distances.min())
+                line = int(self.line_set.segment_lines[
+                    self.run_offsets[node]])
+                if distance < best_distance or (
+                        distance == best_distance and line < best_line):
+                    best_distance = distance
+                    best_line = line
+                continue
+
+            # pushing children, i.e. nodes or runs, that may contain a
+            # closer line
+            boxes, children, offsets = self.levels[level]
+            children = children[offsets[node]:offsets[node + 1]]
+            child_boxes = self.levels[level - 1][0][
+                children] if level else self.run_boxes[children]
+            distances = calculate_box_distances(x, y, child_boxes)
+            for child, distance in zip(children, distances):
+                if distance <= best_distance:
+                    heapq.heappush(
+                        queue, (float(distance), level - 1, int(child)))
+
+        return best_line, best_distance
+
+    def query(self, x, y, k=1, max_distance=None, snap=False):
+        u"""
+        Finds the specified number of lines nearest to the specified point,
+        optionally restricted to lines within the specified maximum distance.
+        If no number of lines is specified, all lines within the maximum
+        distance are found. Nodes farther away than the maximum distance or
+        the k-th nearest line found so far are never visited. If specified,
+        the nearest point on each line and its measure along the line are
+        determined as well. Returns list of matches ordered by distance and
+        line index.
+        """
+        if k is None and max_distance is None:
+            raise ValueError(
+                "Number of lines or maximum distance need to be specified")
+        if not self.levels:
+            return list()
+
+        limit = np.inf if max_distance is None else float(max_distance)
+        threshold = limit
+        # distance, segment and relative position on segment by line
+        found = dict()
+
+        # queue of nodes and runs (level -1) to visit, ordered by their
+        # distance lower bounds
+        queue = [(0., len(self.levels) - 1, 0)]
+        while queue:
+            lower_bound, level, node = heapq.heappop(queue)
+            # no remaining entry may contain a line closer than the threshold
+            if lower_bound > threshold:
+                break
+
+            if level >= 0:
+                # pushing children, i.e. nodes or runs, that may contain a
+                # line within the threshold
+                boxes, children, offsets = self.levels[level]
+                children = children[offsets[node]:offsets[node + 1]]
+                child_boxes = self.levels[level - 1][0][
+                    children] if level else self.run_boxes[children]
+                distances = calculate_box_distances(x, y, child_boxes)
+                for child, distance in zip(children, distances):
+                    if distance <= threshold:
+                        heapq.heappush(
+                            queue, (float(distance), level - 1, int(child)))
+                continue
+
+            start = int(self.run_offsets[node])
+            end = int(self.run_offsets[node + 1])
+            line = int(self.line_set.segment_lines[start])
+            # abandoning runs that can not get closer than the nearest
+            # segment of their line found so far
+            if line in found and found[line][0] < lower_bound:
+                continue
+
+            # calculating distances to all segments of the run, retaining
+            # the nearest segment of its line
+            distances, positions = calculate_segment_projections(
+                x, y, self.line_set.segments[start:end])
+            i = int(np.argmin(distances))
+            distance = float(distances[i])
+            if distance <= limit and (
+                    line not in found or
+                    (distance, start + i) < found[line][:2]):
+                found[line] = (distance, start + i, float(positions[i]))
+
+            # narrowing threshold to the distance of the k-th nearest line
+            if k is not None and len(found) >= k:
+                threshold = min(limit, heapq.nsmallest(
+                    k, (item[0] for item in found.values()))[-1])
+
+        matches = list()
+        for line, (distance, segment, position) in sorted(
+                found.items(), key=lambda item: (item[1][0], item[0]))[:k]:
+            if snap:
+                x0, y0, x1, y1 = self.line_set.segments[segment].tolist()
+                matches.append(Match(
+                    line, distance, x0 + position * (x1 - x0),
+                    y0 + position * (y1 - y0),
+                    float(self.line_set.segment_measures[segment]) +
+                    position * math.hypot(x1 - x0, y1 - y0)))
+            else:
+                matches.append(Match(line, distance, None, None, None))
+
+        return matches
+
+    def nearest_batch(self, x, y, max_distance=None, chunk_size=CHUNK_SIZE):
+        u"""
+        Finds lines nearest to all specified points at once, optionally
+        restricted to lines within the specified maximum distance. The tree is
+        traversed level-wise for all points simultaneously down to the runs
+        of segments, discarding nodes and runs whose distance lower bound
+        exceeds the smallest upper bound found for the according point or the
+        maximum distance. Distances to the segments of the remaining runs are
+        calculated in chunks of point-segment pairs.
+        Returns arrays of line indexes (-1 if there is no line) and distances,
+        ties are resolved in favor of the lower line index.
+        """
+        limit = np.inf if max_distance is None else float(max_distance)
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        best_lines = np.full(len(x), -1, dtype=np.int64)
+        best_distances = np.full(len(x), np.inf)
+        if not self.levels or not len(x):
+            return best_lines, best_distances
+
+        # starting with the root node for all points, descending down to
+        # runs of segments
+        pair_points = np.arange(len(x))
+        pair_nodes = np.zeros(len(x), dtype=np.int64)
+        for level in range(len(self.levels) - 1, -1, -1):
+            _, children, offsets = self.levels[level]
+            pair_points, pair_nodes = expand_pairs(
+                pair_points, pair_nodes, children, offsets)
+            child_boxes = self.levels[level - 1][0][
+                pair_nodes] if level else self.run_boxes[pair_nodes]
+            lower_bounds = calculate_box_distances(
+                x[pair_points], y[pair_points], child_boxes)
+            upper_bounds = calculate_box_max_distances(
+                x[pair_points], y[pair_points], child_boxes)
+            # pairs are grouped by point, each point retains at least the
+            # node with the smallest upper bound unless it is beyond the
+            # maximum distance, bounds of degenerate boxes may be equal but
+            # rounded differently
+            group_starts = get_group_starts(pair_points)
+            point_upper_bounds = np.minimum(np.minimum.reduceat(
+                upper_bounds, group_starts), limit) * (1. + BOUND_TOLERANCE)
+            is_candidate = lower_bounds <= np.repeat(
+                point_upper_bounds, np.diff(np.append(
+                    group_starts, len(pair_points))))
+            pair_points = pair_points[is_candidate]
+            pair_nodes = pair_nodes[is_candidate]
+
+        # expanding runs to their segments
+        pair_points, pair_segments = expand_pairs(
+            pair_points, pair_nodes, None, self.run_offsets)
+
+        for start in range(0, len(pair_points), chunk_size):
+            points = pair_points[start:start + chunk_size]
+            segments = pair_segments[start:start + chunk_size]
+            distances = calculate_segment_distances(
+                x[points], y[points], self.line_set.segments[segments])
+            lines = self.line_set.segment_lines[segments]
+
+            # reducing chunk to the best pair of each point...
+            group_starts = get_group_starts(points)
+            group_sizes = np.diff(np.append(group_starts, len(points)))
+            min_distances = np.minimum.reduceat(distances, group_starts)
+            lines = np.minimum.reduceat(np.where(
+                distances == np.repeat(min_distances, group_sizes),
+                lines, np.iinfo(np.int64).max), group_starts)
+            points = points[group_starts]
+            distances = min_distances
+            # ...and merging with results of previous chunks
+            is_better = (distances < best_distances[points]) | (
+                (distances == best_distances[points]) &
+                (lines < best_lines[points]))
+            best_distances[points[is_better]] = distances[is_better]
+            best_lines[points[is_better]] = lines[is_better]
+
+        is_beyond = best_distances > limit
+        best_lines[is_beyond] = -1
+        best_distances[is_beyond] = np.inf
+
+        return best_lines, best_distances
+
+
+def get_batches(iterable, size):
+    u"""
+    Yields successive lists of specified size from specified iterable with
+    the last list containing the remaining elements.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def find_nearest_lines(
+        points, line_index, max_distance=None, batch_size=BATCH_SIZE):
+    u"""
+    Finds nearest lines for all specified points, each of them given as point
+    OID and coordinates, optionally restricted to lines within the specified
+    maximum distance. Points are queried in batches. Yields tuples of point
+    OID, OID of nearest line and distance.
+    """
+    oids = line_index.line_set.oids
+    for batch in get_batches(points, batch_size):
+        _, x, y = zip(*batch)
+        lines, distances = line_index.nearest_batch(x, y, max_distance)
+        for (poid, _, _), line, distance in zip(batch, lines, distances):
+            if line < 0:
+                yield poid, None, None
+            else:
+                yield poid, int(oids[line]), float(distance)
+
+
+def query_nearest_lines(
+        points, line_index, k=1, max_distance=None, snap=False):
+    u"""
+    Finds the specified number of nearest lines and/or all lines within the
+    specified maximum distance for all specified points, each of them given
+    as point OID and coordinates. Yields tuples of point OID, line OID and
+    distance for each line found, extended by coordinates of the nearest
+    point on the line and its measure if specified. Points without any line
+    found yield a single tuple without line.
+    """
+    oids = line_index.line_set.oids
+    for poid, x, y in points:
+        matches = line_index.query(x, y, k, max_distance, snap)
+        if not matches:
+            yield (poid, None, None) + ((None, None, None) if snap else ())
+        for match in matches:
+            result = (poid, int(oids[match.line]), match.distance)
+            if snap:
+                result += (match.x, match.y, match.measure)
+            yield result
+
+
+def parse_wkt(wkt):
+    u"""
+    Parses specified point or (multi-)linestring well-known text. Returns a
+    list of parts, i.e. lists of coordinate pairs.
+    """
+    match = WKT_GEOMETRY_REGEX.search(wkt)
+    if match is None:
+        raise ValueError("Unsupported geometry: %s" % wkt[:50])
+    parts = list()
+    for part in WKT_PART_REGEX.findall(match.group(2)):
+        if not part.strip():
+            continue
+        # ignoring z and m values
+        parts.append([
+            tuple(float(value) for value in vertex.split()[:2]) for
+            vertex in part.split(",")])
+    return parts
+
+
+def read_lines_from_wkt_file(src_path):
+    u"""
+    Reads line features from a CSV file with line OID and well-known text of
+    the geometry in each row.
+    """
+    with open(src_path) as src_file:
+        for loid, wkt in csv.reader(src_file):
+            yield int(loid), parse_wkt(wkt)
+
+
+def read_points_from_wkt_file(src_path):
+    u"""
+    Reads point features from a CSV file with point OID and well-known text
+    of the geometry in each row.
+    """
+    with open(src_path) as src_file:
+        for poid, wkt in csv.reader(src_file):
+            parts = parse_wkt(wkt)
+            if parts:
+                yield (int(poid),) + parts[0][0]
+
+
+def read_lines_from_feature_class(src, where_clause=None):
+    u"""
+    Reads line features from specified feature class or layer, optionally
+    restricted to features matching the specified where clause.
+    """
+    import arcpy
+
+    with arcpy.da.SearchCursor(
+            src, ["OID@", "SHAPE@"], where_clause) as cursor:
+        for loid, geom in cursor:
+            if geom is None:
+                continue
+            yield loid, [
+                [(pnt.X, pnt.Y) for pnt in part if pnt is not None] for
+                part in geom]
+
+
+def read_points_from_feature_class(src, min_oid=None):
+    u"""
+    Reads point features from specified feature class or layer in order of
+    their OIDs, optionally restricted to OIDs greater than the specified one.
+    """
+    import arcpy
+
+    oid_fieldname = arcpy.Describe(src).OIDFieldName
+    where_clause = None
+    if min_oid is not None:
+        where_clause = "%s > %d" % (oid_fieldname, min_oid)
+
+    with arcpy.da.SearchCursor(
+            src, ["OID@", "SHAPE@XY"], where_clause,
+            sql_clause=(None, "ORDER BY %s" % oid_fieldname)) as cursor:
+        for poid, (x, y) in cursor:
+            if x is not None:
+                yield poid, x, y
+
+
+def export_to_wkt_file(src, tgt_path):
+    u"""
+    Exports features of specified feature class or layer to a CSV file with
+    OID and well-known text of the geometry in each row.
+    """
+    import arcpy
+
+    with open(tgt_path, 'w') as tgt_file:
+        writer = csv.writer(tgt_file)
+        with arcpy.da.SearchCursor(src, ["OID@", "SHAPE@WKT"]) as cursor:
+            for oid, wkt in cursor:
+                if wkt is not None:
+                    writer.writerow((oid, wkt))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+        description='Find nearest line features to a set of point ' +
+        'features exported as well-known text.')
+    parser.add_argument(
+        'point_file', help='CSV file with point OIDs and geometries')
+    parser.add_argument(
+        'line_file', help='CSV file with line OIDs and geometries')
+    parser.add_argument(
+        '-k', type=int, default=1, help='Number of nearest lines per point')
+    parser.add_argument(
+        '--max-distance', type=float,
+        help='Maximum distance between points and lines')
+    parser.add_argument(
+        '--all', dest='all_within', action='store_true',
+        help='Find all lines within maximum distance')
+    parser.add_argument(
+        '--snap', action='store_true',
+        help='Retrieve nearest points on lines and their measures')
+    args = parser.parse_args()
+
+    if args.all_within and args.max_distance is None:
+        parser.error("--all requires --max-distance")
+
+    line_index = LineIndex(LineSet.from_lines(
+        read_lines_from_wkt_file(args.line_file)))
+    points = read_points_from_wkt_file(args.point_file)
+
+    writer = csv.writer(sys.stdout)
+    if args.k == 1 and not args.all_within and not args.snap:
+        results = find_nearest_lines(points, line_index, args.max_distance)
+    else:
+        results = query_nearest_lines(
+            points, line_index, None if args.all_within else args.k,
+            args.max_distance, args.snap)
+    for result in results:
+        writer.writerow(result)
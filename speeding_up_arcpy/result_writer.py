@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Streaming writers for results of nearest line retrieval. Results are written
+in batches to a CSV file or an SQLite database while the retrieval is still
+running. Checkpoints recording the last completed point OID are taken
+periodically, allowing to resume an interrupted run by skipping all points up
+to this OID. Additionally a reporter for throttled progress output is
+provided.
+"""
+
+from __future__ import division, print_function
+
+import csv
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+# number of results written at once
+BATCH_SIZE = 10000
+# minimum interval (in seconds) between checkpoints
+CHECKPOINT_INTERVAL = 30
+# minimum interval (in seconds) between progress reports
+PROGRESS_INTERVAL = 10
+
+# column names of results, optionally extended by the nearest point on the
+# line and its measure
+RESULT_FIELDS = ('poid', 'loid', 'distance')
+SNAP_FIELDS = ('x', 'y', 'measure')
+# SQLite column types of all fields
+FIELD_TYPES = {
+    'poid': 'INTEGER',
+    'loid': 'INTEGER',
+    'distance': 'REAL',
+    'x': 'REAL',
+    'y': 'REAL',
+    'measure': 'REAL',
+}
+
+
+def replace_file(src_path, tgt_path):
+    u"""
+    Moves specified file to the specified target location, replacing any
+    existing file.
+    """
+    if hasattr(os, 'replace'):
+        os.replace(src_path, tgt_path)
+    else:
+        # renaming does not replace existing files on Windows
+        if os.path.isfile(tgt_path):
+            os.remove(tgt_path)
+        os.rename(src_path, tgt_path)
+
+
+class ResultWriter(object):
+    u"""
+    Base class of writers streaming results to a durable sink. Results have
+    to be written in ascending order of point OIDs unless the writer is set
+    up as unordered, which rules out resuming. Multiple results for a point
+    are written consecutively. Pending results are written whenever a batch
+    is complete, a checkpoint is taken along with the first batch after the
+    checkpoint interval elapsed and on closing the writer.
+    """
+
+    def __init__(
+            self, tgt_path, resume=False, ordered=True, fields=RESULT_FIELDS,
+            batch_size=BATCH_SIZE, checkpoint_interval=CHECKPOINT_INTERVAL):
+        if resume and not ordered:
+            raise ValueError("Unordered results can not be resumed")
+        self.tgt_path = tgt_path
+        self.ordered = ordered
+        self.fields = tuple(fields)
+        self.batch_size = batch_size
+        self.checkpoint_interval = checkpoint_interval
+        self.pending = list()
+        # OID of the last result written and overall number of results
+        self.last_oid = None
+        self.count = 0
+
+        if resume:
+            self.last_oid, self.count = self.open_sink(resume=True)
+        else:
+            self.open_sink(resume=False)
+        self.last_checkpoint = time.time()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # results retrieved so far are valid even if the run failed
+        self.close()
+
+    def write(self, result):
+        u"""
+        Registers specified result, i.e. a tuple of point OID, OID of nearest
+        line, distance and further fields, for writing.
+        """
+        last_oid = self.pending[-1][0] if self.pending else self.last_oid
+        # results of a point may only follow pending results of the point
+        if self.ordered and last_oid is not None and (
+                result[0] < last_oid or
+                result[0] == last_oid and not self.pending):
+            raise ValueError(
+                "Results need to be written in ascending order of point " +
+                "OIDs: %d after %d" % (result[0], last_oid))
+        # keeping all results of a point within the same batch
+        if len(self.pending) >= self.batch_size and result[0] != last_oid:
+            self.flush()
+        self.pending.append(result)
+
+    def flush(self, checkpoint=False):
+        u"""
+        Writes all pending results and takes a checkpoint if specified or if
+        the checkpoint interval elapsed.
+        """
+        if self.pending:
+            self.write_rows(self.pending)
+            self.last_oid = self.pending[-1][0]
+            self.count += len(self.pending)
+            self.pending = list()
+        elapsed = time.time() - self.last_checkpoint
+        if checkpoint or elapsed >= self.checkpoint_interval:
+            self.checkpoint()
+            self.last_checkpoint = time.time()
+
+    def close(self):
+        u"""
+        Writes all pending results, takes a final checkpoint and closes the
+        sink.
+        """
+        self.flush(checkpoint=True)
+        self.close_sink()
+
+    def open_sink(self, resume):
+        u"""
+        Opens sink, discarding all previous results unless the run is to be
+        resumed. In that case results beyond the last checkpoint are
+        discarded and OID of the last result and overall number of results
+        are returned.
+        """
+        raise NotImplementedError
+
+    def write_rows(self, rows):
+        u"""
+        Writes specified results to the sink.
+        """
+        raise NotImplementedError
+
+    def checkpoint(self):
+        u"""
+        Makes all results written so far durable and records OID of the last
+        result.
+        """
+        raise NotImplementedError
+
+    def close_sink(self):
+        u"""
+        Closes the sink.
+        """
+        raise NotImplementedError
+
+
+class CSVResultWriter(ResultWriter):
+    u"""
+    A writer streaming results to a CSV file. Checkpoints are recorded in a
+    JSON file next to it, along with the size of the CSV file at that point.
+    """
+
+    def open_sink(self, resume):
+        self.checkpoint_path = "%s.checkpoint" % self.tgt_path
+        last_oid, count, size = None, 0, 0
+        if resume and os.path.isfile(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            last_oid, count, size = (
+                checkpoint['last_oid'], checkpoint['count'],
+                checkpoint['size'])
+
+        # the csv module expects files in binary mode in Python 2
+        if sys.version_info[0] < 3:
+            self.tgt_file = open(self.tgt_path, 'r+b' if size else 'wb')
+        else:
+            self.tgt_file = open(
+                self.tgt_path, 'r+' if size else 'w', newline='')
+        self.writer = csv.writer(self.tgt_file)
+
+        if size:
+            # discarding everything written after the last checkpoint
+            self.tgt_file.seek(size)
+            self.tgt_file.truncate()
+        else:
+            self.writer.writerow(self.fields)
+            self.checkpoint_state(None, 0)
+
+        return last_oid, count
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def checkpoint(self):
+        self.checkpoint_state(self.last_oid, self.count)
+
+    def checkpoint_state(self, last_oid, count):
+        u"""
+        Makes CSV file durable and atomically records specified state.
+        """
+        self.tgt_file.flush()
+        os.fsync(self.tgt_file.fileno())
+
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.checkpoint_path)),
+            suffix=".tmp")
+        with os.fdopen(tmp_fd, 'w') as tmp_file:
+            json.dump({
+                'last_oid': last_oid,
+                'count': count,
+                'size': self.tgt_file.tell(),
+            }, tmp_file)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        replace_file(tmp_path, self.checkpoint_path)
+
+    def close_sink(self):
+        self.tgt_file.close()
+
+
+class SQLiteResultWriter(ResultWriter):
+    u"""
+    A writer streaming results to an SQLite database. Results are inserted
+    within a transaction that is committed along with the checkpoint.
+    """
+
+    def open_sink(self, resume):
+        self.connection = sqlite3.connect(self.tgt_path)
+        if not resume:
+            self.connection.execute("DROP TABLE IF EXISTS nearest_lines")
+            self.connection.execute("DROP TABLE IF EXISTS checkpoint")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS nearest_lines (%s)" % ", ".join(
+                "%s %s" % (field, FIELD_TYPES[field]) for
+                field in self.fields))
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS nearest_lines_poid " +
+            "ON nearest_lines (poid)")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint (" +
+            "id INTEGER PRIMARY KEY CHECK (id = 0), last_oid INTEGER, " +
+            "count INTEGER)")
+        self.connection.commit()
+
+        row = self.connection.execute(
+            "SELECT last_oid, count FROM checkpoint").fetchone()
+        if row is None:
+            return None, 0
+        return row
+
+    def write_rows(self, rows):
+        self.connection.executemany(
+            "INSERT INTO nearest_lines VALUES (%s)" % ", ".join(
+                "?" * len(self.fields)), rows)
+
+    def checkpoint(self):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO checkpoint VALUES (0, ?, ?)",
+            (self.last_oid, self.count))
+        self.connection.commit()
+
+    def close_sink(self):
+        self.connection.close()
+
+
+def create_writer(tgt_path, resume=False, **kwargs):
+    u"""
+    Creates writer for the specified target location, using a CSV file for
+    paths ending in '.csv' and an SQLite database otherwise.
+    """
+    if tgt_path.lower().endswith(".csv"):
+        return CSVResultWriter(tgt_path, resume, **kwargs)
+    return SQLiteResultWriter(tgt_path, resume, **kwargs)
+
+
+class ProgressReporter(object):
+    u"""
+    A reporter printing the number of processed features and the processing
+    rate at most once per specified interval.
+    """
+
+    def __init__(self, total=None, initial=0, interval=PROGRESS_INTERVAL):
+        self.total = total
+        self.initial = initial
+        self.count = initial
+        self.interval = interval
+        self.start_time = time.time()
+        self.last_report = self.start_time
+
+    def update(self, count=1):
+        u"""
+        Registers specified number of processed features and reports progress
+        if the reporting interval elapsed.
+        """
+        self.count += count
+        if time.time() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        u"""
+        Prints number of processed features and processing rate.
+        """
+        now = time.time()
+        rate = (self.count - self.initial) / max(now - self.start_time, 1e-9)
+        if self.total:
+            print("Processed %d of %d point features (%.1f%%, %.1f/s)" % (
+                self.count, self.total, 100. * self.count / self.total, rate))
+        else:
+            print("Processed %d point features (%.1f/s)" % (self.count, rate))
+        sys.stdout.flush()
+        self.last_report = now
@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Parallel retrieval of nearest line features using a spatial index that is
+built once and shared with all worker processes without copying. All arrays
+of the index are placed in a single shared memory block (or a memory-mapped
+temporary file if shared memory is not available) that workers attach to.
+Indexes opened from a line store are not copied at all, workers merely
+memory-map the store themselves.
+Point batches are pulled dynamically by the workers, with batch sizes
+decreasing along with the remaining work (guided self-scheduling), and
+results are streamed back as soon as a batch is completed.
+"""
+
+from __future__ import division, print_function
+
+import itertools
+import multiprocessing
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+import line_store
+import nearest_line
+
+# alignment (in bytes) of arrays within the shared block
+ALIGNMENT = 64
+# number of batches initially assigned per worker, subsequent batches are
+# getting smaller
+BATCHES_PER_WORKER = 4
+# minimum and maximum number of points per batch
+MIN_BATCH_SIZE = 64
+MAX_BATCH_SIZE = nearest_line.BATCH_SIZE
+
+# line index attached in each worker process
+LINE_INDEX = None
+
+
+class SharedLineIndex(object):
+    u"""
+    A copy of all arrays of a line index in a single shared memory block.
+    Worker processes attach to the block using the picklable descriptor.
+    """
+
+    def __init__(self, line_index):
+        self.shm = None
+        self.tmp_path = None
+
+        store_path = getattr(line_index, 'store_path', None)
+        if store_path is not None:
+            # workers open the store, sharing its pages with all others
+            self.descriptor = (store_path, None, line_index.capacity)
+            return
+
+        arrays = line_index.to_arrays()
+
+        # laying out arrays within the block
+        layout = list()
+        size = 0
+        for key, array in arrays.items():
+            size += -size % ALIGNMENT
+            layout.append((key, array.dtype.str, array.shape, size))
+            size += array.nbytes
+        size += ALIGNMENT
+
+        if shared_memory is not None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            buffer = self.shm.buf
+            location = self.shm.name
+        else:
+            tmp_fd, self.tmp_path = tempfile.mkstemp(suffix=".lineindex")
+            os.close(tmp_fd)
+            buffer = np.memmap(
+                self.tmp_path, dtype=np.uint8, mode='w+', shape=(size,))
+            location = self.tmp_path
+
+        for key, dtype, shape, offset in layout:
+            np.ndarray(shape, dtype, buffer, offset)[...] = arrays[key]
+        if self.tmp_path is not None:
+            buffer.flush()
+        # views on the buffer need to be released before closing the block
+        del buffer
+
+        self.descriptor = (location, layout, line_index.capacity)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        u"""
+        Releases the shared block.
+        """
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+        if self.tmp_path is not None:
+            os.remove(self.tmp_path)
+            self.tmp_path = None
+
+
+def attach_index(descriptor):
+    u"""
+    Creates line index from the shared block or the line store with the
+    specified descriptor. The returned index keeps the block attached.
+    """
+    location, layout, capacity = descriptor
+    if layout is None:
+        return line_store.open_store(location)
+    if shared_memory is not None:
+        shm = shared_memory.SharedMemory(name=location)
+        buffer = shm.buf
+    else:
+        shm = None
+        buffer = np.memmap(location, dtype=np.uint8, mode='r')
+
+    arrays = dict()
+    for key, dtype, shape, offset in layout:
+        arrays[key] = np.ndarray(shape, dtype, buffer, offset)
+
+    line_index = nearest_line.LineIndex.from_arrays(arrays, capacity)
+    # keeping a reference to prevent the block from being closed
+    line_index.shm = shm
+    return line_index
+
+
+def init_worker(descriptor):
+    u"""
+    Initializes worker process by attaching the shared line index.
+    """
+    global LINE_INDEX
+    LINE_INDEX = attach_index(descriptor)
+
+
+def process_batch(batch):
+    u"""
+    Finds nearest lines for a batch of points given as arrays of point OIDs
+    and coordinates. Returns arrays of point OIDs, line OIDs (-1 if there are
+    no lines) and distances.
+    """
+    poids, x, y = batch
+    lines, distances = LINE_INDEX.nearest_batch(x, y)
+    loids = np.where(
+        lines < 0, -1, LINE_INDEX.line_set.oids[np.maximum(lines, 0)])
+    return poids, loids, distances
+
+
+def read_point_chunk(points, size):
+    u"""
+    Reads up to the specified number of points, each of them given as point
+    OID and coordinates, from the specified iterator. Returns arrays of point
+    OIDs and coordinates.
+    """
+    poids, x, y = list(), list(), list()
+    for poid, px, py in itertools.islice(points, size):
+        poids.append(poid)
+        x.append(px)
+        y.append(py)
+    return (
+        np.array(poids, dtype=np.int64), np.array(x, dtype=np.float64),
+        np.array(y, dtype=np.float64))
+
+
+def get_adaptive_batches(
+        points, worker_cnt, min_size=MIN_BATCH_SIZE, max_size=MAX_BATCH_SIZE):
+    u"""
+    Yields successive batches of point OIDs and coordinate arrays read in
+    chunks from the specified iterable of points, each of them given as point
+    OID and coordinates. Batch sizes are proportional to the number of
+    remaining points, large batches at the beginning keep overhead low while
+    small ones at the end keep all workers busy. Points are only read as far
+    ahead as needed to determine batch sizes.
+    """
+    points = iter(points)
+    # as long as this many points remain, batches have the maximum size
+    window = worker_cnt * BATCHES_PER_WORKER * max_size
+    poids, x, y = read_point_chunk(points, window)
+    is_exhausted = len(poids) < window
+
+    while len(poids):
+        size = len(poids) // (worker_cnt * BATCHES_PER_WORKER)
+        size = min(max(size, min_size), max_size)
+        yield poids[:size], x[:size], y[:size]
+        poids, x, y = poids[size:], x[size:], y[size:]
+
+        if not is_exhausted and len(poids) < window:
+            chunk_poids, chunk_x, chunk_y = read_point_chunk(points, window)
+            is_exhausted = len(chunk_poids) < window
+            poids = np.concatenate((poids, chunk_poids))
+            x = np.concatenate((x, chunk_x))
+            y = np.concatenate((y, chunk_y))
+
+
+def find_nearest_lines_parallel(
+        points, line_index, worker_cnt=None, ordered=False):
+    u"""
+    Finds nearest lines for all specified points, each of them given as point
+    OID and coordinates, using specified number of worker processes. Points
+    are read in chunks while batches are processed. Yields tuples of point
+    OID, OID of nearest line and distance in order of completion or, if
+    specified, in order of the points.
+    """
+    if worker_cnt is None:
+        worker_cnt = multiprocessing.cpu_count()
+
+    # the pool submits batches as fast as they are generated, so the number
+    # of batches submitted but not yet consumed is limited
+    max_pending = worker_cnt * BATCHES_PER_WORKER
+    pending = threading.Semaphore(max_pending)
+    stopped = threading.Event()
+
+    def get_limited_batches():
+        for batch in get_adaptive_batches(points, worker_cnt):
+            pending.acquire()
+            if stopped.is_set():
+                return
+            yield batch
+
+    with SharedLineIndex(line_index) as shared_index:
+        pool = multiprocessing.Pool(
+            worker_cnt, init_worker, (shared_index.descriptor,))
+        try:
+            # workers pull batches dynamically in either case, ordered
+            # results are merely buffered until preceding ones are completed
+            imap = pool.imap if ordered else pool.imap_unordered
+            for batch_poids, loids, distances in imap(
+                    process_batch, get_limited_batches()):
+                pending.release()
+                for poid, loid, distance in zip(
+                        batch_poids.tolist(), loids.tolist(),
+                        distances.tolist()):
+                    if loid < 0:
+                        yield poid, None, None
+                    else:
+                        yield poid, loid, distance
+            pool.close()
+        except BaseException:
+            # releasing the generation of batches before terminating
+            stopped.set()
+            for _ in range(max_pending):
+                pending.release()
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
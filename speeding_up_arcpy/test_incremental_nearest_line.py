@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Tests of incremental maintenance of nearest line features against a full
+recompute after the same edits.
+"""
+
+from __future__ import division, print_function
+
+import unittest
+
+import numpy as np
+
+import incremental_nearest_line
+import nearest_line
+
+
+def create_lines(rng, loids):
+    return [(loid, [[tuple(vertex) for vertex in rng.uniform(
+        0, 1000, (rng.randint(2, 5), 2))]]) for loid in loids]
+
+
+def create_points(rng, poids):
+    return [(poid, x, y) for poid, (x, y) in zip(
+        poids, rng.uniform(0, 1000, (len(poids), 2)).tolist())]
+
+
+class IncrementalNearestLineTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.lines = dict(create_lines(rng, range(300)))
+        self.points = dict(
+            (poid, (x, y)) for poid, x, y in create_points(rng, range(2000)))
+        self.line_index = nearest_line.LineIndex(
+            nearest_line.LineSet.from_lines(sorted(self.lines.items())))
+        self.state = incremental_nearest_line.NearestLineState.create(
+            [(poid, x, y) for poid, (x, y) in sorted(self.points.items())],
+            self.line_index)
+
+        # moving and inserting points as well as deleting others
+        self.changed_points = create_points(
+            rng, list(range(0, 100)) + list(range(2000, 2050)))
+        self.deleted_poids = list(range(100, 150))
+        # modifying and inserting lines as well as deleting others
+        self.edited_lines = create_lines(
+            rng, list(range(0, 20)) + list(range(300, 310)))
+        self.deleted_loids = list(range(20, 40))
+
+        for poid, x, y in self.changed_points:
+            self.points[poid] = (x, y)
+        for poid in self.deleted_poids:
+            del self.points[poid]
+        self.lines.update(self.edited_lines)
+        for loid in self.deleted_loids:
+            del self.lines[loid]
+
+    def get_full_state(self):
+        return incremental_nearest_line.NearestLineState.create(
+            [(poid, x, y) for poid, (x, y) in sorted(self.points.items())],
+            nearest_line.LineIndex(nearest_line.LineSet.from_lines(
+                sorted(self.lines.items()))))
+
+    def test_update_state(self):
+        state, line_index, changed_poids, deleted_poids = (
+            incremental_nearest_line.update_state(
+                self.state, self.line_index, self.changed_points,
+                self.deleted_poids, self.edited_lines, self.deleted_loids))
+        full_state = self.get_full_state()
+
+        self.assertEqual(state.poids.tolist(), full_state.poids.tolist())
+        self.assertEqual(state.loids.tolist(), full_state.loids.tolist())
+        np.testing.assert_allclose(state.distances, full_state.distances)
+        self.assertEqual(
+            sorted(line_index.line_set.oids.tolist()), sorted(self.lines))
+        self.assertEqual(deleted_poids.tolist(), self.deleted_poids)
+        self.assertTrue(set(range(2000, 2050)) <= set(changed_poids.tolist()))
+
+    def test_affected_points(self):
+        # points keep their locations, so results change solely due to edits
+        # of lines
+        _, edited_set = incremental_nearest_line.update_line_index(
+            self.line_index, self.edited_lines, self.deleted_loids)
+        affected = incremental_nearest_line.get_affected_points(
+            self.state, edited_set, self.deleted_loids)
+
+        full_state = incremental_nearest_line.NearestLineState.create(
+            zip(self.state.poids.tolist(), self.state.x.tolist(),
+                self.state.y.tolist()),
+            nearest_line.LineIndex(nearest_line.LineSet.from_lines(
+                sorted(self.lines.items()))))
+        changed = np.flatnonzero(
+            (full_state.loids != self.state.loids) |
+            (full_state.distances != self.state.distances))
+
+        self.assertTrue(len(changed))
+        self.assertTrue(set(changed.tolist()) <= set(affected.tolist()))
+        self.assertLess(len(affected), len(self.state))
+
+
+if __name__ == '__main__':
+    unittest.main()
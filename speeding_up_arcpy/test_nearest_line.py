@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Regression tests of the nearest line engine.
+"""
+
+from __future__ import division, print_function
+
+import unittest
+
+import numpy as np
+
+import nearest_line
+
+
+class NearestBatchTest(unittest.TestCase):
+
+    def test_degenerate_box(self):
+        # lower and upper bound of the box of a vertical segment are equal,
+        # rounding must not prune the only candidate
+        line_index = nearest_line.LineIndex(nearest_line.LineSet.from_lines(
+            [(1, [[(400., 550.), (400., 600.)]])]))
+        lines, distances = line_index.nearest_batch(
+            [337.1494653354972], [544.3270571804358])
+        line, distance = line_index.nearest(
+            337.1494653354972, 544.3270571804358)
+        self.assertEqual(lines.tolist(), [0])
+        self.assertEqual(line, 0)
+        self.assertAlmostEqual(distances[0], distance)
+
+    def test_axis_aligned_segments(self):
+        rng = np.random.RandomState(0)
+        lines = list()
+        for i in range(500):
+            x, y = rng.randint(0, 1000, 2).astype(np.float64)
+            length = rng.randint(1, 50)
+            if i % 2:
+                lines.append((i, [[(x, y), (x, y + length)]]))
+            else:
+                lines.append((i, [[(x, y), (x + length, y)]]))
+        line_index = nearest_line.LineIndex(
+            nearest_line.LineSet.from_lines(lines))
+        x = rng.uniform(0, 1000, 2000)
+        y = rng.uniform(0, 1000, 2000)
+
+        lines, distances = line_index.nearest_batch(x, y)
+        self.assertTrue((lines >= 0).all())
+        for i in range(0, len(x), 20):
+            line, distance = line_index.nearest(x[i], y[i])
+            self.assertAlmostEqual(distances[i], distance)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+u"""
+Out-of-core retrieval of nearest line features. The extent of all point
+features is partitioned into a regular grid of tiles that are processed
+independently, optionally in parallel. For each tile only the points within
+and the lines intersecting the tile extended by a halo margin are loaded,
+bounding memory usage by tile size instead of dataset size. A line found
+nearer to a point than the point's distance to the border of the extended
+tile is provably the nearest one overall. All other points are escalated,
+i.e. processed again with a doubled margin reaching into the neighbouring
+tiles, until their results are exact as well.
+"""
+
+from __future__ import division, print_function
+
+import math
+import multiprocessing
+import os
+
+from collections import defaultdict, namedtuple
+
+import numpy as np
+
+import nearest_line
+
+# default margin around each tile, relative to tile size
+HALO_RATIO = 0.1
+
+# sources of point and line features, set up in each worker process
+POINT_SOURCE = None
+LINE_SOURCE = None
+
+# regular grid of tiles, defined by its origin, tile size and dimensions
+TileGrid = namedtuple('TileGrid', 'xmin ymin tile_size column_cnt row_cnt')
+
+
+class ArrayPoints(object):
+    u"""
+    A source of point features held in arrays of point OIDs and coordinates.
+    """
+
+    def __init__(self, poids, x, y):
+        self.poids = np.asarray(poids, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.extent = (
+            self.x.min(), self.y.min(), self.x.max(), self.y.max()) if len(
+                self.poids) else None
+
+    def read(self, extent):
+        u"""
+        Reads all points within the specified extent.
+        """
+        xmin, ymin, xmax, ymax = extent
+        is_within = (self.x >= xmin) & (self.x <= xmax) & (
+            self.y >= ymin) & (self.y <= ymax)
+        return zip(
+            self.poids[is_within].tolist(), self.x[is_within].tolist(),
+            self.y[is_within].tolist())
+
+
+class ArrayLines(object):
+    u"""
+    A source of line features held in a line set.
+    """
+
+    def __init__(self, line_set):
+        self.line_set = line_set
+        self.boxes = line_set.line_boxes
+        self.extent = (
+            self.boxes[:, 0].min(), self.boxes[:, 1].min(),
+            self.boxes[:, 2].max(), self.boxes[:, 3].max()) if len(
+                line_set) else None
+
+    def read(self, extent):
+        u"""
+        Reads all lines whose bounding boxes intersect the specified extent.
+        Returns a line set.
+        """
+        xmin, ymin, xmax, ymax = extent
+        return self.line_set.subset(np.flatnonzero(
+            (self.boxes[:, 0] <= xmax) & (self.boxes[:, 2] >= xmin) &
+            (self.boxes[:, 1] <= ymax) & (self.boxes[:, 3] >= ymin)))
+
+
+class FeatureClassSource(object):
+    u"""
+    A source of point or line features stored in a feature class. Features
+    are selected by location using a temporary feature layer.
+    """
+
+    def __init__(self, src):
+        import arcpy
+
+        self.src = src
+        desc = arcpy.Describe(src)
+        self.is_line = desc.shapeType == 'Polyline'
+        # keeping the spatial reference as string to remain picklable
+        self.spatial_reference = desc.spatialReference.exportToString()
+        self.extent = (
+            desc.extent.XMin, desc.extent.YMin,
+            desc.extent.XMax, desc.extent.YMax)
+
+    def read(self, extent):
+        u"""
+        Reads all features intersecting the specified extent. Returns a line
+        set for line features and a list of point OIDs and coordinates
+        otherwise.
+        """
+        import arcpy
+
+        xmin, ymin, xmax, ymax = extent
+        spatial_reference = arcpy.SpatialReference()
+        spatial_reference.loadFromString(self.spatial_reference)
+        extent_geom = arcpy.Polygon(arcpy.Array([
+            arcpy.Point(xmin, ymin), arcpy.Point(xmin, ymax),
+            arcpy.Point(xmax, ymax), arcpy.Point(xmax, ymin),
+            arcpy.Point(xmin, ymin)]), spatial_reference)
+
+        # using a layer name unique for the current process
+        lyr = arcpy.management.MakeFeatureLayer(
+            self.src, "tile_layer_%d" % os.getpid())
+        try:
+            arcpy.management.SelectLayerByLocation(
+                lyr, "INTERSECT", extent_geom)
+            if self.is_line:
+                return nearest_line.LineSet.from_lines(
+                    nearest_line.read_lines_from_feature_class(lyr))
+            return list(nearest_line.read_points_from_feature_class(lyr))
+        finally:
+            arcpy.management.Delete(lyr)
+
+
+def create_tile_grid(extent, tile_size):
+    u"""
+    Creates a grid of tiles with specified size covering the specified
+    extent.
+    """
+    xmin, ymin, xmax, ymax = extent
+    return TileGrid(
+        xmin, ymin, tile_size,
+        max(int(math.ceil((xmax - xmin) / tile_size)), 1),
+        max(int(math.ceil((ymax - ymin) / tile_size)), 1))
+
+
+def get_tile(grid, x, y):
+    u"""
+    Retrieves column and row of the tile containing the specified point.
+    Tiles contain their lower but not their upper borders, apart from the
+    last column and row of the grid.
+    """
+    column = int((x - grid.xmin) // grid.tile_size)
+    row = int((y - grid.ymin) // grid.tile_size)
+    return (
+        min(max(column, 0), grid.column_cnt - 1),
+        min(max(row, 0), grid.row_cnt - 1))
+
+
+def get_tile_extent(grid, column, row, margin=0.):
+    u"""
+    Retrieves extent of the specified tile, extended by the specified margin.
+    """
+    xmin = grid.xmin + column * grid.tile_size
+    ymin = grid.ymin + row * grid.tile_size
+    return (
+        xmin - margin, ymin - margin,
+        xmin + grid.tile_size + margin, ymin + grid.tile_size + margin)
+
+
+def init_worker(point_source, line_source):
+    u"""
+    Initializes worker process by setting up point and line sources.
+    """
+    global POINT_SOURCE, LINE_SOURCE
+    POINT_SOURCE = point_source
+    LINE_SOURCE = line_source
+
+
+def process_tile(task):
+    u"""
+    Finds nearest lines for all points of a tile using lines intersecting
+    the tile extended by the specified margin. Points are either read from
+    the point source of the worker or, for escalated points, provided with
+    the task. Returns exact results as tuples of point OID, OID of nearest
+    line and distance, and points that need to be escalated.
+    """
+    grid, column, row, margin, points, lines_extent = task
+
+    if points is None:
+        # reading points within the tile, excluding those on borders
+        # belonging to neighbouring tiles
+        points = [
+            (poid, x, y) for poid, x, y in POINT_SOURCE.read(
+                get_tile_extent(grid, column, row)) if
+            get_tile(grid, x, y) == (column, row)]
+    if not points:
+        return list(), list()
+
+    extent = get_tile_extent(grid, column, row, margin)
+    line_index = nearest_line.LineIndex(LINE_SOURCE.read(extent))
+    # once the extended tile covers all lines, results are exact anyway
+    covers_all_lines = lines_extent is None or (
+        extent[0] <= lines_extent[0] and extent[1] <= lines_extent[1] and
+        extent[2] >= lines_extent[2] and extent[3] >= lines_extent[3])
+
+    _, x, y = [np.array(values) for values in zip(*points)]
+    # querying points in batches to bound memory usage of the search
+    lines = np.empty(len(points), dtype=np.int64)
+    distances = np.empty(len(points))
+    for start in range(0, len(points), nearest_line.BATCH_SIZE):
+        end = start + nearest_line.BATCH_SIZE
+        lines[start:end], distances[start:end] = line_index.nearest_batch(
+            x[start:end], y[start:end])
+    # calculating distances to the border of the extended tile, any line
+    # not loaded is located outside of it
+    border_distances = np.minimum(
+        np.minimum(x - extent[0], extent[2] - x),
+        np.minimum(y - extent[1], extent[3] - y))
+    is_exact = (distances < border_distances) | covers_all_lines
+
+    results = list()
+    escalated = list()
+    for point, line, distance, exact in zip(
+            points, lines.tolist(), distances.tolist(), is_exact.tolist()):
+        if not exact:
+            escalated.append(point)
+        elif line < 0:
+            results.append((point[0], None, None))
+        else:
+            results.append((
+                point[0], int(line_index.line_set.oids[line]), distance))
+
+    return results, escalated
+
+
+def find_nearest_lines_tiled(
+        point_source, line_source, tile_size, halo=None, worker_cnt=None):
+    u"""
+    Finds nearest lines for all points of the specified point source using
+    tiles of specified size and an initial halo margin around each of them.
+    Tiles are processed by the specified number of worker processes, each
+    of them reading points and lines of its tiles from the sources. Yields
+    tuples of point OID, OID of nearest line and distance in order of
+    completion.
+    """
+    if point_source.extent is None:
+        return
+    if halo is None:
+        halo = tile_size * HALO_RATIO
+    if worker_cnt is None:
+        worker_cnt = multiprocessing.cpu_count()
+
+    grid = create_tile_grid(point_source.extent, tile_size)
+    tasks = [
+        (grid, column, row, halo, None, line_source.extent) for
+        column in range(grid.column_cnt) for row in range(grid.row_cnt)]
+
+    pool = None
+    if worker_cnt > 1:
+        pool = multiprocessing.Pool(
+            worker_cnt, init_worker, (point_source, line_source))
+    else:
+        init_worker(point_source, line_source)
+    try:
+        while tasks:
+            escalated = defaultdict(list)
+            if pool is None:
+                tile_results = map(process_tile, tasks)
+            else:
+                tile_results = pool.imap_unordered(process_tile, tasks)
+            for results, escalated_points in tile_results:
+                for result in results:
+                    yield result
+                for point in escalated_points:
+                    escalated[get_tile(grid, point[1], point[2])].append(
+                        point)
+
+            # processing escalated points with doubled margins
+            halo *= 2
+            tasks = [
+                (grid, column, row, halo, points, line_source.extent) for
+                (column, row), points in sorted(escalated.items())]
+        if pool is not None:
+            pool.close()
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()